@@ -0,0 +1,194 @@
+import os
+import math
+import time
+import heapq
+import asyncio
+import itertools
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Optional
+from dotenv import load_dotenv
+from app.handlers import ServiceOverloadedError, PriorityQuotaError, DeadlineExceededError
+from app.deadline import remaining
+from app.logger import log
+
+load_dotenv()
+ADMISSION_INITIAL_LIMIT = float(os.getenv("ADMISSION_INITIAL_LIMIT", "16"))
+ADMISSION_MIN_LIMIT = float(os.getenv("ADMISSION_MIN_LIMIT", "2"))
+ADMISSION_MAX_LIMIT = float(os.getenv("ADMISSION_MAX_LIMIT", "64"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "100"))
+# batch work may fill only this many queue places, so it can never crowd interactive callers out
+ADMISSION_BATCH_MAX_QUEUE = int(os.getenv("ADMISSION_BATCH_MAX_QUEUE", str(ADMISSION_MAX_QUEUE // 2)))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+ADMISSION_LATENCY_TARGET = float(os.getenv("ADMISSION_LATENCY_TARGET", "20"))
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BATCH = 2
+priority_ctx: ContextVar[int] = ContextVar("priority", default=PRIORITY_NORMAL)
+
+def is_throttle_error(exc: BaseException) -> bool:
+    while exc is not None:
+        if getattr(exc, "status_code", None) == 429 or type(exc).__name__ == "RateLimitError":
+            return True
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+class AdaptiveLimiter:
+    # AIMD: grow the limit by 1/limit per healthy call, halve it on 429s, shrink it gently on slow calls
+    def __init__(self, initial: float, min_limit: float, max_limit: float, max_queue: int,
+                 queue_timeout: float, latency_target: float, batch_max_queue: Optional[int] = None):
+        self.limit = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.batch_max_queue = max_queue if batch_max_queue is None else min(batch_max_queue, max_queue)
+        self.queue_timeout = queue_timeout
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self.avg_latency = 0.0
+        self._queue = []
+        self._seq = itertools.count()
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.over_quota = 0
+        self.throttled = 0
+        self._last_decrease = float("-inf")
+
+    def _has_capacity(self) -> bool:
+        return self.in_flight < max(1, int(self.limit))
+
+    def has_capacity(self) -> bool:
+        # true when a new call would be admitted without queueing behind anyone
+        return self._has_capacity() and not self._queue
+
+    def retry_after(self) -> int:
+        per_slot = self.avg_latency or 1.0
+        return max(1, math.ceil(per_slot * (len(self._queue) + 1) / max(1, int(self.limit))))
+
+    async def acquire(self, priority: int):
+        if self._has_capacity() and not self._queue:
+            self.in_flight += 1
+            self.admitted += 1
+            return
+        if priority >= PRIORITY_BATCH and self._queued(priority) >= self.batch_max_queue:
+            self.rejected += 1
+            self.over_quota += 1
+            raise PriorityQuotaError("Batch share of upstream capacity exhausted, please retry later.", self.retry_after())
+        if len(self._queue) >= self.max_queue:
+            self.rejected += 1
+            raise ServiceOverloadedError("Upstream capacity exhausted, please retry later.", self.retry_after())
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._seq), future)
+        heapq.heappush(self._queue, entry)
+        self.queued += 1
+        # never queue past the request deadline
+        left = remaining()
+        wait = self.queue_timeout if left is None else max(0.0, min(self.queue_timeout, left))
+        try:
+            await asyncio.wait_for(asyncio.shield(future), wait)
+        except asyncio.TimeoutError:
+            self._discard(entry)
+            if future.done() and not future.cancelled():
+                self.admitted += 1
+                return
+            future.cancel()
+            self.rejected += 1
+            if wait < self.queue_timeout:
+                raise DeadlineExceededError("Request deadline expired while waiting for upstream capacity.")
+            raise ServiceOverloadedError("Timed out waiting for upstream capacity.", self.retry_after())
+        except asyncio.CancelledError:
+            self._discard(entry)
+            if future.done() and not future.cancelled():
+                # slot was granted just as the caller went away
+                self.release()
+            else:
+                future.cancel()
+            raise
+        self.admitted += 1
+
+    def _queued(self, priority: int) -> int:
+        return sum(1 for entry in self._queue if entry[0] == priority and not entry[2].done())
+
+    def _discard(self, entry):
+        if entry in self._queue:
+            self._queue.remove(entry)
+            heapq.heapify(self._queue)
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._queue and self._has_capacity():
+            _, _, future = heapq.heappop(self._queue)
+            if future.done():
+                continue
+            self.in_flight += 1
+            future.set_result(None)
+
+    def on_throttle(self):
+        # the retry loop reports each 429 it sleeps through, so a call that eventually succeeds still backs off;
+        # the limit halves at most once per latency window, so the retries of one call, its final failure and
+        # a burst of concurrent 429s all count as the single congestion signal they are
+        self.throttled += 1
+        now = time.monotonic()
+        if now - self._last_decrease < (self.avg_latency or 1.0):
+            return
+        self._last_decrease = now
+        previous = self.limit
+        self.limit = max(self.min_limit, self.limit / 2)
+        if int(self.limit) < int(previous):
+            log.warning(f"Upstream concurrency limit lowered to {int(self.limit)} after a throttled attempt")
+
+    def record(self, latency: float, throttled: bool):
+        self.avg_latency = latency if not self.avg_latency else 0.8 * self.avg_latency + 0.2 * latency
+        if throttled:
+            self.on_throttle()
+        else:
+            previous = self.limit
+            if latency > self.latency_target:
+                self.limit = max(self.min_limit, self.limit * 0.9)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            if int(self.limit) < int(previous):
+                log.warning(f"Upstream concurrency limit lowered to {int(self.limit)} (latency={latency:.1f}s)")
+        self._wake()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire(priority_ctx.get())
+        started = time.perf_counter()
+        throttled = False
+        cancelled = False
+        try:
+            yield
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        except Exception as e:
+            throttled = is_throttle_error(e)
+            raise
+        finally:
+            if not cancelled:
+                self.record(time.perf_counter() - started, throttled)
+            self.release()
+
+    def stats(self) -> dict:
+        return {
+            "limit": round(self.limit, 2),
+            "inFlight": self.in_flight,
+            "queueDepth": len(self._queue),
+            "avgLatency": round(self.avg_latency, 3),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "overQuota": self.over_quota,
+            "throttled": self.throttled,
+        }
+
+upstream_limiter = AdaptiveLimiter(
+    ADMISSION_INITIAL_LIMIT, ADMISSION_MIN_LIMIT, ADMISSION_MAX_LIMIT,
+    ADMISSION_MAX_QUEUE, ADMISSION_QUEUE_TIMEOUT, ADMISSION_LATENCY_TARGET, ADMISSION_BATCH_MAX_QUEUE
+)
@@ -0,0 +1,114 @@
+import os
+import json
+import time
+import hashlib
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Optional
+from dotenv import load_dotenv
+from app.logger import log
+from app.shared import SharedBackend, shared_backend, KEY_PREFIX
+
+load_dotenv()
+CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "512"))
+CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", "3600"))
+CACHE_SHARED = os.getenv("LLM_CACHE_SHARED", "true").lower() == "true"
+CACHE_BYPASS_HEADER = "X-Cache-Bypass"
+
+cache_bypass_ctx: ContextVar[bool] = ContextVar("cache_bypass", default=False)
+
+def fingerprint(payload) -> str:
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def completion_key(messages, model: str, temperature: float, response_format=None) -> str:
+    payload = {"messages": messages, "model": model, "temperature": temperature}
+    if response_format:
+        payload["responseFormat"] = response_format
+    return fingerprint(payload)
+
+class MemoryTier:
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: str):
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class CompletionCache:
+    # a per-process LRU in front of the backend every worker shares
+    def __init__(self, max_entries: int, ttl: float, shared: Optional[SharedBackend] = None):
+        self.ttl = ttl
+        self.memory = MemoryTier(max_entries, ttl)
+        self.shared = shared
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    async def get(self, key: str) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        if self.shared is not None:
+            value = await self.shared.get(f"{KEY_PREFIX}llm:{key}")
+            if value is not None:
+                self.hits += 1
+                self.shared_hits += 1
+                self.memory.set(key, value)
+                return value
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: str):
+        self.memory.set(key, value)
+        if self.shared is not None:
+            await self.shared.set(f"{KEY_PREFIX}llm:{key}", value, self.ttl)
+
+    async def clear(self):
+        self.memory.clear()
+        if self.shared is not None:
+            await self.shared.clear()
+
+    async def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": CACHE_ENABLED,
+            "backend": self.shared.name if self.shared is not None else None,
+            "hits": self.hits,
+            "sharedHits": self.shared_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hitRate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "memoryEntries": len(self.memory),
+            "sharedEntries": await self.shared.size() if self.shared is not None else None,
+        }
+
+completion_cache = CompletionCache(CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS, shared_backend if CACHE_SHARED else None)
+log.info(
+    f"LLM cache initialised (enabled={CACHE_ENABLED}, memory={CACHE_MAX_ENTRIES}, "
+    f"shared={shared_backend.name if CACHE_SHARED else 'off'}, ttl={CACHE_TTL_SECONDS}s)"
+)
@@ -0,0 +1,224 @@
+import os
+import math
+import time
+import random
+import asyncio
+from contextvars import ContextVar
+from typing import Optional
+from fastapi import status
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
+from dotenv import load_dotenv
+from app.handlers import DeadlineExceededError, UpstreamUnavailableError, describe_error
+from app.metrics import record_error, record_disconnect, set_circuit_state
+from app.logger import log
+
+load_dotenv()
+DEADLINE_HEADER = "X-Request-Timeout"
+REQUEST_TIMEOUT_SECONDS = float(os.getenv("REQUEST_TIMEOUT_SECONDS", "120"))
+MAX_REQUEST_TIMEOUT_SECONDS = float(os.getenv("MAX_REQUEST_TIMEOUT_SECONDS", "600"))
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "3"))
+UPSTREAM_RETRY_BASE_DELAY = float(os.getenv("UPSTREAM_RETRY_BASE_DELAY", "0.5"))
+UPSTREAM_RETRY_MAX_DELAY = float(os.getenv("UPSTREAM_RETRY_MAX_DELAY", "8"))
+UPSTREAM_MIN_ATTEMPT_SECONDS = float(os.getenv("UPSTREAM_MIN_ATTEMPT_SECONDS", "2"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+
+deadline_ctx: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+def request_timeout(header_value: Optional[str]) -> Optional[float]:
+    timeout = REQUEST_TIMEOUT_SECONDS
+    if header_value:
+        try:
+            timeout = float(header_value)
+        except ValueError:
+            log.warning(f"Ignoring malformed {DEADLINE_HEADER} header: {header_value!r}")
+    if timeout <= 0:
+        return None
+    return min(timeout, MAX_REQUEST_TIMEOUT_SECONDS)
+
+def remaining() -> Optional[float]:
+    deadline = deadline_ctx.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+def shared_deadline() -> Optional[float]:
+    # work shared by several requests must not end with the first caller's budget, nor run unbounded:
+    # it gets the default budget, or the current caller's own deadline when that is later
+    default = time.monotonic() + REQUEST_TIMEOUT_SECONDS if REQUEST_TIMEOUT_SECONDS > 0 else None
+    current = deadline_ctx.get()
+    if default is None or current is None:
+        return default if default is not None else current
+    return max(default, current)
+
+def attempt_timeout(default: float) -> float:
+    # every attempt gets whatever is left of the request budget, never more than the client timeout
+    left = remaining()
+    if left is None:
+        return default
+    if left < UPSTREAM_MIN_ATTEMPT_SECONDS:
+        raise DeadlineExceededError(f"Request deadline leaves {max(0.0, left):.1f}s, not enough for an upstream call.")
+    return min(default, left)
+
+def status_code_of(exc: BaseException) -> Optional[int]:
+    return getattr(exc, "status_code", None)
+
+def is_retryable(exc: BaseException) -> bool:
+    code = status_code_of(exc)
+    if code is None:
+        # connection resets and timeouts carry no status
+        return type(exc).__name__ in ("APIConnectionError", "APITimeoutError") or isinstance(exc, (asyncio.TimeoutError, ConnectionError))
+    return code in (408, 409, 429) or code >= 500
+
+def is_upstream_failure(exc: BaseException) -> bool:
+    # 4xx answers prove the proxy is up; only outages and 5xx count against the breaker
+    code = status_code_of(exc)
+    return is_retryable(exc) and code != 429
+
+def retry_delay(exc: BaseException, attempt: int) -> float:
+    response = getattr(exc, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(UPSTREAM_RETRY_MAX_DELAY, float(retry_after))
+        except ValueError:
+            pass
+    # full jitter keeps retries from a burst of failures from landing together
+    return random.uniform(0, min(UPSTREAM_RETRY_MAX_DELAY, UPSTREAM_RETRY_BASE_DELAY * 2 ** attempt))
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, open_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.opened = 0
+        self.rejected = 0
+        set_circuit_state(self.state)
+
+    def _transition(self, state: str):
+        log.warning(f"Upstream circuit breaker {self.state} -> {state} (consecutive failures={self.failures})")
+        self.state = state
+        set_circuit_state(state)
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.opened_at + self.open_seconds - time.monotonic()))
+
+    def check(self):
+        # cheap enough to run before queueing for an admission slot
+        if self.state == self.OPEN and time.monotonic() - self.opened_at < self.open_seconds:
+            self.rejected += 1
+            raise UpstreamUnavailableError("LLM provider is unavailable, failing fast.", self.retry_after())
+
+    def before_call(self):
+        self.check()
+        if self.state == self.OPEN:
+            self._transition(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN:
+            # a single probe decides whether the provider is back
+            if self.probing:
+                self.rejected += 1
+                raise UpstreamUnavailableError("LLM provider is recovering, failing fast.", 1)
+            self.probing = True
+
+    def record_success(self):
+        self.failures = 0
+        self.probing = False
+        if self.state != self.CLOSED:
+            self._transition(self.CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+            self.opened += 1
+            self.opened_at = time.monotonic()
+            self._transition(self.OPEN)
+
+    def release_probe(self):
+        self.probing = False
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutiveFailures": self.failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+            "retryAfter": self.retry_after() if self.state == self.OPEN else 0,
+        }
+
+circuit_breaker = CircuitBreaker(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_OPEN_SECONDS)
+
+class DeadlineMiddleware:
+    # runs the request in its own task so a disconnect or an expired deadline can cancel upstream work
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timeout = request_timeout(Headers(scope=scope).get(DEADLINE_HEADER))
+        token = deadline_ctx.set(time.monotonic() + timeout if timeout else None)
+        body_done = asyncio.Event()
+        disconnected = asyncio.Event()
+        response_started = False
+
+        async def tracked_receive():
+            if body_done.is_set():
+                # only a disconnect can follow the body, and the watcher owns the real channel now
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+            elif not message.get("more_body", False):
+                body_done.set()
+            return message
+
+        async def tracked_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        async def watch_disconnect():
+            await body_done.wait()
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+
+        app_task = asyncio.create_task(self.app(scope, tracked_receive, tracked_send))
+        watcher = asyncio.create_task(watch_disconnect())
+        try:
+            done, _ = await asyncio.wait({app_task, watcher}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done and response_started:
+                # a stream that started in time runs to completion; its upstream calls still see the deadline
+                done, _ = await asyncio.wait({app_task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if app_task in done:
+                app_task.result()
+                return
+            app_task.cancel()
+            await asyncio.gather(app_task, return_exceptions=True)
+            if watcher in done:
+                record_disconnect()
+                log.warning("Client disconnected, cancelled in-flight work")
+            elif not response_started:
+                error = DeadlineExceededError(f"Request did not complete within {timeout:g}s.")
+                record_error("DEADLINE_EXCEEDED")
+                log.warning(f"Deadline exceeded: {error.message}")
+                response = JSONResponse(
+                    status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                    content={"status": "FAILURE", "data": None, "error": describe_error(error)}
+                )
+                await response(scope, receive, send)
+        finally:
+            watcher.cancel()
+            if not app_task.done():
+                app_task.cancel()
+            deadline_ctx.reset(token)
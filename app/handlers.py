@@ -1,17 +1,65 @@
 from fastapi import Request, status
 from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
-import json
-from starlette.concurrency import iterate_in_threadpool
-from app.logger import log
+from fastapi.encoders import jsonable_encoder
+import uuid
+from starlette.datastructures import Headers
+from app.logger import log, correlation_id_ctx
+from app.cache import cache_bypass_ctx, CACHE_BYPASS_HEADER
+from app.metrics import record_error, mark_envelope_started, stage_timer
 
 class LLMServiceError(Exception):
     def __init__(self, message: str):
         self.message = message
 
+class UpstreamUnavailableError(LLMServiceError):
+    def __init__(self, message: str, retry_after: int):
+        self.message = message
+        self.retry_after = retry_after
+
+class DeadlineExceededError(LLMServiceError):
+    def __init__(self, message: str):
+        self.message = message
+
+class ServiceOverloadedError(Exception):
+    def __init__(self, message: str, retry_after: int):
+        self.message = message
+        self.retry_after = retry_after
+
+class PriorityQuotaError(ServiceOverloadedError):
+    # the caller's own priority class is over its share; upstream itself may still have room for others
+    pass
+
+class PromptTooLargeError(Exception):
+    def __init__(self, message: str):
+        self.message = message
+
+class DiagramNotFoundError(Exception):
+    def __init__(self, message: str):
+        self.message = message
+
+def describe_error(exc: Exception) -> dict:
+    if isinstance(exc, UpstreamUnavailableError):
+        return {"message": exc.message, "code": "UPSTREAM_UNAVAILABLE", "retryAfter": exc.retry_after}
+    if isinstance(exc, DeadlineExceededError):
+        return {"message": exc.message, "code": "DEADLINE_EXCEEDED"}
+    if isinstance(exc, LLMServiceError):
+        return {"message": exc.message, "code": "LLM_PROVIDER_ERROR"}
+    if isinstance(exc, PriorityQuotaError):
+        return {"message": exc.message, "code": "PRIORITY_QUOTA_EXCEEDED", "retryAfter": exc.retry_after}
+    if isinstance(exc, ServiceOverloadedError):
+        return {"message": exc.message, "code": "SERVICE_OVERLOADED", "retryAfter": exc.retry_after}
+    if isinstance(exc, PromptTooLargeError):
+        return {"message": exc.message, "code": "PROMPT_TOO_LARGE"}
+    if isinstance(exc, DiagramNotFoundError):
+        return {"message": exc.message, "code": "DIAGRAM_NOT_FOUND"}
+    return {"message": "Internal Server Error", "code": "INTERNAL_ERROR"}
+
 async def global_exception_handler(request: Request, exc: Exception):
+    record_error("VALIDATION_ERROR" if isinstance(exc, RequestValidationError) else describe_error(exc)["code"])
     if isinstance(exc, RequestValidationError):
-        error_details = exc.errors()
+        # validator errors carry the raised exception in ctx, which is not JSON serializable
+        error_details = jsonable_encoder(exc.errors(), custom_encoder={Exception: str})
         log.error(f"Validation Error occurred: {error_details}")
         return JSONResponse(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -25,6 +73,27 @@ async def global_exception_handler(request: Request, exc: Exception):
                 }
             }
         )
+    if isinstance(exc, UpstreamUnavailableError):
+        log.warning(f"Failing fast, upstream unavailable: {exc.message}")
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": str(exc.retry_after)},
+            content={
+                "status": "FAILURE",
+                "data": None,
+                "error": describe_error(exc)
+            }
+        )
+    if isinstance(exc, DeadlineExceededError):
+        log.warning(f"Deadline exceeded: {exc.message}")
+        return JSONResponse(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            content={
+                "status": "FAILURE",
+                "data": None,
+                "error": describe_error(exc)
+            }
+        )
     if isinstance(exc, LLMServiceError):
         log.error(f"LLM Service Error: {exc.message}")
         return JSONResponse(
@@ -35,6 +104,38 @@ async def global_exception_handler(request: Request, exc: Exception):
                 "error": {"message": exc.message, "code": "LLM_PROVIDER_ERROR"}
             }
         )
+    if isinstance(exc, PromptTooLargeError):
+        log.error(f"Prompt budget exceeded: {exc.message}")
+        return JSONResponse(
+            status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+            content={
+                "status": "FAILURE",
+                "data": None,
+                "error": describe_error(exc)
+            }
+        )
+    if isinstance(exc, DiagramNotFoundError):
+        log.warning(f"Diagram lookup failed: {exc.message}")
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={
+                "status": "FAILURE",
+                "data": None,
+                "error": describe_error(exc)
+            }
+        )
+    if isinstance(exc, ServiceOverloadedError):
+        log.warning(f"Request shed: {exc.message}")
+        return JSONResponse(
+            # 429 tells the caller to slow down itself; 503 means upstream capacity is gone for everyone
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS if isinstance(exc, PriorityQuotaError) else status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": str(exc.retry_after)},
+            content={
+                "status": "FAILURE",
+                "data": None,
+                "error": describe_error(exc)
+            }
+        )
     log.exception(f"Unhandled Exception: {str(exc)}")
     return JSONResponse(
         status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -45,21 +146,42 @@ async def global_exception_handler(request: Request, exc: Exception):
         }
     )
 
-async def global_response_middleware(request: Request, call_next):
-    response = await call_next(request)
-    if response.status_code == 200 and "application/json" in response.headers.get("content-type", ""):
-        response_body = [section async for section in response.body_iterator]
-        response.body_iterator = iterate_in_threadpool(iter(response_body))  
+class EnvelopeJSONResponse(JSONResponse):
+    # wraps successful payloads while rendering, so the body is serialized exactly once
+    def render(self, content) -> bytes:
+        mark_envelope_started()
+        with stage_timer("envelope"):
+            if self.status_code == 200 and not (isinstance(content, dict) and "status" in content):
+                content = {
+                    "status": "SUCCESS",
+                    "data": content,
+                    "error": None
+                }
+            return super().render(content)
+
+class CorrelationIdMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        corr_id = headers.get("X-Correlation-ID") or str(uuid.uuid4())
+        bypass = headers.get(CACHE_BYPASS_HEADER, "").lower() in ("1", "true", "yes")
+        scope.setdefault("state", {})["correlation_id"] = corr_id
+        token = correlation_id_ctx.set(corr_id)
+        bypass_token = cache_bypass_ctx.set(bypass)
+
+        async def send_with_correlation_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-correlation-id", corr_id.encode("latin-1"))]
+            await send(message)
+
         try:
-            body_json = json.loads(response_body[0].decode())
-            if isinstance(body_json, dict) and "status" in body_json:
-                return response
-            wrapped_content = {
-                "status": "SUCCESS",
-                "data": body_json,
-                "error": None
-            }
-            return JSONResponse(content=wrapped_content, status_code=200)
-        except :
-            pass
-    return response
\ No newline at end of file
+            await self.app(scope, receive, send_with_correlation_id)
+        finally:
+            correlation_id_ctx.reset(token)
+            cache_bypass_ctx.reset(bypass_token)
@@ -1,54 +1,403 @@
 import os
+import time
 import httpx
+import asyncio
 import logging
+import importlib.util
+from typing import List, Optional
 from openai import AsyncAzureOpenAI
 from dotenv import load_dotenv
-from app.handlers import LLMServiceError
+from app.handlers import LLMServiceError, PromptTooLargeError, DeadlineExceededError
 from app.logger import log
+from app.cache import completion_cache, completion_key, cache_bypass_ctx, CACHE_ENABLED
+from app.admission import upstream_limiter, is_throttle_error
+from app.services.tokens import count_message_tokens, prompt_stats
+from app.metrics import (count_upstream_attempt, start_upstream_attempts, record_upstream_call, observe_usage,
+    record_stage, stage_timer, record_hedge)
+from app.routing import Route, model_router
+from app.shared import shared_lock, SHARED_LOCK_WAIT
+from app.deadline import (circuit_breaker, attempt_timeout, remaining, is_retryable, is_upstream_failure, retry_delay,
+    UPSTREAM_MAX_RETRIES, UPSTREAM_MIN_ATTEMPT_SECONDS)
 
 load_dotenv()
-AZURE_ENDPOINT = 'https://api.kadal.ai/proxy/api/v1/azure'
+AZURE_ENDPOINT = os.getenv("LLM_ENDPOINT", 'https://api.kadal.ai/proxy/api/v1/azure')
 LM_KEY = os.getenv("LLM_API_KEY")
-API_VERSION = "2024-02-15-preview"
+API_VERSION = os.getenv("LLM_API_VERSION", "2024-02-15-preview")
+# Azure OpenAI accepts response_format json_schema (structured outputs) from this API version on
+STRUCTURED_OUTPUTS_API_VERSION = "2024-08-01-preview"
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false").lower() == "true"
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+HTTP_VERIFY_SSL = os.getenv("HTTP_VERIFY_SSL", "false").lower() == "true"
+HTTP_WARMUP_CONNECTIONS = int(os.getenv("HTTP_WARMUP_CONNECTIONS", "2"))
+MAX_PROMPT_TOKENS = int(os.getenv("MAX_PROMPT_TOKENS", "0"))
 
 if not LM_KEY:
     raise RuntimeError("LLM_API_KEY is missing from environment variables (.env)")
 
-client = AsyncAzureOpenAI(
-    azure_endpoint=AZURE_ENDPOINT,
-    api_version=API_VERSION,
-    api_key=LM_KEY,
-    timeout=30.0,
-    max_retries=3,
-    http_client=httpx.AsyncClient(verify=False) 
-)
+class CountingTransport(httpx.AsyncBaseTransport):
+    # counts requests waiting on the pool or the provider through public httpx API only
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self.transport = transport
+        self.in_flight = 0
+        self.sent = 0
 
-async def get_chat_completion(messages, correlation_id: str, model="gpt-4o-mini", temperature=0.7):
-    log.info(
-        f"Requesting completion from model {model}", 
-        extra={'correlation_id': correlation_id}
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.in_flight += 1
+        self.sent += 1
+        try:
+            return await self.transport.handle_async_request(request)
+        finally:
+            self.in_flight -= 1
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+client: Optional[AsyncAzureOpenAI] = None
+http_client: Optional[httpx.AsyncClient] = None
+transport: Optional[CountingTransport] = None
+
+def _http2_available() -> bool:
+    if not HTTP2_ENABLED:
+        return False
+    if importlib.util.find_spec("h2") is None:
+        log.warning("HTTP2_ENABLED is set but the 'h2' package is not installed; falling back to HTTP/1.1")
+        return False
+    return True
+
+def get_client() -> AsyncAzureOpenAI:
+    global client, http_client, transport
+    if client is None:
+        transport = CountingTransport(httpx.AsyncHTTPTransport(
+            verify=HTTP_VERIFY_SSL,
+            http2=_http2_available(),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+            )
+        ))
+        http_client = httpx.AsyncClient(
+            transport=transport,
+            timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            event_hooks={"request": [count_upstream_attempt]}
+        )
+        client = AsyncAzureOpenAI(
+            azure_endpoint=AZURE_ENDPOINT,
+            api_version=API_VERSION,
+            api_key=LM_KEY,
+            timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            # retries are ours, so they can respect the request deadline and the circuit breaker
+            max_retries=0,
+            http_client=http_client
+        )
+    return client
+
+async def start_client():
+    get_client()
+    if HTTP_WARMUP_CONNECTIONS <= 0:
+        return
+    # concurrent requests force separate connections, so each one pays its TLS handshake now
+    results = await asyncio.gather(
+        *[http_client.head(AZURE_ENDPOINT, timeout=HTTP_CONNECT_TIMEOUT) for _ in range(HTTP_WARMUP_CONNECTIONS)],
+        return_exceptions=True
     )
+    failures = [r for r in results if isinstance(r, Exception)]
+    if failures:
+        log.warning(f"Upstream warm-up failed for {len(failures)}/{len(results)} connections: {failures[0]}")
+    log.info(f"Upstream connection pool warmed: {pool_stats()}")
+
+async def close_client():
+    global client, http_client, transport
+    if client is not None:
+        await client.close()
+    client = None
+    http_client = None
+    transport = None
+
+def _connection_counts(pool) -> dict:
+    # connection state is only exposed by httpcore internals; a release that moves them reports "unavailable"
     try:
-        response = await client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=temperature
-        )
+        connections = list(pool.connections)
+        idle = sum(1 for conn in connections if conn.is_idle())
+    except Exception:
+        return {"connections": "unavailable", "idle": "unavailable", "active": "unavailable"}
+    return {"connections": len(connections), "idle": idle, "active": len(connections) - idle}
+
+def pool_stats() -> dict:
+    stats = {
+        "maxConnections": HTTP_MAX_CONNECTIONS,
+        "maxKeepaliveConnections": HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        "keepaliveExpiry": HTTP_KEEPALIVE_EXPIRY,
+        "http2": _http2_available(),
+    }
+    if transport is None:
+        return {**stats, "started": False}
+    return {
+        **stats,
+        "started": True,
+        **_connection_counts(getattr(transport.transport, "_pool", None)),
+        # sent and not yet answered, whether still queued for a connection or waiting on the provider
+        "inFlightRequests": transport.in_flight,
+        "requestsSent": transport.sent,
+    }
+
+def check_prompt_budget(messages, correlation_id: str) -> int:
+    prompt_tokens = count_message_tokens(messages)
+    prompt_stats.record(prompt_tokens)
+    log.info(f"Prompt size: {prompt_tokens} tokens", extra={'correlation_id': correlation_id})
+    if MAX_PROMPT_TOKENS and prompt_tokens > MAX_PROMPT_TOKENS:
+        prompt_stats.rejected += 1
+        raise PromptTooLargeError(f"Prompt has {prompt_tokens} tokens, above the {MAX_PROMPT_TOKENS} token budget.")
+    return prompt_tokens
+
+def supports_structured_outputs() -> bool:
+    # versions are dated, so the date prefix orders them
+    return API_VERSION[:10] >= STRUCTURED_OUTPUTS_API_VERSION[:10]
+
+def upstream_options(response_format) -> dict:
+    return {"response_format": response_format} if response_format else {}
+
+def record_usage(usage, model: str) -> int:
+    # prompt_tokens_details is only reported by API versions that support prompt caching
+    if usage is None:
+        return 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None) or 0
+    prompt_tokens = getattr(usage, "prompt_tokens", None) or 0
+    prompt_stats.record_usage(prompt_tokens, cached_tokens)
+    observe_usage(model, prompt_tokens, getattr(usage, "completion_tokens", None) or 0, cached_tokens)
+    return cached_tokens
+
+def resolve_route(messages, operation: str, model: Optional[str]) -> Route:
+    if model is not None:
+        return Route(operation, [model])
+    # token counting is only paid for when a route is bounded by prompt size
+    prompt_tokens = count_message_tokens(messages) if model_router.needs_prompt_size(operation) else None
+    return model_router.route(operation, prompt_tokens)
+
+async def create_with_retries(create, correlation_id: str):
+    attempt = 0
+    while True:
+        timeout = attempt_timeout(HTTP_READ_TIMEOUT)
+        circuit_breaker.before_call()
+        try:
+            result = await create(httpx.Timeout(timeout, connect=min(HTTP_CONNECT_TIMEOUT, timeout)))
+        except asyncio.CancelledError:
+            circuit_breaker.release_probe()
+            raise
+        except Exception as e:
+            if is_upstream_failure(e):
+                circuit_breaker.record_failure()
+            else:
+                circuit_breaker.record_success()
+            if not is_retryable(e) or attempt >= UPSTREAM_MAX_RETRIES:
+                log.error(
+                    f"Kadal API Error after {attempt + 1} attempt(s): {str(e)}", 
+                    extra={'correlation_id': correlation_id}
+                )
+                raise LLMServiceError(f"Kadal API Error: {str(e)}")
+            delay = retry_delay(e, attempt)
+            left = remaining()
+            if left is not None and left - delay < UPSTREAM_MIN_ATTEMPT_SECONDS:
+                log.error(
+                    f"Kadal API Error with no deadline left for a retry after {attempt + 1} attempt(s): {str(e)}", 
+                    extra={'correlation_id': correlation_id}
+                )
+                raise DeadlineExceededError(f"Request deadline exhausted after {attempt + 1} upstream attempt(s).")
+            if is_throttle_error(e):
+                upstream_limiter.on_throttle()
+            attempt += 1
+            log.warning(
+                f"Upstream attempt {attempt} failed ({str(e)}), retrying in {delay:.2f}s"
+                + (f" with {left:.1f}s of budget left" if left is not None else ""), 
+                extra={'correlation_id': correlation_id}
+            )
+            await asyncio.sleep(delay)
+            continue
+        circuit_breaker.record_success()
+        return result
+
+async def _complete(messages, correlation_id: str, model: str, temperature: float, response_format, operation: str) -> str:
+    circuit_breaker.check()
+    queued = time.perf_counter()
+    async with upstream_limiter.slot():
+        record_stage("queue", time.perf_counter() - queued)
+        attempts = start_upstream_attempts()
+        started = time.perf_counter()
+        try:
+            with stage_timer("upstream_wait"):
+                response = await create_with_retries(lambda timeout: get_client().chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    timeout=timeout,
+                    **upstream_options(response_format)
+                ), correlation_id)
+        except LLMServiceError:
+            record_upstream_call(model, attempts, "error", operation)
+            raise
         content = response.choices[0].message.content
         if not content:
+            record_upstream_call(model, attempts, "error", operation)
             log.error(
                 "LLM returned empty content", 
                 extra={'correlation_id': correlation_id}
             )
             raise LLMServiceError("LLM returned an empty response.")
+        usage = getattr(response, "usage", None)
+        cached_tokens = record_usage(usage, model)
         log.info(
-            "LLM response successfully received", 
+            f"LLM response successfully received from {model} (prompt_tokens={getattr(usage, 'prompt_tokens', None)}, "
+            f"cached_tokens={cached_tokens}, completion_tokens={getattr(usage, 'completion_tokens', None)})", 
             extra={'correlation_id': correlation_id}
         )
-        return content
-    except Exception as e:
+        elapsed = time.perf_counter() - started
+        model_router.record(operation, model, elapsed)
+        record_upstream_call(model, attempts, "success", operation, elapsed)
+    return content
+
+async def _hedged_complete(messages, correlation_id: str, models: List[str], temperature: float, response_format, operation: str) -> str:
+    model_router.calls += 1
+    primary_model = models[0]
+    primary = asyncio.create_task(_complete(messages, correlation_id, primary_model, temperature, response_format, operation))
+    delay = model_router.hedge_delay(operation, primary_model)
+    if delay is None:
+        return await primary
+    tasks = {primary}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done or not model_router.allow_hedge() or not upstream_limiter.has_capacity():
+            return await primary
+        # the backup goes to the next fastest deployment when the route has one
+        hedge_model = models[1] if len(models) > 1 else primary_model
+        hedge = asyncio.create_task(_complete(messages, correlation_id, hedge_model, temperature, response_format, operation))
+        tasks.add(hedge)
+        model_router.hedged += 1
+        record_hedge(operation, hedge_model, "launched")
+        log.info(f"Hedging {operation} call to {hedge_model} after {delay:.2f}s", extra={'correlation_id': correlation_id})
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge:
+                        model_router.hedges_won += 1
+                        record_hedge(operation, hedge_model, "won")
+                    return task.result()
+        # both attempts failed: surface the primary's error
+        return primary.result()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+async def get_chat_completion(messages, correlation_id: str, model: Optional[str] = None, temperature=0.7, response_format=None, operation: str = "completion"):
+    route = resolve_route(messages, operation, model)
+    log.info(
+        f"Requesting {operation} completion via route {route.name}", 
+        extra={'correlation_id': correlation_id}
+    )
+    use_cache = CACHE_ENABLED and not cache_bypass_ctx.get()
+    # keyed on the route rather than the deployment that answered, so hedging and re-ranking keep hits
+    cache_key = completion_key(messages, route.name, temperature, response_format)
+    if not use_cache:
+        if CACHE_ENABLED:
+            completion_cache.bypassed += 1
+        return await _complete_and_cache(messages, correlation_id, route, cache_key, temperature, response_format, operation)
+    cached = await completion_cache.get(cache_key)
+    if cached is not None:
+        log.info("LLM cache hit", extra={'correlation_id': correlation_id})
+        return cached
+    # one worker on the box calls the provider for a prompt; the others wait and read its answer from the shared cache
+    left = remaining()
+    async with shared_lock(cache_key, SHARED_LOCK_WAIT if left is None else max(0.0, min(SHARED_LOCK_WAIT, left))) as waited:
+        if waited:
+            cached = await completion_cache.get(cache_key)
+            if cached is not None:
+                log.info("LLM cache hit after waiting on another worker", extra={'correlation_id': correlation_id})
+                return cached
+        return await _complete_and_cache(messages, correlation_id, route, cache_key, temperature, response_format, operation)
+
+async def _complete_and_cache(messages, correlation_id: str, route: Route, cache_key: str, temperature: float, response_format, operation: str) -> str:
+    check_prompt_budget(messages, correlation_id)
+    content = await _hedged_complete(messages, correlation_id, model_router.rank(route, operation), temperature, response_format, operation)
+    if CACHE_ENABLED:
+        await completion_cache.set(cache_key, content)
+    return content
+
+async def stream_chat_completion(messages, correlation_id: str, model: Optional[str] = None, temperature=0.7, response_format=None, operation: str = "completion"):
+    route = resolve_route(messages, operation, model)
+    log.info(
+        f"Requesting streamed {operation} completion via route {route.name}", 
+        extra={'correlation_id': correlation_id}
+    )
+    use_cache = CACHE_ENABLED and not cache_bypass_ctx.get()
+    cache_key = completion_key(messages, route.name, temperature, response_format)
+    if use_cache:
+        cached = await completion_cache.get(cache_key)
+        if cached is not None:
+            log.info("LLM cache hit", extra={'correlation_id': correlation_id})
+            yield cached
+            return
+    elif CACHE_ENABLED:
+        completion_cache.bypassed += 1
+    check_prompt_budget(messages, correlation_id)
+    # tokens are already flowing to the client, so streams are routed but never hedged
+    model = model_router.rank(route, operation)[0]
+    parts = []
+    circuit_breaker.check()
+    queued = time.perf_counter()
+    async with upstream_limiter.slot():
+        record_stage("queue", time.perf_counter() - queued)
+        attempts = start_upstream_attempts()
+        started = time.perf_counter()
+        try:
+            # spans the whole stream: tokens arrive at the provider's pace
+            with stage_timer("upstream_wait"):
+                # only opening the stream is retried; once tokens were sent a retry would duplicate them
+                stream = await create_with_retries(lambda timeout: get_client().chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    stream=True,
+                    timeout=timeout,
+                    **upstream_options(response_format)
+                ), correlation_id)
+                async with stream:
+                    async for chunk in stream:
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            parts.append(delta)
+                            yield delta
+        except LLMServiceError:
+            record_upstream_call(model, attempts, "error", operation)
+            raise
+        except Exception as e:
+            record_upstream_call(model, attempts, "error", operation)
+            log.error(
+                f"Kadal API Error: {str(e)}", 
+                extra={'correlation_id': correlation_id}
+            )
+            raise LLMServiceError(f"Kadal API Error: {str(e)}")
+        elapsed = time.perf_counter() - started
+        model_router.record(operation, model, elapsed)
+        record_upstream_call(model, attempts, "success", operation, elapsed)
+    content = "".join(parts)
+    if not content:
         log.error(
-            f"Kadal API Error: {str(e)}", 
+            "LLM returned empty content", 
             extra={'correlation_id': correlation_id}
         )
-        raise LLMServiceError(f"Kadal API Error: {str(e)}")
\ No newline at end of file
+        raise LLMServiceError("LLM returned an empty response.")
+    log.info(
+        "LLM stream successfully completed", 
+        extra={'correlation_id': correlation_id}
+    )
+    if CACHE_ENABLED:
+        await completion_cache.set(cache_key, content)
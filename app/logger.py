@@ -1,39 +1,118 @@
 import logging
 import sys
 import os
-from logging.handlers import RotatingFileHandler
+import queue
+import atexit
+import zlib
+import copy
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from pythonjsonlogger import jsonlogger
 from contextvars import ContextVar
 
 correlation_id_ctx: ContextVar[str] = ContextVar("correlation_id", default="system")
 
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOG_DIR = os.path.join(BASE_DIR, "logs")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_SINKS = {sink.strip().lower() for sink in os.getenv("LOG_SINKS", "file,console").split(",") if sink.strip()}
+LOG_FILE = os.getenv("LOG_FILE", os.path.join(LOG_DIR, "archie.log"))
+LOG_FILE_MAX_BYTES = int(os.getenv("LOG_FILE_MAX_BYTES", str(5 * 1024 * 1024)))
+LOG_FILE_BACKUPS = int(os.getenv("LOG_FILE_BACKUPS", "5"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_INFO_SAMPLE_RATE = float(os.getenv("LOG_INFO_SAMPLE_RATE", "1.0"))
+
 class CorrelationIdFilter(logging.Filter):
     def filter(self, record):
         record.correlation_id = correlation_id_ctx.get()
         return True
-    
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-LOG_DIR = os.path.join(BASE_DIR, "logs")
-if not os.path.exists(LOG_DIR):
-    os.makedirs(LOG_DIR)
 
-def get_logger(name: str):
-    logger = logging.getLogger(name)
-    if not logger.handlers:
-        log_file = os.path.join(LOG_DIR, "archie.log")
-        file_handler = RotatingFileHandler(log_file, maxBytes=5*1024*1024, backupCount=5)
+class InfoSamplingFilter(logging.Filter):
+    # keeps or drops every INFO line of a request together, so a sampled request is still readable end to end
+    def __init__(self, rate: float):
+        super().__init__()
+        self.threshold = int(max(0.0, min(1.0, rate)) * 10000)
+
+    def filter(self, record):
+        if record.levelno != logging.INFO or self.threshold >= 10000:
+            return True
+        correlation_id = getattr(record, "correlation_id", "system")
+        if correlation_id == "system":
+            return True
+        return zlib.crc32(correlation_id.encode()) % 10000 < self.threshold
+
+class NonBlockingQueueHandler(QueueHandler):
+    # a full queue drops the record instead of stalling the event loop behind a slow sink
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self.exc_formatter = logging.Formatter()
+
+    def prepare(self, record):
+        # resolve args and the traceback now, but leave the layout to each sink's own formatter
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self.exc_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def _sinks() -> list:
+    handlers = []
+    if "file" in LOG_SINKS:
+        os.makedirs(os.path.dirname(LOG_FILE) or ".", exist_ok=True)
+        file_handler = RotatingFileHandler(LOG_FILE, maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUPS)
         json_formatter = jsonlogger.JsonFormatter('%(asctime)s %(levelname)s %(name)s %(message)s %(correlation_id)s')
         file_handler.setFormatter(json_formatter)
+        handlers.append(file_handler)
+    if "console" in LOG_SINKS:
         console_handler = logging.StreamHandler(sys.stdout)
         pretty_formatter = logging.Formatter(
             fmt='%(asctime)s | %(levelname)-8s | %(correlation_id)s | %(message)s',
             datefmt='%Y-%m-%d %H:%M:%S'
         )
         console_handler.setFormatter(pretty_formatter)
-        logger.addHandler(file_handler)
-        logger.addHandler(console_handler)
+        handlers.append(console_handler)
+    return handlers
+
+_listener = None
+
+def stop_logging():
+    # flushes whatever is still queued; safe to call more than once
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def get_logger(name: str):
+    global _listener
+    logger = logging.getLogger(name)
+    if not logger.handlers:
+        # formatting, disk writes and rotation run on the listener thread, never on the event loop
+        log_queue = queue.Queue(LOG_QUEUE_SIZE)
+        logger.addHandler(NonBlockingQueueHandler(log_queue))
         logger.addFilter(CorrelationIdFilter())
-        logger.setLevel(logging.INFO)
+        logger.addFilter(InfoSamplingFilter(LOG_INFO_SAMPLE_RATE))
+        logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+        _listener = QueueListener(log_queue, *_sinks(), respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
     return logger
 
-log = get_logger("archie-ai")
\ No newline at end of file
+def logging_stats() -> dict:
+    handler = next((h for h in log.handlers if isinstance(h, NonBlockingQueueHandler)), None)
+    return {
+        "level": logging.getLevelName(log.level),
+        "sinks": sorted(LOG_SINKS),
+        "queued": handler.queue.qsize() if handler else 0,
+        "dropped": handler.dropped if handler else 0,
+        "infoSampleRate": LOG_INFO_SAMPLE_RATE,
+    }
+
+log = get_logger("archie-ai")
@@ -1,121 +1,159 @@
-import uuid
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, Body
+from fastapi.responses import PlainTextResponse
 from app.model import *
-from app.services.generate import generate_diagram, generate_derived_artifact
-from app.handlers import global_exception_handler, global_response_middleware
+from app.services.generate import (run_generation, run_batch_generation, prepare_generation_stream, prepare_refine_stream,
+    run_refinement, open_diagram_session, get_diagram_version, run_incremental_generation)
+from app.handlers import (global_exception_handler, EnvelopeJSONResponse, CorrelationIdMiddleware,
+    LLMServiceError, ServiceOverloadedError, PromptTooLargeError, DiagramNotFoundError, UpstreamUnavailableError, DeadlineExceededError)
 from fastapi.exceptions import RequestValidationError
-from app.services.extract import extract_project_structure
-from app.logger import correlation_id_ctx, log
-from app.services.generate import refine_diagram, refine_derived_artifact
+from app.services.extract import extract_project_structure, extract_structure_events
+from app.logger import log, logging_stats
+from app.cache import completion_cache
+from app.shared import shared_backend, lock_stats
+from app.kadalClient import start_client, close_client, pool_stats
+from app.admission import upstream_limiter, priority_ctx, PRIORITY_INTERACTIVE, PRIORITY_BATCH
+from app.services.tokens import prompt_stats
+from app.singleflight import SingleFlight
+from app.streaming import completion_events, event_stream_response, sse_event
+from app.sessions import diagram_store
+from app.services.lint import lint_stats
+from app.routing import model_router
+from app.similarity import similarity_cache, similarity_threshold, RequestFingerprint, SIMILARITY_HEADER
+from app.deadline import DeadlineMiddleware, circuit_breaker
+from app.metrics import MetricsMiddleware, label_request, render_metrics, CONTENT_TYPE
 
-app = FastAPI(title="Archie AI Service", openapi_version="3.0.2")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await start_client()
+    yield
+    await close_client()
+    await shared_backend.close()
+
+app = FastAPI(title="Archie AI Service", openapi_version="3.0.2", default_response_class=EnvelopeJSONResponse, lifespan=lifespan)
+# innermost, so the correlation id and metrics contexts are already set when it copies them into the request task
+app.add_middleware(DeadlineMiddleware)
+app.add_middleware(CorrelationIdMiddleware)
+# added last so it wraps everything, including the correlation id middleware
+app.add_middleware(MetricsMiddleware)
 app.add_exception_handler(Exception, global_exception_handler)
 app.add_exception_handler(RequestValidationError, global_exception_handler)
-
-@app.middleware("http")
-async def correlation_id_middleware(request: Request, call_next):
-    corr_id = request.headers.get("X-Correlation-ID", str(uuid.uuid4()))
-    token = correlation_id_ctx.set(corr_id)
-    try:
-        request.state.correlation_id = corr_id
-        response = await call_next(request)
-        response.headers["X-Correlation-ID"] = corr_id
-        return response
-    finally:
-        correlation_id_ctx.reset(token)
-
-@app.middleware("http")
-async def wrap_response(request: Request, call_next):
-    return await global_response_middleware(request, call_next)
+app.add_exception_handler(LLMServiceError, global_exception_handler)
+app.add_exception_handler(ServiceOverloadedError, global_exception_handler)
+app.add_exception_handler(PromptTooLargeError, global_exception_handler)
+app.add_exception_handler(DiagramNotFoundError, global_exception_handler)
+app.add_exception_handler(UpstreamUnavailableError, global_exception_handler)
+app.add_exception_handler(DeadlineExceededError, global_exception_handler)
+generation_flight = SingleFlight("generate")
 
 @app.post("/generate")
 async def generate(request: Request, gen_req: GenerateRequest = Body(...)):
+    label_request(gen_req.diagramType, gen_req.codeType)
     c_id = request.state.correlation_id
-    diagramType = gen_req.diagramType
-    if diagramType == DiagramType.DATABASE:
-        uml_context = await generate_diagram(
-            "ERD",
-            gen_req.requirementsText,
-            "PLANTUML",
-            gen_req.classes,
-            flag=True,
-            correlation_id=c_id
-        )
-        final_output = await generate_derived_artifact(
-            "DATABASE",
-            gen_req.requirementsText,
-            uml_context,
-            gen_req.classes,
-            correlation_id=c_id
-        )
-        return {
-            "diagramType": diagramType,
-            "codeType": "SQL/NoSQL",
-            "diagramCode": final_output,
-            "isRenderable": False,
-            "correlation_id": c_id
-        }
-    if diagramType == DiagramType.API:
-        final_output = await generate_derived_artifact(
-            "API",
-            gen_req.requirementsText,
-            "",  
-            gen_req.classes,
-            correlation_id=c_id
-        )
-        return {
-            "diagramType": diagramType,
-            "codeType": "OPENAPI",
-            "diagramCode": final_output,
-            "isRenderable": False,
-            "correlation_id": c_id
-        }
-    diagram_code = await generate_diagram(
-        diagramType.value,
-        gen_req.requirementsText,
-        gen_req.codeType,
-        gen_req.classes,
-        flag=False,
-        correlation_id=c_id
-    )
-    return {
-        "diagramType": diagramType,
-        "codeType": gen_req.codeType,
-        "diagramCode": diagram_code,
-        "isRenderable": True,
-        "correlation_id": c_id
-    }
+    if gen_req.diagramId is not None:
+        # regenerating into an existing diagram applies the class model delta to its latest version
+        result = await run_incremental_generation(gen_req, c_id)
+        return {**result, "correlation_id": c_id}
+    request_fp = RequestFingerprint(gen_req)
+    threshold = similarity_threshold(request.headers.get(SIMILARITY_HEADER))
+    match = similarity_cache.lookup(request_fp, threshold)
+    if match is not None:
+        cached, score = match
+        log.info(f"Similarity cache hit (score={score}, threshold={threshold})", extra={'correlation_id': c_id})
+        # the score lets clients decide the match was not close enough and resend with a stricter threshold
+        result = {**cached, "cacheMatch": {"source": "exact" if score == 1.0 else "similar", "score": score}}
+    else:
+        result = await generation_flight.do(request_fp.key, lambda: run_generation(gen_req, c_id))
+        similarity_cache.store(request_fp, result)
+    session = await open_diagram_session(result, gen_req)
+    return {**result, **session, "correlation_id": c_id}
 
-@app.post("/extract", response_model=ProjectResponse)
+@app.post("/generate/stream")
+async def generate_stream(request: Request, gen_req: GenerateRequest = Body(...)):
+    label_request(gen_req.diagramType, gen_req.codeType)
+    c_id = request.state.correlation_id
+    messages, meta = await prepare_generation_stream(gen_req, c_id)
+    return event_stream_response(completion_events(messages, meta, c_id))
+
+@app.post("/generate/batch")
+async def generate_batch(request: Request, batch_req: BatchGenerateRequest = Body(...)):
+    label_request()
+    c_id = request.state.correlation_id
+    priority_ctx.set(PRIORITY_BATCH)
+    results = [result async for result in run_batch_generation(batch_req, c_id)]
+    results.sort(key=lambda r: r["index"])
+    return {"results": results, "correlation_id": c_id}
+
+@app.post("/generate/batch/stream")
+async def generate_batch_stream(request: Request, batch_req: BatchGenerateRequest = Body(...)):
+    label_request()
+    c_id = request.state.correlation_id
+    priority_ctx.set(PRIORITY_BATCH)
+
+    async def events():
+        async for result in run_batch_generation(batch_req, c_id):
+            yield sse_event("result", result)
+        yield sse_event("done", {"correlation_id": c_id})
+    return event_stream_response(events())
+
+# response_model routes skip default_response_class, so the envelope is set explicitly
+@app.post("/extract", response_model=ExtractionResponse, response_class=EnvelopeJSONResponse)
 async def extract_structure(request: Request, ext_req: ExtractionRequest = Body(...)):
+    label_request()
     c_id = request.state.correlation_id
     log.info(f"Extracting structure for project: {ext_req.projectName}", extra={'correlation_id': c_id})
     structured_data = await extract_project_structure(
         ext_req.requirementsText, 
         ext_req.projectName,
-        correlation_id=c_id
+        correlation_id=c_id,
+        mode=ext_req.mode
     )
     return structured_data
 
+@app.post("/extract/stream")
+async def extract_structure_stream(request: Request, ext_req: ExtractionRequest = Body(...)):
+    label_request()
+    c_id = request.state.correlation_id
+    log.info(f"Streaming structure extraction for project: {ext_req.projectName}", extra={'correlation_id': c_id})
+    return event_stream_response(extract_structure_events(ext_req.requirementsText, ext_req.projectName, c_id))
+
 @app.post("/refine")
 async def refine(request: Request, ref_req: RefineRequest = Body(...)):
+    label_request(ref_req.diagramType, ref_req.codeType)
     c_id = request.state.correlation_id 
-    diagramType = ref_req.diagramType
-    if diagramType in [DiagramType.DATABASE, DiagramType.API]:
-        is_db = (diagramType == DiagramType.DATABASE)
-        refined_output = await refine_derived_artifact(diagramType.value, ref_req.diagramCode, ref_req.userInstruction, correlation_id=c_id)
-        return {
-            "diagramType": diagramType,
-            "codeType": "JSON/SQL" if is_db else "OPENAPI",
-            "diagramCode": refined_output,
-            "isRenderable": False,
-            "correlation_id": c_id
-        }
-    refined_code = await refine_diagram(diagramType.value, ref_req.diagramCode, ref_req.userInstruction, ref_req.codeType, correlation_id=c_id)
+    priority_ctx.set(PRIORITY_INTERACTIVE)
+    result = await run_refinement(ref_req, c_id)
+    return {**result, "correlation_id": c_id}
+
+@app.post("/refine/stream")
+async def refine_stream(request: Request, ref_req: RefineRequest = Body(...)):
+    label_request(ref_req.diagramType, ref_req.codeType)
+    c_id = request.state.correlation_id
+    priority_ctx.set(PRIORITY_INTERACTIVE)
+    messages, meta, on_complete = await prepare_refine_stream(ref_req)
+    return event_stream_response(completion_events(messages, meta, c_id, operation="refine", on_complete=on_complete))
+
+@app.get("/diagrams/{diagram_id}")
+async def get_diagram(diagram_id: str, version: Optional[int] = None):
+    return await get_diagram_version(diagram_id, version)
+
+@app.get("/stats")
+async def stats():
     return {
-        "diagramType": diagramType,
-        "codeType": ref_req.codeType,
-        "diagramCode": refined_code,
-        "isRenderable": True,
-        "correlation_id": c_id
-    }
\ No newline at end of file
+        "cache": await completion_cache.stats(),
+        "sharedLocks": lock_stats.stats(),
+        "similarity": similarity_cache.stats(),
+        "singleFlight": generation_flight.stats(),
+        "upstreamPool": pool_stats(),
+        "admission": upstream_limiter.stats(),
+        "prompts": prompt_stats.stats(),
+        "diagrams": diagram_store.stats(),
+        "lint": lint_stats.stats(),
+        "routing": model_router.stats(),
+        "logging": logging_stats(),
+        "circuitBreaker": circuit_breaker.stats()
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type=CONTENT_TYPE)
@@ -0,0 +1,297 @@
+import os
+import time
+from functools import wraps
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence
+from starlette.routing import Match
+
+# the registry lives in this process: behind several workers each scrape sees only the worker that answered,
+# so run one worker per scrape target (or one container per worker); process_start_time_seconds tells
+# a restart apart from another worker's counters
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+LANGUAGES = ("PLANTUML", "MERMAID")
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[tuple, object] = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "none")) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in self.values.items()]
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        state = self.values.get(key)
+        if state is None:
+            # per-bucket counts, sum, count
+            state = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[0][i] += 1
+                break
+        state[1] += value
+        state[2] += 1
+
+    def samples(self) -> List[str]:
+        lines = []
+        names = self.labelnames + ("le",)
+        for key, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(names, key + (_format_value(bound),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(names, key + ('+Inf',))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(round(total, 6))}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+REQUEST_LABELS = ("endpoint", "diagram_type", "language")
+
+requests_total = Counter("archie_requests_total", "HTTP requests by endpoint and status.", REQUEST_LABELS + ("status",))
+request_duration = Histogram("archie_request_duration_seconds", "End-to-end request latency.", REQUEST_LABELS)
+stage_duration = Histogram("archie_stage_duration_seconds", "Time spent per request stage.", REQUEST_LABELS + ("stage",))
+requests_in_flight = Gauge("archie_requests_in_flight", "Requests currently being served.", ("endpoint",))
+errors_total = Counter("archie_errors_total", "Errors returned to clients by error code.", ("endpoint", "code"))
+upstream_calls_total = Counter("archie_upstream_calls_total", "Completion calls to the LLM provider.", REQUEST_LABELS + ("operation", "model", "outcome"))
+upstream_latency = Histogram("archie_upstream_latency_seconds", "Provider latency per routed operation and model.", ("operation", "model"))
+hedges_total = Counter("archie_hedged_requests_total", "Hedged completion calls, launched and won by the backup.", ("operation", "model", "outcome"))
+upstream_retries_total = Counter("archie_upstream_retries_total", "Upstream attempts retried by the service retry loop (deadline-aware backoff, 429s included).", REQUEST_LABELS + ("model",))
+prompt_tokens = Histogram("archie_prompt_tokens", "Prompt tokens reported by the provider.", REQUEST_LABELS + ("model",), TOKEN_BUCKETS)
+completion_tokens = Histogram("archie_completion_tokens", "Completion tokens reported by the provider.", REQUEST_LABELS + ("model",), TOKEN_BUCKETS)
+cached_prompt_tokens_total = Counter("archie_cached_prompt_tokens_total", "Prompt tokens served from the provider prefix cache.", REQUEST_LABELS + ("model",))
+
+circuit_state = Gauge("archie_circuit_breaker_state", "Upstream circuit breaker state: 0 closed, 1 half open, 2 open.")
+circuit_transitions_total = Counter("archie_circuit_breaker_transitions_total", "Upstream circuit breaker state changes.", ("state",))
+client_disconnects_total = Counter("archie_client_disconnects_total", "Requests cancelled because the client went away.", ("endpoint",))
+process_start_time = Gauge("process_start_time_seconds", "Start time of this process since the unix epoch; metrics are per process.")
+process_start_time.values[()] = time.time()
+
+REGISTRY = [
+    requests_total, request_duration, stage_duration, requests_in_flight, errors_total,
+    upstream_calls_total, upstream_latency, hedges_total, upstream_retries_total, prompt_tokens, completion_tokens, cached_prompt_tokens_total,
+    circuit_state, circuit_transitions_total, client_disconnects_total, process_start_time,
+]
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+class RequestMetrics:
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.diagram_type = "none"
+        self.language = "none"
+        self.started = time.perf_counter()
+        self.handler_started: Optional[float] = None
+        self.envelope_started: Optional[float] = None
+        self.stages: Dict[str, float] = {}
+
+    def labels(self) -> dict:
+        return {"endpoint": self.endpoint, "diagram_type": self.diagram_type, "language": self.language}
+
+    def detached(self) -> "RequestMetrics":
+        # same labels, own stage timings: for work that outlives or serves more than this request
+        copy = RequestMetrics(self.endpoint)
+        copy.diagram_type, copy.language = self.diagram_type, self.language
+        return copy
+
+request_metrics_ctx: ContextVar[Optional[RequestMetrics]] = ContextVar("request_metrics", default=None)
+upstream_attempts_ctx: ContextVar[Optional[list]] = ContextVar("upstream_attempts", default=None)
+
+def _current_labels() -> dict:
+    current = request_metrics_ctx.get()
+    return current.labels() if current is not None else {"endpoint": "background"}
+
+def label_request(diagram_type=None, language: Optional[str] = None):
+    # called first thing in a handler: everything before it was body parsing and validation
+    current = request_metrics_ctx.get()
+    if current is None:
+        return
+    current.handler_started = time.perf_counter()
+    current.stages["validation"] = current.handler_started - current.started
+    if diagram_type is not None:
+        current.diagram_type = getattr(diagram_type, "value", diagram_type)
+    if language is not None:
+        language = language.upper()
+        current.language = language if language in LANGUAGES else "OTHER"
+
+def record_stage(stage: str, seconds: float):
+    current = request_metrics_ctx.get()
+    if current is not None:
+        current.stages[stage] = current.stages.get(stage, 0.0) + seconds
+
+@contextmanager
+def stage_timer(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+def timed(stage: str):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def mark_envelope_started():
+    current = request_metrics_ctx.get()
+    if current is not None and current.envelope_started is None:
+        current.envelope_started = time.perf_counter()
+
+def record_error(code: str):
+    current = request_metrics_ctx.get()
+    if current is not None:
+        errors_total.inc(endpoint=current.endpoint, code=code)
+
+def start_upstream_attempts() -> list:
+    attempts = [0]
+    upstream_attempts_ctx.set(attempts)
+    return attempts
+
+async def count_upstream_attempt(request):
+    # httpx request hook: runs once per HTTP attempt, including the retries made by create_with_retries
+    attempts = upstream_attempts_ctx.get()
+    if attempts is not None:
+        attempts[0] += 1
+
+def record_upstream_call(model: str, attempts: list, outcome: str, operation: str = "completion", seconds: Optional[float] = None):
+    labels = {**_current_labels(), "model": model}
+    upstream_calls_total.inc(operation=operation, outcome=outcome, **labels)
+    if seconds is not None:
+        upstream_latency.observe(seconds, operation=operation, model=model)
+    if attempts[0] > 1:
+        upstream_retries_total.inc(attempts[0] - 1, **labels)
+
+def set_circuit_state(state: str):
+    if circuit_state.values:
+        circuit_transitions_total.inc(state=state)
+    circuit_state.values[()] = CIRCUIT_STATES[state]
+
+def record_disconnect():
+    current = request_metrics_ctx.get()
+    client_disconnects_total.inc(endpoint=current.endpoint if current is not None else "unknown")
+
+def record_hedge(operation: str, model: str, outcome: str):
+    hedges_total.inc(operation=operation, model=model, outcome=outcome)
+
+def observe_usage(model: str, prompt: int, completion: int, cached: int):
+    labels = {**_current_labels(), "model": model}
+    if prompt:
+        prompt_tokens.observe(prompt, **labels)
+    if completion:
+        completion_tokens.observe(completion, **labels)
+    if cached:
+        cached_prompt_tokens_total.inc(cached, **labels)
+
+def _finish(current: RequestMetrics, status: int):
+    finished = time.perf_counter()
+    labels = current.labels()
+    request_duration.observe(finished - current.started, **labels)
+    requests_total.inc(status=status, **labels)
+    stages = dict(current.stages)
+    if current.handler_started is not None:
+        # whatever the handler did besides building prompts and waiting on the provider
+        handler_end = current.envelope_started or finished
+        waited = sum(stages.get(name, 0.0) for name in ("prompt_build", "queue", "upstream_wait"))
+        stages["post_processing"] = max(0.0, handler_end - current.handler_started - waited)
+    for stage, seconds in stages.items():
+        stage_duration.observe(seconds, stage=stage, **labels)
+
+def resolve_endpoint(scope) -> str:
+    # label by route template so /diagrams/{diagram_id} is one series, not one per id
+    app = scope.get("app")
+    partial = None
+    for route in getattr(getattr(app, "router", None), "routes", []):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path
+    return partial or "unmatched"
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        current = RequestMetrics(resolve_endpoint(scope))
+        token = request_metrics_ctx.set(current)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        requests_in_flight.inc(endpoint=current.endpoint)
+        try:
+            await self.app(scope, receive, send_with_status)
+        except Exception:
+            # the server error handler runs outside this middleware, after the context is gone
+            errors_total.inc(endpoint=current.endpoint, code="INTERNAL_ERROR")
+            status = 500
+            raise
+        finally:
+            requests_in_flight.dec(endpoint=current.endpoint)
+            _finish(current, status)
+            request_metrics_ctx.reset(token)
+
+def render_metrics() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, field_validator, model_validator
 from typing import Optional, Any,List
 from enum import Enum
 class DiagramType(str, Enum):
@@ -17,17 +17,14 @@ class DiagramBaseModel(BaseModel):
         if isinstance(v, str):
             return v.upper().replace(" ", "_")
         return v
+class ExtractionMode(str, Enum):
+    single = "single"
+    mapreduce = "mapreduce"
+    auto = "auto"
 class ExtractionRequest(BaseModel):
     projectName: str
     requirementsText: str
-class GenerateRequest(DiagramBaseModel):
-    requirementsText: str
-    codeType: str
-    classes: List[ClassModel]
-class RefineRequest(DiagramBaseModel):
-    diagramCode: str
-    userInstruction: str
-    codeType:str
+    mode: Optional[ExtractionMode] = None
 
 class AttributeNature(str, Enum):
     Identifying = "Identifying"
@@ -56,9 +53,80 @@ class ClassModel(BaseModel):
     className: str
     attributes: List[Attribute]
     relationships: List[Relationship]
+class DatabaseStrategy(str, Enum):
+    serial = "serial"
+    parallel = "parallel"
+    deterministic = "deterministic"
+class RenderMode(str, Enum):
+    deterministic = "deterministic"
+    llm = "llm"
+    auto = "auto"
+class ClassEncoding(str, Enum):
+    json = "json"
+    compact = "compact"
+    dsl = "dsl"
+class PartitionMode(str, Enum):
+    single = "single"
+    stitched = "stitched"
+    linked = "linked"
+    auto = "auto"
+class RefineFormat(str, Enum):
+    full = "full"
+    diff = "diff"
+class GenerateRequest(DiagramBaseModel):
+    requirementsText: str
+    codeType: str
+    classes: List[ClassModel]
+    databaseStrategy: Optional[DatabaseStrategy] = None
+    renderMode: Optional[RenderMode] = None
+    polish: bool = False
+    classEncoding: Optional[ClassEncoding] = None
+    diagramId: Optional[str] = None
+    partitionMode: Optional[PartitionMode] = None
+class RefineRequest(DiagramBaseModel):
+    diagramCode: Optional[str] = None
+    userInstruction: str
+    codeType:str
+    diagramId: Optional[str] = None
+    baseVersion: Optional[int] = None
+    responseFormat: RefineFormat = RefineFormat.full
+    @model_validator(mode="after")
+    def require_source(self):
+        if self.diagramCode is None and self.diagramId is None:
+            raise ValueError("Either diagramCode or diagramId is required")
+        return self
+    @field_validator("baseVersion")
+    @classmethod
+    def check_base_version(cls, v):
+        if v is not None and v < 1:
+            raise ValueError("baseVersion starts at 1")
+        return v
+class BatchTarget(DiagramBaseModel):
+    codeType: str = "PLANTUML"
+    databaseStrategy: Optional[DatabaseStrategy] = None
+    renderMode: Optional[RenderMode] = None
+    polish: bool = False
+    partitionMode: Optional[PartitionMode] = None
+class BatchGenerateRequest(BaseModel):
+    requirementsText: str
+    classes: List[ClassModel]
+    targets: List[BatchTarget]
+    classEncoding: Optional[ClassEncoding] = None
 class ProjectResponse(BaseModel):
     projectName: str
     classes: List[ClassModel]
+class ChunkReport(BaseModel):
+    index: int
+    tokens: int
+    classes: int
+    elapsedMs: float
+    error: Optional[str] = None
+class ExtractionReport(BaseModel):
+    mode: ExtractionMode
+    totalMs: float
+    chunks: List[ChunkReport]
+class ExtractionResponse(ProjectResponse):
+    extraction: Optional[ExtractionReport] = None
 class ErrorResponse(BaseModel):
     message: str
     code: str
@@ -0,0 +1,135 @@
+import os
+import json
+import random
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from app.logger import log
+
+load_dotenv()
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")
+MODEL_ROUTES = os.getenv("MODEL_ROUTES", "")
+ROUTE_LATENCY_WINDOW = int(os.getenv("ROUTE_LATENCY_WINDOW", "200"))
+ROUTE_EXPLORE_RATE = float(os.getenv("ROUTE_EXPLORE_RATE", "0.05"))
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.5"))
+HEDGE_MAX_DELAY = float(os.getenv("HEDGE_MAX_DELAY", "30"))
+HEDGE_MAX_RATE = float(os.getenv("HEDGE_MAX_RATE", "0.1"))
+
+class Route:
+    def __init__(self, operation: str, models: List[str], max_prompt_tokens: Optional[int] = None):
+        self.operation = operation
+        self.models = models
+        self.max_prompt_tokens = max_prompt_tokens
+
+    @property
+    def name(self) -> str:
+        return ",".join(self.models)
+
+    def matches(self, operation: str, prompt_tokens: Optional[int]) -> bool:
+        if self.operation not in ("*", operation):
+            return False
+        return self.max_prompt_tokens is None or (prompt_tokens is not None and prompt_tokens <= self.max_prompt_tokens)
+
+    def describe(self) -> dict:
+        return {"operation": self.operation, "models": self.models, "maxPromptTokens": self.max_prompt_tokens}
+
+def parse_routes(raw: str) -> List[Route]:
+    # e.g. [{"operation": "refine", "maxPromptTokens": 1500, "models": ["gpt-4o-mini"]}, {"operation": "*", "models": ["gpt-4o"]}]
+    routes = []
+    if raw.strip():
+        for entry in json.loads(raw):
+            models = entry.get("models") or [entry["model"]]
+            routes.append(Route(entry.get("operation", "*"), list(models), entry.get("maxPromptTokens")))
+    if not any(route.operation == "*" and route.max_prompt_tokens is None for route in routes):
+        routes.append(Route("*", [LLM_MODEL]))
+    return routes
+
+class LatencyWindow:
+    def __init__(self, size: int):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+        self.count += 1
+
+    def percentile(self, pct: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+class ModelRouter:
+    def __init__(self, routes: List[Route]):
+        self.routes = routes
+        self.latency: Dict[Tuple[str, str], LatencyWindow] = {}
+        self.calls = 0
+        self.hedged = 0
+        self.hedges_won = 0
+
+    def needs_prompt_size(self, operation: str) -> bool:
+        return any(route.max_prompt_tokens is not None and route.operation in ("*", operation) for route in self.routes)
+
+    def route(self, operation: str, prompt_tokens: Optional[int] = None) -> Route:
+        return next(route for route in self.routes if route.matches(operation, prompt_tokens))
+
+    def window(self, operation: str, model: str) -> LatencyWindow:
+        key = (operation, model)
+        if key not in self.latency:
+            self.latency[key] = LatencyWindow(ROUTE_LATENCY_WINDOW)
+        return self.latency[key]
+
+    def rank(self, route: Route, operation: str) -> List[str]:
+        # fastest median first; models without samples go first so every deployment gets measured
+        if len(route.models) == 1:
+            return list(route.models)
+        if random.random() < ROUTE_EXPLORE_RATE:
+            return random.sample(route.models, len(route.models))
+        def median(model: str) -> float:
+            value = self.window(operation, model).percentile(50)
+            return -1.0 if value is None else value
+        return sorted(route.models, key=median)
+
+    def record(self, operation: str, model: str, seconds: float):
+        self.window(operation, model).observe(seconds)
+
+    def hedge_delay(self, operation: str, model: str) -> Optional[float]:
+        if not HEDGE_ENABLED:
+            return None
+        window = self.window(operation, model)
+        if len(window.samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return min(HEDGE_MAX_DELAY, max(HEDGE_MIN_DELAY, window.percentile(HEDGE_PERCENTILE)))
+
+    def allow_hedge(self) -> bool:
+        # hedges add upstream load, so they are capped at a share of all calls
+        return self.hedged < HEDGE_MAX_RATE * self.calls
+
+    def stats(self) -> dict:
+        return {
+            "routes": [route.describe() for route in self.routes],
+            "hedging": {
+                "enabled": HEDGE_ENABLED,
+                "calls": self.calls,
+                "hedged": self.hedged,
+                "hedgesWon": self.hedges_won,
+                "hedgeRate": round(self.hedged / self.calls, 4) if self.calls else 0.0,
+            },
+            "latency": {
+                f"{operation}/{model}": {
+                    "samples": window.count,
+                    "p50": round(window.percentile(50) or 0.0, 3),
+                    "p95": round(window.percentile(95) or 0.0, 3),
+                }
+                for (operation, model), window in self.latency.items()
+            },
+        }
+
+model_router = ModelRouter(parse_routes(MODEL_ROUTES))
+log.info(
+    f"Model routing initialised (routes={[route.describe() for route in model_router.routes]}, "
+    f"hedging={'on' if HEDGE_ENABLED else 'off'})"
+)
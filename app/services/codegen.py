@@ -0,0 +1,293 @@
+import re
+import json
+from typing import Dict, List, Tuple
+from app.model import ClassModel, AttributeNature, RelationshipNature, RelationshipType
+
+SQL_TYPES = {
+    "string": "VARCHAR(255)", "str": "VARCHAR(255)", "text": "TEXT", "char": "CHAR(1)",
+    "int": "INTEGER", "integer": "INTEGER", "long": "BIGINT", "bigint": "BIGINT", "short": "SMALLINT",
+    "float": "DOUBLE PRECISION", "double": "DOUBLE PRECISION", "decimal": "DECIMAL(18,2)", "money": "DECIMAL(18,2)",
+    "bool": "BOOLEAN", "boolean": "BOOLEAN",
+    "date": "DATE", "datetime": "TIMESTAMP", "timestamp": "TIMESTAMP", "time": "TIME",
+    "uuid": "VARCHAR(36)",
+}
+BSON_TYPES = {
+    "int": "int", "integer": "int", "short": "int", "long": "long", "bigint": "long",
+    "float": "double", "double": "double", "decimal": "decimal", "money": "decimal",
+    "bool": "bool", "boolean": "bool", "date": "date", "datetime": "date", "timestamp": "date",
+}
+OPENAPI_TYPES = {
+    "int": {"type": "integer", "format": "int32"}, "integer": {"type": "integer", "format": "int32"},
+    "short": {"type": "integer", "format": "int32"},
+    "long": {"type": "integer", "format": "int64"}, "bigint": {"type": "integer", "format": "int64"},
+    "float": {"type": "number", "format": "float"}, "double": {"type": "number", "format": "double"},
+    "decimal": {"type": "number"}, "money": {"type": "number"},
+    "bool": {"type": "boolean"}, "boolean": {"type": "boolean"},
+    "date": {"type": "string", "format": "date"}, "datetime": {"type": "string", "format": "date-time"},
+    "timestamp": {"type": "string", "format": "date-time"}, "time": {"type": "string", "format": "time"},
+    "uuid": {"type": "string", "format": "uuid"},
+}
+
+def snake_case(name: str) -> str:
+    name = re.sub(r'[^0-9A-Za-z]+', '_', name.strip())
+    name = re.sub(r'([a-z0-9])([A-Z])', r'\1_\2', name)
+    return name.strip('_').lower() or "entity"
+
+def pluralize(word: str) -> str:
+    if re.search(r'[^aeiou]y$', word):
+        return word[:-1] + "ies"
+    if re.search(r'(s|x|z|ch|sh)$', word):
+        return word + "es"
+    return word + "s"
+
+def _type_key(type_name: str) -> str:
+    return type_name.strip().lower()
+
+SQL_RESERVED = {
+    "order", "group", "user", "table", "select", "from", "where", "join", "key", "index", "check",
+    "column", "constraint", "default", "references", "primary", "foreign", "unique", "values", "case",
+    "end", "limit", "offset", "desc", "asc", "by", "to", "as", "on", "in", "is", "not", "null", "and", "or",
+}
+
+def sql_identifier(name: str) -> str:
+    # reserved words would otherwise make the DDL unparseable ("CREATE TABLE order")
+    return f'"{name}"' if name.lower() in SQL_RESERVED else name
+
+def schema_name(class_name: str) -> str:
+    # OpenAPI component keys and operationIds only allow [A-Za-z0-9._-]
+    return "".join(part[:1].upper() + part[1:] for part in re.split(r'[^0-9A-Za-z]+', class_name) if part) or "Entity"
+
+class Column:
+    def __init__(self, name: str, type_name: str, required: bool, source_type: str):
+        self.name = name
+        self.type_name = type_name
+        self.required = required
+        self.source_type = source_type
+
+class ForeignKey:
+    def __init__(self, table: str, columns: List[str], ref_table: str, ref_columns: List[str], cascade: bool):
+        self.table = table
+        self.columns = columns
+        self.ref_table = ref_table
+        self.ref_columns = ref_columns
+        self.cascade = cascade
+
+class Table:
+    def __init__(self, name: str, class_name: str):
+        self.name = name
+        self.class_name = class_name
+        self.columns: List[Column] = []
+        self.primary_key: List[str] = []
+        self.unique: List[List[str]] = []
+        self.is_join = False
+
+    def has_column(self, name: str) -> bool:
+        return any(col.name == name for col in self.columns)
+
+def build_schema(classes: List[ClassModel]) -> Tuple[Dict[str, Table], List[ForeignKey]]:
+    tables: Dict[str, Table] = {}
+    for cls in classes:
+        table = Table(snake_case(cls.className), cls.className)
+        for attr in cls.attributes:
+            table.columns.append(Column(attr.name, SQL_TYPES.get(_type_key(attr.type), "VARCHAR(255)"), attr.required, attr.type))
+            if attr.nature == AttributeNature.Identifying:
+                table.primary_key.append(attr.name)
+        if not table.primary_key:
+            table.columns.insert(0, Column("id", "BIGINT", True, "Long"))
+            table.primary_key.append("id")
+        tables[cls.className] = table
+
+    foreign_keys: List[ForeignKey] = []
+    seen = set()
+
+    def add_reference(child: Table, parent: Table, required: bool, cascade: bool, unique: bool):
+        columns = []
+        for pk in parent.primary_key:
+            column = pk if pk.lower().startswith(snake_case(parent.class_name).replace("_", "")) else f"{parent.name}_{pk}"
+            columns.append(column)
+            if not child.has_column(column):
+                pk_type = next(col for col in parent.columns if col.name == pk)
+                child.columns.append(Column(column, pk_type.type_name, required, pk_type.source_type))
+        key = (child.name, tuple(columns), parent.name)
+        if key in seen:
+            return
+        seen.add(key)
+        if unique and columns != child.primary_key:
+            child.unique.append(columns)
+        foreign_keys.append(ForeignKey(child.name, columns, parent.name, list(parent.primary_key), cascade))
+
+    for cls in classes:
+        for rel in cls.relationships:
+            source, target = tables.get(rel.source), tables.get(rel.target)
+            if source is None or target is None or source is target:
+                continue
+            composition = rel.nature == RelationshipNature.Composition
+            if rel.sourcetype == RelationshipType.Many and rel.targettype == RelationshipType.Many:
+                join_name = f"{source.name}_{target.name}"
+                if any(t.name in (join_name, f"{target.name}_{source.name}") for t in tables.values()):
+                    continue
+                join = Table(join_name, join_name)
+                join.is_join = True
+                tables[join_name] = join
+                add_reference(join, source, True, True, False)
+                add_reference(join, target, True, True, False)
+                join.primary_key = [col.name for col in join.columns]
+            elif rel.sourcetype == RelationshipType.Many:
+                add_reference(source, target, composition, composition, False)
+            else:
+                add_reference(target, source, composition, composition, rel.targettype == RelationshipType.One)
+    return tables, foreign_keys
+
+def _column_list(columns: List[str]) -> str:
+    return ", ".join(sql_identifier(col) for col in columns)
+
+def _sql(tables: Dict[str, Table], foreign_keys: List[ForeignKey]) -> List[str]:
+    lines = []
+    for table in tables.values():
+        body = []
+        for col in table.columns:
+            body.append(f"    {sql_identifier(col.name)} {col.type_name}{' NOT NULL' if col.required or col.name in table.primary_key else ''}")
+        body.append(f"    PRIMARY KEY ({_column_list(table.primary_key)})")
+        for unique in table.unique:
+            body.append(f"    UNIQUE ({_column_list(unique)})")
+        lines.append(f"CREATE TABLE {sql_identifier(table.name)} (")
+        lines.append(",\n".join(body))
+        lines.append(");")
+        lines.append("")
+    names = set()
+    for fk in foreign_keys:
+        cascade = " ON DELETE CASCADE" if fk.cascade else ""
+        name = f"fk_{fk.table}_{fk.ref_table}"
+        if name in names:
+            name = f"{name}_{len(names)}"
+        names.add(name)
+        lines.append(
+            f"ALTER TABLE {sql_identifier(fk.table)} ADD CONSTRAINT {name} "
+            f"FOREIGN KEY ({_column_list(fk.columns)}) REFERENCES {sql_identifier(fk.ref_table)} ({_column_list(fk.ref_columns)}){cascade};"
+        )
+    return lines
+
+def _mongo(tables: Dict[str, Table]) -> List[str]:
+    lines = []
+    for table in tables.values():
+        properties = {
+            col.name: {"bsonType": BSON_TYPES.get(_type_key(col.source_type), "string")}
+            for col in table.columns
+        }
+        required = [col.name for col in table.columns if col.required or col.name in table.primary_key]
+        schema = {"bsonType": "object", "required": required, "properties": properties}
+        validator = json.dumps({"validator": {"$jsonSchema": schema}}, indent=2)
+        lines.append(f'db.createCollection("{table.name}", {validator});')
+        lines.append("")
+    return lines
+
+def generate_database_code(classes: List[ClassModel]) -> str:
+    tables, foreign_keys = build_schema(classes)
+    lines = ["### SQL", ""] + _sql(tables, foreign_keys) + ["", "### NoSQL", ""] + _mongo(tables)
+    return "\n".join(lines).strip()
+
+def _openapi_type(type_name: str) -> dict:
+    return dict(OPENAPI_TYPES.get(_type_key(type_name), {"type": "string"}))
+
+def generate_openapi_contract(classes: List[ClassModel]) -> str:
+    tables, _ = build_schema(classes)
+    schemas, paths = {}, {}
+    for cls in classes:
+        table = tables[cls.className]
+        name = schema_name(cls.className)
+        schemas[name] = {
+            "type": "object",
+            "required": [col.name for col in table.columns if col.required or col.name in table.primary_key],
+            "properties": {col.name: _openapi_type(col.source_type) for col in table.columns},
+        }
+        ref = {"$ref": f"#/components/schemas/{name}"}
+        resource = pluralize(snake_case(cls.className).replace("_", "-"))
+        id_name = table.primary_key[0]
+        id_schema = _openapi_type(next(col.source_type for col in table.columns if col.name == id_name))
+        json_body = {"content": {"application/json": {"schema": ref}}}
+        paths[f"/{resource}"] = {
+            "get": {
+                "summary": f"List {cls.className} records",
+                "operationId": f"list{name}",
+                "responses": {"200": {"description": "OK", "content": {"application/json": {"schema": {"type": "array", "items": ref}}}}},
+            },
+            "post": {
+                "summary": f"Create a {cls.className}",
+                "operationId": f"create{name}",
+                "requestBody": {"required": True, **json_body},
+                "responses": {"201": {"description": "Created", **json_body}},
+            },
+        }
+        id_param = {"name": id_name, "in": "path", "required": True, "schema": id_schema}
+        paths[f"/{resource}/{{{id_name}}}"] = {
+            "parameters": [id_param],
+            "get": {
+                "summary": f"Get a {cls.className}",
+                "operationId": f"get{name}",
+                "responses": {"200": {"description": "OK", **json_body}, "404": {"description": "Not Found"}},
+            },
+            "put": {
+                "summary": f"Update a {cls.className}",
+                "operationId": f"update{name}",
+                "requestBody": {"required": True, **json_body},
+                "responses": {"200": {"description": "OK", **json_body}, "404": {"description": "Not Found"}},
+            },
+            "delete": {
+                "summary": f"Delete a {cls.className}",
+                "operationId": f"delete{name}",
+                "responses": {"204": {"description": "No Content"}, "404": {"description": "Not Found"}},
+            },
+        }
+    document = {
+        "openapi": "3.1.0",
+        "info": {"title": "Generated API", "version": "1.0.0"},
+        "paths": paths,
+        "components": {"schemas": schemas},
+    }
+    return "\n".join(_yaml_lines(document, 0))
+
+_PLAIN_SCALAR = re.compile(r'^[A-Za-z_/$][A-Za-z0-9_./#$ -]*$')
+_VERSION_SCALAR = re.compile(r'^\d+(\.\d+){2,}$')
+_YAML_KEYWORDS = {"true", "false", "null", "yes", "no", "on", "off", "~"}
+
+def _yaml_scalar(value) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if value is None:
+        return "null"
+    if isinstance(value, (int, float)):
+        return str(value)
+    text = str(value)
+    if _VERSION_SCALAR.match(text):
+        return text
+    if _PLAIN_SCALAR.match(text) and text.lower() not in _YAML_KEYWORDS and not text.endswith(" "):
+        return text
+    return json.dumps(text, ensure_ascii=False)
+
+def _yaml_lines(node, indent: int) -> List[str]:
+    pad = "  " * indent
+    lines = []
+    if isinstance(node, dict):
+        for key, value in node.items():
+            key_text = _yaml_scalar(key)
+            if isinstance(value, (dict, list)) and value:
+                lines.append(f"{pad}{key_text}:")
+                lines.extend(_yaml_lines(value, indent + 1))
+            elif isinstance(value, (dict, list)):
+                lines.append(f"{pad}{key_text}: {'{}' if isinstance(value, dict) else '[]'}")
+            else:
+                lines.append(f"{pad}{key_text}: {_yaml_scalar(value)}")
+    else:
+        for item in node:
+            if isinstance(item, (dict, list)) and item:
+                nested = _yaml_lines(item, indent + 1)
+                lines.append(f"{pad}- {nested[0].lstrip()}")
+                lines.extend(nested[1:])
+            else:
+                lines.append(f"{pad}- {_yaml_scalar(item)}")
+    return lines
+
+GENERATORS = {
+    "DATABASE": generate_database_code,
+    "API": generate_openapi_contract,
+}
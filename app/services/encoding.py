@@ -0,0 +1,39 @@
+import json
+from typing import List
+from app.model import ClassModel, ClassEncoding, AttributeNature, RelationshipNature, RelationshipType
+
+NATURE_CODES = {
+    RelationshipNature.Association: "A",
+    RelationshipNature.Aggregation: "G",
+    RelationshipNature.Composition: "C",
+}
+MULTIPLICITY_CODES = {RelationshipType.One: "1", RelationshipType.Many: "M"}
+DSL_LEGEND = (
+    "CLASS MODEL (one class per line: 'Class: attr:Type, ...'; attribute flags: # = Identifying (primary key), "
+    "? = Optional, ! = required; indented relationship lines: 'Source>Target NATURE SRC:TGT label' where "
+    "NATURE A=Association G=Aggregation C=Composition and multiplicity 1=One M=Many)"
+)
+
+def _dsl_attribute(attr) -> str:
+    prefix = "#" if attr.nature == AttributeNature.Identifying else "?" if attr.nature == AttributeNature.Optional else ""
+    return f"{prefix}{attr.name}:{attr.type}{'!' if attr.required else ''}"
+
+def encode_dsl(classes: List[ClassModel]) -> str:
+    lines = [DSL_LEGEND]
+    for cls in classes:
+        lines.append(f"{cls.className}: {', '.join(_dsl_attribute(a) for a in cls.attributes)}")
+        for rel in cls.relationships:
+            label = f" {rel.label}" if rel.label else ""
+            lines.append(
+                f" {rel.source}>{rel.target} {NATURE_CODES[rel.nature]} "
+                f"{MULTIPLICITY_CODES[rel.sourcetype]}:{MULTIPLICITY_CODES[rel.targettype]}{label}"
+            )
+    return "\n".join(lines)
+
+def encode_classes(classes: List[ClassModel], encoding: ClassEncoding = ClassEncoding.json) -> str:
+    if encoding == ClassEncoding.dsl:
+        return encode_dsl(classes)
+    class_data = [cls.model_dump(mode="json") for cls in classes]
+    if encoding == ClassEncoding.compact:
+        return json.dumps(class_data, separators=(",", ":"))
+    return json.dumps(class_data, indent=2)
@@ -1,18 +1,183 @@
-import json
+import os
 import re
-from app.services.prompts import get_prompt_extract_structure
-from app.kadalclient import get_chat_completion 
+import json
+import time
+import asyncio
+from typing import List, Optional, Tuple
+from pydantic import ValidationError
+from app.services.prompts import get_prompt_extract_structure, strip_markdown
+from app.services.partial_json import ClassStreamParser, repair_json
+from app.kadalClient import get_chat_completion, stream_chat_completion, supports_structured_outputs
+from app.handlers import LLMServiceError, ServiceOverloadedError, PromptTooLargeError
+from app.model import ClassModel, ProjectResponse, ExtractionMode
+from app.services.merge import merge_class_models
+from app.services.tokens import count_tokens
+from app.streaming import sse_event, sse_error
 from app.logger import log
 
-async def extract_project_structure(requirements_text: str, project_name: str, correlation_id: str) -> dict:
+EXTRACT_RESPONSE_FORMAT = os.getenv("EXTRACT_RESPONSE_FORMAT", "json_object")
+EXTRACTION_MODE = os.getenv("EXTRACTION_MODE", "auto")
+EXTRACT_CHUNK_TOKENS = int(os.getenv("EXTRACT_CHUNK_TOKENS", "3000"))
+EXTRACT_MAX_CONCURRENCY = int(os.getenv("EXTRACT_MAX_CONCURRENCY", "4"))
+EXTRACT_MAP_REDUCE_THRESHOLD = int(os.getenv("EXTRACT_MAP_REDUCE_THRESHOLD", "6000"))
+EXTRACT_SCHEMA_RETRIES = int(os.getenv("EXTRACT_SCHEMA_RETRIES", "1"))
+
+# a blank line, or a line that starts a markdown heading or a numbered section
+_SECTION_BREAK = re.compile(r'\n\s*\n|\n(?=#{1,6}\s|\d+(?:\.\d+)*[.)]?\s+[A-Z])')
+_SENTENCE_BREAK = re.compile(r'(?<=[.!?])\s+')
+
+def strict_json_schema(model) -> dict:
+    # structured outputs need every property required and no extra keys
+    def tighten(node):
+        if isinstance(node, list):
+            for item in node:
+                tighten(item)
+            return
+        if not isinstance(node, dict):
+            return
+        node.pop("title", None)
+        node.pop("default", None)
+        properties = node.get("properties")
+        if node.get("type") == "object" and properties is not None:
+            node["additionalProperties"] = False
+            node["required"] = list(properties)
+            for value in properties.values():
+                tighten(value)
+        for key, value in node.items():
+            if key != "properties":
+                tighten(value)
+    schema = model.model_json_schema()
+    tighten(schema)
+    return schema
+
+def extract_response_format() -> Optional[dict]:
+    # json_schema needs LLM_API_VERSION 2024-08-01-preview or later; older versions reject it, so they get json_object
+    # and rely on validate-and-retry in request_project instead
+    if EXTRACT_RESPONSE_FORMAT == "json_schema" and supports_structured_outputs():
+        return {
+            "type": "json_schema",
+            "json_schema": {"name": "ProjectResponse", "strict": True, "schema": strict_json_schema(ProjectResponse)}
+        }
+    if EXTRACT_RESPONSE_FORMAT in ("json_object", "json_schema"):
+        return {"type": "json_object"}
+    return None
+
+def validate_class(item) -> Optional[dict]:
+    if not isinstance(item, dict):
+        return None
+    # a class cut off by repair keeps whatever members were complete
+    item.setdefault("attributes", [])
+    item.setdefault("relationships", [])
+    try:
+        return ClassModel.model_validate(item).model_dump(mode="json")
+    except ValidationError:
+        return None
+
+def parse_project(raw_response: str, project_name: str) -> Tuple[Optional[dict], bool]:
+    cleaned = strip_markdown(raw_response)
+    repaired = False
+    try:
+        data = json.loads(cleaned)
+    except json.JSONDecodeError:
+        data = repair_json(raw_response)
+        repaired = True
+    if not isinstance(data, dict):
+        return None, repaired
+    raw_classes = data.get("classes") if isinstance(data.get("classes"), list) else []
+    classes = [cls for cls in (validate_class(item) for item in raw_classes) if cls is not None]
+    repaired = repaired or len(classes) != len(raw_classes)
+    return {"projectName": data.get("projectName") or project_name, "classes": classes}, repaired
+
+def schema_errors(raw_response: str, project_name: str) -> List[str]:
+    # strict check against the response model; parse_project is the lenient salvage that runs afterwards
+    try:
+        data = json.loads(strip_markdown(raw_response))
+    except json.JSONDecodeError as e:
+        return [f"not valid JSON ({e.msg} at line {e.lineno} column {e.colno})"]
+    if not isinstance(data, dict):
+        return ["the top level must be a JSON object with projectName and classes"]
+    try:
+        ProjectResponse.model_validate({**data, "projectName": data.get("projectName") or project_name})
+    except ValidationError as e:
+        return [f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors()[:10]]
+    return []
+
+async def request_project(messages: list, project_name: str, correlation_id: str) -> str:
+    # a reply that still fails after the retries is left to parse_project to salvage
+    raw_response = await get_chat_completion(messages, correlation_id=correlation_id, response_format=extract_response_format(), operation="extract")
+    for _ in range(EXTRACT_SCHEMA_RETRIES):
+        errors = schema_errors(raw_response, project_name)
+        if not errors:
+            return raw_response
+        log.warning(f"Extraction reply failed validation: {'; '.join(errors)}", extra={'correlation_id': correlation_id})
+        # the invalid reply goes back with the errors, so the retry corrects it rather than starting over
+        messages = [
+            *messages,
+            {"role": "assistant", "content": raw_response},
+            {"role": "user", "content": "That reply does not match the required JSON schema:\n" + "\n".join(f"- {error}" for error in errors)
+                + "\nReturn the complete corrected JSON object only."},
+        ]
+        raw_response = await get_chat_completion(messages, correlation_id=correlation_id, response_format=extract_response_format(), operation="extract")
+    return raw_response
+
+def _elapsed_ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 1)
+
+def _pack(pieces: List[str], chunk_tokens: int, separator: str) -> List[str]:
+    chunks, current, current_tokens = [], [], 0
+    for piece in pieces:
+        tokens = count_tokens(piece)
+        if current and current_tokens + tokens > chunk_tokens:
+            chunks.append(separator.join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        chunks.append(separator.join(current))
+    return chunks
+
+def split_sections(text: str, chunk_tokens: int) -> List[str]:
+    pieces = []
+    for block in (b.strip() for b in _SECTION_BREAK.split(text)):
+        if not block:
+            continue
+        if count_tokens(block) <= chunk_tokens:
+            pieces.append(block)
+            continue
+        # oversized sections fall back to line, then sentence boundaries
+        for line in block.splitlines():
+            if count_tokens(line) <= chunk_tokens:
+                pieces.append(line)
+            else:
+                pieces.extend(_pack(_SENTENCE_BREAK.split(line), chunk_tokens, " "))
+    return _pack(pieces, chunk_tokens, "\n\n")
+
+def resolve_extraction_mode(mode: Optional[ExtractionMode], requirements_text: str) -> ExtractionMode:
+    mode = mode or ExtractionMode(EXTRACTION_MODE)
+    if mode == ExtractionMode.auto:
+        too_large = count_tokens(requirements_text) > EXTRACT_MAP_REDUCE_THRESHOLD
+        return ExtractionMode.mapreduce if too_large else ExtractionMode.single
+    return mode
+
+async def extract_project_structure(requirements_text: str, project_name: str, correlation_id: str, mode: Optional[ExtractionMode] = None) -> dict:
+    if resolve_extraction_mode(mode, requirements_text) == ExtractionMode.mapreduce:
+        chunks = split_sections(requirements_text, EXTRACT_CHUNK_TOKENS)
+        if len(chunks) > 1:
+            return await extract_map_reduce(chunks, project_name, correlation_id)
+    started = time.perf_counter()
     messages = get_prompt_extract_structure(requirements_text, project_name)
+    raw_response = None
     try:
-        raw_response = await get_chat_completion(messages, correlation_id=correlation_id)
-        clean_json = re.sub(r'```(?:json)?', '', raw_response).strip()
-        clean_json = clean_json.replace('```', '') 
-        structured_data = json.loads(clean_json)
+        raw_response = await request_project(messages, project_name, correlation_id)
+        structured_data, repaired = parse_project(raw_response, project_name)
+        if structured_data is None:
+            raise json.JSONDecodeError("Unrecoverable JSON", raw_response, 0)
+        if repaired:
+            log.warning(f"Repaired malformed extraction response for {project_name}", extra={'correlation_id': correlation_id})
         log.info(f"Structure extracted successfully for {project_name}", extra={'correlation_id': correlation_id})
-        return structured_data
+        elapsed = _elapsed_ms(started)
+        chunk = {"index": 0, "tokens": count_tokens(requirements_text), "classes": len(structured_data["classes"]), "elapsedMs": elapsed}
+        return {**structured_data, "extraction": {"mode": ExtractionMode.single, "totalMs": elapsed, "chunks": [chunk]}}
     except json.JSONDecodeError as e:
         log.error(f"JSON Parsing Error: {str(e)}", extra={'correlation_id': correlation_id})
         return {
@@ -23,4 +188,98 @@ async def extract_project_structure(requirements_text: str, project_name: str, c
         }
     except Exception as e:
         log.error(f"Unexpected error in extraction: {str(e)}", extra={'correlation_id': correlation_id})
-        raise e
\ No newline at end of file
+        raise e
+
+async def _extract_chunk(index: int, total: int, chunk: str, project_name: str, correlation_id: str, semaphore: asyncio.Semaphore):
+    report = {"index": index, "tokens": count_tokens(chunk), "classes": 0}
+    classes, failure = [], None
+    async with semaphore:
+        started = time.perf_counter()
+        messages = get_prompt_extract_structure(f"(Section {index + 1} of {total})\n{chunk}", project_name)
+        try:
+            raw_response = await request_project(messages, project_name, correlation_id)
+            structured_data, _ = parse_project(raw_response, project_name)
+            if structured_data is None:
+                report["error"] = "Failed to parse AI response into JSON"
+            else:
+                classes = structured_data["classes"]
+        except (LLMServiceError, ServiceOverloadedError, PromptTooLargeError) as e:
+            failure = e
+            report["error"] = e.message
+        report["elapsedMs"] = _elapsed_ms(started)
+    report["classes"] = len(classes)
+    log.info(
+        f"Extracted section {index + 1}/{total}: {report['classes']} classes in {report['elapsedMs']}ms",
+        extra={'correlation_id': correlation_id}
+    )
+    return classes, report, failure
+
+async def extract_map_reduce(chunks: List[str], project_name: str, correlation_id: str) -> dict:
+    started = time.perf_counter()
+    log.info(f"Map-reduce extraction over {len(chunks)} sections for {project_name}", extra={'correlation_id': correlation_id})
+    semaphore = asyncio.Semaphore(EXTRACT_MAX_CONCURRENCY)
+    outcomes = await asyncio.gather(*(
+        _extract_chunk(i, len(chunks), chunk, project_name, correlation_id, semaphore) for i, chunk in enumerate(chunks)
+    ))
+    failures = [failure for _, _, failure in outcomes if failure is not None]
+    if failures and len(failures) == len(chunks):
+        raise failures[0]
+    classes = merge_class_models([fragment for fragment, _, _ in outcomes])
+    extracted = sum(report["classes"] for _, report, _ in outcomes)
+    log.info(
+        f"Structure extracted successfully for {project_name} ({extracted} section classes merged into {len(classes)})",
+        extra={'correlation_id': correlation_id}
+    )
+    return {
+        "projectName": project_name,
+        "classes": classes,
+        "extraction": {
+            "mode": ExtractionMode.mapreduce,
+            "totalMs": _elapsed_ms(started),
+            "chunks": [report for _, report, _ in outcomes],
+        },
+    }
+
+async def extract_structure_events(requirements_text: str, project_name: str, correlation_id: str):
+    messages = get_prompt_extract_structure(requirements_text, project_name)
+    parser = ClassStreamParser()
+    emitted: List[dict] = []
+    try:
+        async for delta in stream_chat_completion(messages, correlation_id=correlation_id, response_format=extract_response_format(), operation="extract"):
+            for item in parser.feed(delta):
+                cls = validate_class(item)
+                if cls is not None:
+                    emitted.append(cls)
+                    yield sse_event("class", {"index": len(emitted) - 1, "class": cls})
+    except (LLMServiceError, ServiceOverloadedError, PromptTooLargeError) as e:
+        yield sse_error(e, correlation_id)
+        return
+    except Exception as e:
+        log.exception(f"Unhandled Exception while streaming extraction: {str(e)}", extra={'correlation_id': correlation_id})
+        yield sse_error(e, correlation_id)
+        return
+    structured_data, repaired = parse_project(parser.buffer, project_name)
+    if structured_data is None:
+        log.error("JSON Parsing Error: unrecoverable streamed extraction", extra={'correlation_id': correlation_id})
+        structured_data = {"projectName": project_name, "classes": emitted}
+        repaired = True
+    classes = structured_data["classes"]
+    if classes[:len(emitted)] != emitted:
+        # the final parse disagrees with what was streamed (dropped, reordered or repaired classes):
+        # clients replace every class they received with this list
+        log.warning(
+            f"Streamed classes diverged from the final parse ({len(emitted)} streamed, {len(classes)} parsed)",
+            extra={'correlation_id': correlation_id}
+        )
+        yield sse_event("correction", {"classes": classes})
+    else:
+        # classes recovered by the tail repair were never emitted while streaming
+        for index in range(len(emitted), len(classes)):
+            yield sse_event("class", {"index": index, "class": classes[index]})
+    log.info(f"Structure extracted successfully for {project_name}", extra={'correlation_id': correlation_id})
+    yield sse_event("done", {
+        "projectName": structured_data["projectName"],
+        "classes": classes,
+        "repaired": repaired,
+        "correlation_id": correlation_id
+    })
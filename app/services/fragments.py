@@ -0,0 +1,89 @@
+import os
+import re
+import difflib
+from typing import Optional, Tuple
+
+REFINE_FRAGMENTS_ENABLED = os.getenv("REFINE_FRAGMENTS_ENABLED", "true").lower() == "true"
+FRAGMENT_CONTEXT_LINES = int(os.getenv("REFINE_FRAGMENT_CONTEXT_LINES", "3"))
+FRAGMENT_MAX_RATIO = float(os.getenv("REFINE_FRAGMENT_MAX_RATIO", "0.5"))
+FRAGMENT_MIN_LINES = int(os.getenv("REFINE_FRAGMENT_MIN_LINES", "20"))
+# a reply this much longer than its fragment that also repeats this share of the untouched lines is a full diagram
+FULL_REPLY_MARGIN_LINES = int(os.getenv("REFINE_FULL_REPLY_MARGIN_LINES", "5"))
+FULL_REPLY_OVERLAP = float(os.getenv("REFINE_FULL_REPLY_OVERLAP", "0.5"))
+OUTLINE_MAX_LINES = 60
+
+_WORDS = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_HEADER = re.compile(r"^\s*(@startuml|erDiagram|classDiagram|sequenceDiagram|flowchart|graph)\b")
+_FOOTER = re.compile(r"^\s*@enduml\b")
+_DECLARATION = re.compile(
+    r"^\s*(entity|class|interface|enum|abstract|participant|actor|usecase|component|database|package|"
+    r"rectangle|node|boundary|control|collections|queue)\b", re.IGNORECASE
+)
+STOP_WORDS = {
+    "the", "and", "for", "with", "from", "into", "onto", "that", "this", "these", "those", "then", "than",
+    "add", "remove", "delete", "rename", "change", "update", "make", "set", "use", "move", "replace",
+    "please", "should", "must", "can", "new", "all", "each", "every", "also", "only", "between", "its",
+    "diagram", "entity", "class", "attribute", "attributes", "field", "fields", "relationship", "relationships",
+    "link", "linked", "connect", "called", "named", "type", "instead",
+}
+
+def _terms(text: str) -> set:
+    return {w.lower() for w in _WORDS.findall(text)}
+
+def select_fragment(code: str, instruction: str) -> Optional[Tuple[int, int]]:
+    # returns the [start, end) line span the instruction touches, or None when the whole diagram is needed
+    if not REFINE_FRAGMENTS_ENABLED:
+        return None
+    lines = code.splitlines()
+    if len(lines) < FRAGMENT_MIN_LINES:
+        return None
+    terms = {t for t in _terms(instruction) if len(t) > 1 and t not in STOP_WORDS}
+    if not terms:
+        return None
+    hits = [i for i, line in enumerate(lines) if terms & _terms(line)]
+    if not hits:
+        return None
+    first = 1 if _HEADER.match(lines[0]) else 0
+    last = len(lines) - 1 if _FOOTER.match(lines[-1]) else len(lines)
+    start = max(first, hits[0] - FRAGMENT_CONTEXT_LINES)
+    end = min(last, hits[-1] + FRAGMENT_CONTEXT_LINES + 1)
+    if start >= end or end - start > FRAGMENT_MAX_RATIO * len(lines):
+        return None
+    return start, end
+
+def outline(code: str, span: Tuple[int, int]) -> str:
+    lines = code.splitlines()
+    declared = [
+        line.strip() for i, line in enumerate(lines)
+        if (i < span[0] or i >= span[1]) and _DECLARATION.match(line)
+    ]
+    return "\n".join(declared[:OUTLINE_MAX_LINES]) or "(none)"
+
+def is_full_reply(code: str, span: Tuple[int, int], replacement: str) -> bool:
+    # the model was asked for the fragment only; splicing a whole diagram into it would duplicate everything else
+    replacement_lines = [line for line in replacement.splitlines() if line.strip()]
+    if not replacement_lines:
+        return False
+    if any(_HEADER.match(line) for line in replacement_lines[:3]) or _FOOTER.match(replacement_lines[-1]):
+        return True
+    if len(replacement_lines) <= span[1] - span[0] + FULL_REPLY_MARGIN_LINES:
+        return False
+    lines = code.splitlines()
+    outside = {line.strip() for line in lines[:span[0]] + lines[span[1]:]
+               if line.strip() and not _HEADER.match(line) and not _FOOTER.match(line)}
+    if not outside:
+        return False
+    repeated = outside & {line.strip() for line in replacement_lines}
+    return len(repeated) >= FULL_REPLY_OVERLAP * len(outside)
+
+def splice_fragment(code: str, span: Tuple[int, int], replacement: str) -> str:
+    if is_full_reply(code, span, replacement):
+        return replacement
+    lines = code.splitlines()
+    return "\n".join(lines[:span[0]] + replacement.splitlines() + lines[span[1]:])
+
+def unified_diff(before: str, after: str, from_version: int, to_version: int) -> str:
+    return "\n".join(difflib.unified_diff(
+        before.splitlines(), after.splitlines(),
+        fromfile=f"v{from_version}", tofile=f"v{to_version}", lineterm=""
+    ))
@@ -1,86 +1,587 @@
-import json
-from typing import List
-from app.kadalclient import get_chat_completion
-from app.model import ClassModel
-from app.services.rules import DATABASE_CODE_RULES, API_CONTRACT_RULES
+import os
+import time
+import asyncio
+from typing import Awaitable, Callable, List, Optional, Tuple
+from app.kadalClient import get_chat_completion
+from app.model import ClassModel, GenerateRequest, RefineRequest, DiagramType, BatchGenerateRequest, DatabaseStrategy, RenderMode, ClassEncoding, RefineFormat, PartitionMode
+from app.handlers import LLMServiceError, ServiceOverloadedError, PromptTooLargeError, DiagramNotFoundError, describe_error
+from app.cache import MemoryTier, CACHE_TTL_SECONDS
+from app.similarity import graph_fingerprint, RequestFingerprint
+from app.sessions import DiagramSession, diagram_store
+from app.services.render import render_erd_plantuml, get_renderer
+from app.services.codegen import GENERATORS
+from app.services.encoding import encode_classes
+from app.services.fragments import select_fragment, outline, splice_fragment, unified_diff
+from app.services.incremental import ClassDelta, diff_classes, rerender, patch_diagram
+from app.services.partition import (Partition, partition_classes, can_stitch, stitch, overview, cross_links, partition_stats,
+    PARTITION_MODE, PARTITION_THRESHOLD, PARTITION_MAX_CLASSES, PARTITION_MAX_CONCURRENCY)
+from app.services.lint import fix_diagram, lint_diagram, issue_span, lint_stats, DIAGRAM_LINT_ENABLED, LINT_REPAIR_ENABLED
+from app.services.rules import POLISH_INSTRUCTION
 from app.services.prompts import (get_prompt_message, get_prompt_derived_artifact, strip_markdown, 
-    get_prompt_refine_diagram, get_prompt_refine_artifact, MAPPING)
+    get_prompt_refine_diagram, get_prompt_refine_artifact, get_prompt_refine_fragment)
 from app.logger import log
+from app.metrics import timed, record_error
 
-async def generate_derived_artifact(artifact_type: str, requirements: str, source_uml: str, classes: List[ClassModel], correlation_id: str) -> str:
-    log.info(f"Process started for {artifact_type}")
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "4"))
+DATABASE_PIPELINE_STRATEGY = os.getenv("DATABASE_PIPELINE_STRATEGY", "serial")
+RENDER_MODE = os.getenv("RENDER_MODE", "llm")
+CLASS_ENCODING = os.getenv("CLASS_ENCODING", "json")
+ERD_MEMO_MAX_ENTRIES = int(os.getenv("ERD_MEMO_MAX_ENTRIES", "256"))
+
+erd_memo = MemoryTier(ERD_MEMO_MAX_ENTRIES, CACHE_TTL_SECONDS)
+
+@timed("prompt_build")
+def serialize_classes(classes: List[ClassModel], encoding: Optional[ClassEncoding] = None) -> str:
+    return encode_classes(classes, encoding or ClassEncoding(CLASS_ENCODING))
+
+def build_derived_artifact_messages(artifact_type: str, requirements: str, source_uml: str, classes: List[ClassModel], class_json: Optional[str] = None) -> list:
     artifact_key = artifact_type.upper()
-    if artifact_key == "DATABASE":
-        extra_context = DATABASE_CODE_RULES
-    elif artifact_key == "API":
-        extra_context = API_CONTRACT_RULES
-    else:
-        raise ValueError("Invalid derived artifact type") 
-    class_data = [cls.model_dump() for cls in classes]
+    if class_json is None:
+        class_json = serialize_classes(classes)
     enriched_requirements = (
         f"Original User Requirements:\n{requirements}\n\n"
         f"STRICT STRUCTURED DATA MODEL (SOURCE OF TRUTH):\n"
-        f"{json.dumps(class_data, indent=2)}"
+        f"{class_json}"
     )
-    messages = get_prompt_derived_artifact( extra_context, source_uml if artifact_key == "DATABASE" else "", enriched_requirements)
-    llm_response = await get_chat_completion(messages, correlation_id=correlation_id)
+    return get_prompt_derived_artifact(artifact_key, source_uml if artifact_key == "DATABASE" else "", enriched_requirements)
+
+async def generate_derived_artifact(artifact_type: str, requirements: str, source_uml: str, classes: List[ClassModel], correlation_id: str, class_json: Optional[str] = None) -> str:
+    log.info(f"Process started for {artifact_type}")
+    artifact_key = artifact_type.upper()
+    messages = build_derived_artifact_messages(artifact_type, requirements, source_uml, classes, class_json)
+    llm_response = await get_chat_completion(messages, correlation_id=correlation_id, operation="derive")
     final_output = strip_markdown(llm_response)
     log.info(f"Derived artifact ({artifact_key}) generated", extra={'correlation_id': correlation_id})
-    #print(final_output)
     return final_output
 
-async def generate_diagram(diagram_type: str, requirements: str, language: str, classes: List[ClassModel], flag: bool, correlation_id: str) -> str:
-    log.info(f"Process started for {diagram_type} using {language}")
-    diag_type_key = diagram_type.upper()
-    language_key = language.upper()
-    class_data = [cls.model_dump() for cls in classes]
+def build_diagram_messages(diagram_type: str, requirements: str, language: str, classes: List[ClassModel], class_json: Optional[str] = None) -> list:
+    if class_json is None:
+        class_json = serialize_classes(classes)
     final_requirements = (
         f"User Requirements Context: {requirements}\n\n"
         f"STRICT ARCHITECTURAL STRUCTURE TO FOLLOW:\n"
-        f"{json.dumps(class_data, indent=2)}"
+        f"{class_json}"
     )
-    selected_language_rules = MAPPING.get(language_key, MAPPING.get("PLANTUML"))
-    extra_context = f"Generate a standard, clean {language_key} diagram."
-    for keywords, context in selected_language_rules.items():
-        if any(key in diag_type_key for key in keywords):
-            extra_context = context
-            break    
-    extra_context = f"STRICT SCHEMA MAPPING: Transform the provided JSON into a {diag_type_key}. {extra_context}"
-    messages = get_prompt_message(diagram_type, extra_context, final_requirements, language)
-    raw_response = await get_chat_completion(messages, correlation_id=correlation_id)
-    actual_response = strip_markdown(raw_response) 
+    return get_prompt_message(diagram_type, final_requirements, language)
+
+async def lint_and_repair(code: str, diagram_type: str, language: str, correlation_id: str) -> str:
+    if not DIAGRAM_LINT_ENABLED:
+        return code
+    lint_stats.checked += 1
+    fixed, fixes = fix_diagram(code, language, diagram_type)
+    if fixes:
+        lint_stats.fixed += 1
+        log.info(f"Applied lint fixes: {'; '.join(fixes)}", extra={'correlation_id': correlation_id})
+    issues = lint_diagram(fixed, language)
+    if not issues:
+        return fixed
+    span = issue_span(issues, len(fixed.splitlines()))
+    if span is None or not LINT_REPAIR_ENABLED:
+        lint_stats.unresolved += 1
+        log.warning(f"Unresolved lint issues: {'; '.join(i.describe() for i in issues)}", extra={'correlation_id': correlation_id})
+        return fixed
+    # only the offending lines go back to the model, never the whole diagram
+    instruction = "Fix only these syntax errors and change nothing else:\n" + "\n".join(f"- {i.describe()}" for i in issues)
+    messages = get_prompt_refine_fragment(diagram_type, fixed, span, outline(fixed, span), instruction, language)
+    try:
+        raw_response = await get_chat_completion(messages, correlation_id=correlation_id, operation="lint_repair")
+    except (LLMServiceError, ServiceOverloadedError, PromptTooLargeError) as e:
+        lint_stats.unresolved += 1
+        log.warning(f"Lint repair skipped: {e.message}", extra={'correlation_id': correlation_id})
+        return fixed
+    repaired, _ = fix_diagram(splice_fragment(fixed, span, strip_markdown(raw_response)), language, diagram_type)
+    remaining = lint_diagram(repaired, language)
+    if remaining:
+        lint_stats.unresolved += 1
+        log.warning(f"Lint repair left {len(remaining)} issue(s)", extra={'correlation_id': correlation_id})
+        return repaired if len(remaining) < len(issues) else fixed
+    lint_stats.repaired += 1
+    log.info(f"Repaired {len(issues)} lint issue(s) on lines {span[0] + 1}-{span[1]}", extra={'correlation_id': correlation_id})
+    return repaired
+
+async def generate_diagram(diagram_type: str, requirements: str, language: str, classes: List[ClassModel], flag: bool, correlation_id: str, class_json: Optional[str] = None) -> str:
+    log.info(f"Process started for {diagram_type} using {language}")
+    diag_type_key = diagram_type.upper()
+    messages = build_diagram_messages(diagram_type, requirements, language, classes, class_json)
+    raw_response = await get_chat_completion(messages, correlation_id=correlation_id, operation="generate")
+    actual_response = await lint_and_repair(strip_markdown(raw_response), diagram_type, language, correlation_id)
     if not flag:
         log.info(f"Successfully generated {diag_type_key} diagram code", extra={'correlation_id': correlation_id})
-    print(actual_response)    
     return actual_response
 
+def build_refine_artifact_messages(artifact_type: str, existing_code: str, user_instruction: str) -> list:
+    return get_prompt_refine_artifact(artifact_type.upper(), existing_code, user_instruction)
+
 async def refine_derived_artifact(artifact_type: str, existing_code: str, user_instruction: str, correlation_id: str) -> str:
     log.info(f"Process started for {artifact_type}")
     artifact_key = artifact_type.upper()
-    if artifact_key == "DATABASE":
-        extra_context = DATABASE_CODE_RULES
-    elif artifact_key == "API":
-        extra_context = API_CONTRACT_RULES
-    else:
-        raise ValueError("Invalid derived artifact type")
-    messages = get_prompt_refine_artifact(extra_context, existing_code, user_instruction)
-    llm_response = await get_chat_completion(messages, correlation_id=correlation_id)
+    messages = build_refine_artifact_messages(artifact_type, existing_code, user_instruction)
+    llm_response = await get_chat_completion(messages, correlation_id=correlation_id, operation="refine")
     log.info(f"Refined {artifact_key} artifact", extra={'correlation_id': correlation_id})
     return strip_markdown(llm_response)
 
+def build_refine_diagram_messages(diagram_type: str, existing_diagram_code: str, user_instruction: str, language: str) -> list:
+    return get_prompt_refine_diagram(diagram_type, existing_diagram_code, user_instruction, language)
+
 async def refine_diagram(diagram_type: str, existing_diagram_code: str, user_instruction: str, language: str, correlation_id: str) -> str:
     log.info(f"Process started for {diagram_type} using {language}")
     diag_type_key = diagram_type.upper()
-    language_key = language.upper()
-    selected_language_rules = MAPPING.get(language_key, MAPPING.get("PLANTUML"))
-    rule_context = f"Maintain standard {language_key} syntax."
-    for keywords, context in selected_language_rules.items():
-        if any(key in diag_type_key for key in keywords):
-            rule_context = context
-            break
-    extra_context = f"REFINEMENT MODE: {rule_context}"
-    messages = get_prompt_refine_diagram(extra_context, existing_diagram_code, user_instruction, language)
-    raw_response = await get_chat_completion(messages, correlation_id=correlation_id)
+    messages = build_refine_diagram_messages(diagram_type, existing_diagram_code, user_instruction, language)
+    raw_response = await get_chat_completion(messages, correlation_id=correlation_id, operation="refine")
     log.info(f"Refined {diag_type_key} diagram code", extra={'correlation_id': correlation_id})
-    #print(strip_markdown(raw_response))
-    return strip_markdown(raw_response)
\ No newline at end of file
+    return await lint_and_repair(strip_markdown(raw_response), diagram_type, language, correlation_id)
+
+async def refine_diagram_fragment(diagram_type: str, existing_diagram_code: str, span: Tuple[int, int], user_instruction: str, language: str, correlation_id: str) -> str:
+    log.info(f"Process started for lines {span[0] + 1}-{span[1]} of {diagram_type} using {language}")
+    diag_type_key = diagram_type.upper()
+    messages = get_prompt_refine_fragment(
+        diagram_type, existing_diagram_code, span, outline(existing_diagram_code, span), user_instruction, language
+    )
+    raw_response = await get_chat_completion(messages, correlation_id=correlation_id, operation="refine_fragment")
+    log.info(f"Refined fragment of {diag_type_key} diagram code", extra={'correlation_id': correlation_id})
+    refined_code = splice_fragment(existing_diagram_code, span, strip_markdown(raw_response))
+    return await lint_and_repair(refined_code, diagram_type, language, correlation_id)
+
+def _elapsed_ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 1)
+
+async def _generate_erd_context(gen_req: GenerateRequest, correlation_id: str, class_json: Optional[str], graph_key: str) -> str:
+    uml_context = await generate_diagram(
+        "ERD",
+        gen_req.requirementsText,
+        "PLANTUML",
+        gen_req.classes,
+        flag=True,
+        correlation_id=correlation_id,
+        class_json=class_json
+    )
+    erd_memo.set(graph_key, uml_context)
+    return uml_context
+
+async def _concurrent_erd(gen_req: GenerateRequest, correlation_id: str, class_json: Optional[str], graph_key: str) -> Tuple[Optional[str], float]:
+    # runs alongside the SQL step, which already has a deterministic ERD, so a failure here costs nothing but the ERD
+    started = time.perf_counter()
+    try:
+        return await _generate_erd_context(gen_req, correlation_id, class_json, graph_key), _elapsed_ms(started)
+    except (LLMServiceError, ServiceOverloadedError, PromptTooLargeError) as e:
+        log.warning(f"Concurrent ERD generation failed: {e.message}", extra={'correlation_id': correlation_id})
+        return None, _elapsed_ms(started)
+
+async def resolve_erd_context(gen_req: GenerateRequest, correlation_id: str, class_json: Optional[str] = None) -> Tuple[str, dict]:
+    strategy = gen_req.databaseStrategy or DatabaseStrategy(DATABASE_PIPELINE_STRATEGY)
+    graph_key = graph_fingerprint(gen_req.classes)
+    erd_started = time.perf_counter()
+    if strategy == DatabaseStrategy.serial:
+        uml_context = await _generate_erd_context(gen_req, correlation_id, class_json, graph_key)
+        erd_source = "llm"
+    elif strategy == DatabaseStrategy.parallel and erd_memo.get(graph_key) is not None:
+        uml_context = erd_memo.get(graph_key)
+        erd_source = "cached"
+    else:
+        # on a parallel memo miss run_generation generates the LLM ERD next to the SQL step
+        uml_context = render_erd_plantuml(gen_req.classes)
+        erd_source = "deterministic"
+    log.info(f"DATABASE pipeline using {strategy.value} strategy (ERD source: {erd_source})", extra={'correlation_id': correlation_id})
+    return uml_context, {"strategy": strategy, "erdSource": erd_source, "timings": {"erdMs": _elapsed_ms(erd_started)}}
+
+def deterministic_renderer(gen_req: GenerateRequest):
+    mode = gen_req.renderMode or RenderMode(RENDER_MODE)
+    if mode == RenderMode.llm or not gen_req.classes:
+        return None
+    if gen_req.diagramType.value in GENERATORS:
+        return GENERATORS[gen_req.diagramType.value]
+    # narrative diagram types have no renderer and always go through the LLM
+    return get_renderer(gen_req.diagramType.value, gen_req.codeType)
+
+def output_meta(gen_req: GenerateRequest) -> dict:
+    if gen_req.diagramType == DiagramType.DATABASE:
+        return {"diagramType": gen_req.diagramType, "codeType": "SQL/NoSQL", "isRenderable": False}
+    if gen_req.diagramType == DiagramType.API:
+        return {"diagramType": gen_req.diagramType, "codeType": "OPENAPI", "isRenderable": False}
+    return {"diagramType": gen_req.diagramType, "codeType": gen_req.codeType, "isRenderable": True}
+
+async def render_deterministic(gen_req: GenerateRequest, renderer, correlation_id: str) -> dict:
+    diagramType = gen_req.diagramType
+    diagram_code = renderer(gen_req.classes)
+    log.info(f"Rendered {diagramType.value} deterministically", extra={'correlation_id': correlation_id})
+    polished = gen_req.polish and diagramType.value in GENERATORS
+    if polished:
+        diagram_code = await refine_derived_artifact(diagramType.value, diagram_code, POLISH_INSTRUCTION, correlation_id=correlation_id)
+    return {**output_meta(gen_req), "diagramCode": diagram_code, "renderMode": RenderMode.deterministic, "polished": polished}
+
+def resolve_partition_mode(gen_req: GenerateRequest) -> PartitionMode:
+    # derived artifacts need the whole model at once, so only diagrams are ever split
+    if gen_req.diagramType in (DiagramType.DATABASE, DiagramType.API) or len(gen_req.classes) < 2:
+        return PartitionMode.single
+    mode = gen_req.partitionMode or PartitionMode(PARTITION_MODE)
+    if mode == PartitionMode.auto:
+        if len(gen_req.classes) < PARTITION_THRESHOLD:
+            return PartitionMode.single
+        mode = PartitionMode.stitched
+    if mode == PartitionMode.stitched and not can_stitch(gen_req.diagramType.value, gen_req.codeType):
+        return PartitionMode.linked
+    return mode
+
+async def _generate_part(gen_req: GenerateRequest, partition: Partition, total: int, correlation_id: str, semaphore: asyncio.Semaphore):
+    report = {"index": partition.index, "title": partition.title, "classes": len(partition.classes)}
+    diagramType = gen_req.diagramType.value
+    async with semaphore:
+        started = time.perf_counter()
+        try:
+            code = await generate_diagram(
+                diagramType,
+                gen_req.requirementsText,
+                gen_req.codeType,
+                partition.classes,
+                flag=False,
+                correlation_id=correlation_id,
+                class_json=serialize_classes(partition.classes, gen_req.classEncoding)
+            )
+            report["renderMode"] = RenderMode.llm
+        except (LLMServiceError, ServiceOverloadedError, PromptTooLargeError) as e:
+            renderer = get_renderer(diagramType, gen_req.codeType)
+            if renderer is None:
+                raise
+            # a part that cannot be generated is rendered from its classes rather than failing the whole diagram
+            code = renderer(partition.classes)
+            report["renderMode"] = RenderMode.deterministic
+            report["error"] = e.message
+        report["elapsedMs"] = _elapsed_ms(started)
+    log.info(
+        f"Generated part {partition.index + 1}/{total} ({report['classes']} classes) in {report['elapsedMs']}ms",
+        extra={'correlation_id': correlation_id}
+    )
+    return code, report
+
+async def run_partitioned_generation(gen_req: GenerateRequest, mode: PartitionMode, correlation_id: str) -> dict:
+    started = time.perf_counter()
+    diagramType = gen_req.diagramType.value
+    # clustering a few hundred classes takes long enough to stall other requests on the loop
+    partitions, cross = await asyncio.to_thread(partition_classes, gen_req.classes, PARTITION_MAX_CLASSES)
+    log.info(
+        f"Partitioned {len(gen_req.classes)} classes into {len(partitions)} {diagramType} subdiagrams "
+        f"({len(cross)} relationships cross parts, mode={mode.value})", extra={'correlation_id': correlation_id}
+    )
+    semaphore = asyncio.Semaphore(PARTITION_MAX_CONCURRENCY)
+    outcomes = await asyncio.gather(*(
+        _generate_part(gen_req, partition, len(partitions), correlation_id, semaphore) for partition in partitions
+    ))
+    codes = [code for code, _ in outcomes]
+    reports = [report for _, report in outcomes]
+    fallbacks = sum(1 for report in reports if report["renderMode"] == RenderMode.deterministic)
+    result = {**output_meta(gen_req), "renderMode": RenderMode.deterministic if fallbacks == len(reports) else RenderMode.llm}
+    if fallbacks:
+        # some parts were rendered from their classes after an upstream failure; this result must not be reused
+        result["degraded"] = True
+        log.warning(f"{fallbacks} of {len(reports)} parts fell back to deterministic rendering", extra={'correlation_id': correlation_id})
+    if mode == PartitionMode.stitched:
+        stitched = stitch(partitions, codes, cross, diagramType, gen_req.codeType)
+        result["diagramCode"] = await lint_and_repair(stitched, diagramType, gen_req.codeType, correlation_id)
+    else:
+        result["diagramCode"] = overview(partitions, cross, gen_req.codeType)
+        result["subdiagrams"] = [
+            {
+                "index": partition.index,
+                "title": partition.title,
+                "classes": [cls.className for cls in partition.classes],
+                "diagramCode": code,
+                "links": cross_links(partition, cross),
+            }
+            for partition, code in zip(partitions, codes)
+        ]
+    result["partition"] = {"mode": mode, **partition_stats(partitions, cross), "totalMs": _elapsed_ms(started), "parts": reports}
+    return result
+
+async def run_generation(gen_req: GenerateRequest, correlation_id: str, class_json: Optional[str] = None) -> dict:
+    diagramType = gen_req.diagramType
+    renderer = deterministic_renderer(gen_req)
+    if renderer is not None:
+        return await render_deterministic(gen_req, renderer, correlation_id)
+    partition_mode = resolve_partition_mode(gen_req)
+    if partition_mode != PartitionMode.single:
+        return await run_partitioned_generation(gen_req, partition_mode, correlation_id)
+    if class_json is None:
+        class_json = serialize_classes(gen_req.classes, gen_req.classEncoding)
+    if diagramType == DiagramType.DATABASE:
+        started = time.perf_counter()
+        uml_context, pipeline = await resolve_erd_context(gen_req, correlation_id, class_json)
+        sql_started = time.perf_counter()
+        sql_step = generate_derived_artifact(
+            "DATABASE",
+            gen_req.requirementsText,
+            uml_context,
+            gen_req.classes,
+            correlation_id=correlation_id,
+            class_json=class_json
+        )
+        erd_code = None
+        if pipeline["strategy"] == DatabaseStrategy.parallel and pipeline["erdSource"] == "deterministic":
+            # the SQL step does not wait for the LLM ERD; both run now and the ERD is returned and memoized
+            final_output, (erd_code, erd_ms) = await asyncio.gather(
+                sql_step, _concurrent_erd(gen_req, correlation_id, class_json, graph_fingerprint(gen_req.classes))
+            )
+            pipeline["timings"]["concurrentErdMs"] = erd_ms
+        else:
+            final_output = await sql_step
+        pipeline["timings"]["sqlMs"] = _elapsed_ms(sql_started)
+        pipeline["timings"]["totalMs"] = _elapsed_ms(started)
+        result = {
+            "diagramType": diagramType,
+            "codeType": "SQL/NoSQL",
+            "diagramCode": final_output,
+            "isRenderable": False,
+            "renderMode": RenderMode.llm,
+            "pipeline": pipeline
+        }
+        if erd_code is not None:
+            result["erdCode"] = erd_code
+        return result
+    if diagramType == DiagramType.API:
+        final_output = await generate_derived_artifact(
+            "API",
+            gen_req.requirementsText,
+            "",
+            gen_req.classes,
+            correlation_id=correlation_id,
+            class_json=class_json
+        )
+        return {
+            "diagramType": diagramType,
+            "codeType": "OPENAPI",
+            "diagramCode": final_output,
+            "isRenderable": False,
+            "renderMode": RenderMode.llm
+        }
+    diagram_code = await generate_diagram(
+        diagramType.value,
+        gen_req.requirementsText,
+        gen_req.codeType,
+        gen_req.classes,
+        flag=False,
+        correlation_id=correlation_id,
+        class_json=class_json
+    )
+    return {
+        "diagramType": diagramType,
+        "codeType": gen_req.codeType,
+        "diagramCode": diagram_code,
+        "isRenderable": True,
+        "renderMode": RenderMode.llm
+    }
+
+async def prepare_generation_stream(gen_req: GenerateRequest, correlation_id: str) -> Tuple[Optional[list], dict]:
+    diagramType = gen_req.diagramType
+    renderer = deterministic_renderer(gen_req)
+    if renderer is not None:
+        return None, await render_deterministic(gen_req, renderer, correlation_id)
+    partition_mode = resolve_partition_mode(gen_req)
+    if partition_mode != PartitionMode.single:
+        # parts are generated concurrently and stitched, so there is no single completion to stream
+        return None, await run_partitioned_generation(gen_req, partition_mode, correlation_id)
+    class_json = serialize_classes(gen_req.classes, gen_req.classEncoding)
+    if diagramType == DiagramType.DATABASE:
+        # a stream has nowhere to return a second artifact, so a parallel memo miss streams off the deterministic ERD alone
+        uml_context, pipeline = await resolve_erd_context(gen_req, correlation_id, class_json)
+        messages = build_derived_artifact_messages("DATABASE", gen_req.requirementsText, uml_context, gen_req.classes, class_json)
+        return messages, {**output_meta(gen_req), "renderMode": RenderMode.llm, "pipeline": pipeline}
+    if diagramType == DiagramType.API:
+        messages = build_derived_artifact_messages("API", gen_req.requirementsText, "", gen_req.classes, class_json)
+        return messages, {**output_meta(gen_req), "renderMode": RenderMode.llm}
+    messages = build_diagram_messages(diagramType.value, gen_req.requirementsText, gen_req.codeType, gen_req.classes, class_json)
+    return messages, {**output_meta(gen_req), "renderMode": RenderMode.llm}
+
+def refine_meta(ref_req: RefineRequest) -> dict:
+    diagramType = ref_req.diagramType
+    if diagramType in [DiagramType.DATABASE, DiagramType.API]:
+        is_db = (diagramType == DiagramType.DATABASE)
+        return {"diagramType": diagramType, "codeType": "JSON/SQL" if is_db else "OPENAPI", "isRenderable": False}
+    return {"diagramType": diagramType, "codeType": ref_req.codeType, "isRenderable": True}
+
+async def resolve_refine_base(ref_req: RefineRequest) -> Tuple[Optional[DiagramSession], Optional[int], str]:
+    if ref_req.diagramId is None:
+        return None, None, ref_req.diagramCode
+    session = await diagram_store.get(ref_req.diagramId)
+    if session is None:
+        if ref_req.diagramCode is not None:
+            return None, None, ref_req.diagramCode
+        raise DiagramNotFoundError(f"Diagram {ref_req.diagramId} was not found or has expired.")
+    if ref_req.diagramCode is not None and ref_req.diagramCode != session.code():
+        # client-side edits become a version of their own
+        version = await diagram_store.append(session, ref_req.diagramCode)
+        return session, version, ref_req.diagramCode
+    version = ref_req.baseVersion if ref_req.baseVersion is not None else session.version
+    code = session.code(version)
+    if code is None:
+        raise DiagramNotFoundError(f"Version {version} of diagram {ref_req.diagramId} is no longer available.")
+    return session, version, code
+
+async def open_diagram_session(result: dict, gen_req: Optional[GenerateRequest] = None) -> dict:
+    classes = [cls.model_dump(mode="json") for cls in gen_req.classes] if gen_req is not None else None
+    source_key = RequestFingerprint(gen_req).source if gen_req is not None else None
+    session = await diagram_store.create(
+        result["diagramType"].value, result["codeType"], result["isRenderable"], result["diagramCode"], classes, source_key
+    )
+    return {"diagramId": session.diagram_id, "version": session.version}
+
+async def patch_with_llm(gen_req: GenerateRequest, base_code: str, delta: ClassDelta, correlation_id: str) -> str:
+    # a small patch prompt limited to the affected entities instead of a full regeneration
+    instruction = "Update the existing code to match these class model changes and change nothing else:\n" + "\n".join(
+        f"- {line}" for line in delta.describe()
+    )
+    diagramType = gen_req.diagramType.value
+    if not output_meta(gen_req)["isRenderable"]:
+        return await refine_derived_artifact(diagramType, base_code, instruction, correlation_id=correlation_id)
+    span = select_fragment(base_code, delta.terms())
+    if span is None:
+        return await refine_diagram(diagramType, base_code, instruction, gen_req.codeType, correlation_id=correlation_id)
+    return await refine_diagram_fragment(diagramType, base_code, span, instruction, gen_req.codeType, correlation_id=correlation_id)
+
+async def run_incremental_generation(gen_req: GenerateRequest, correlation_id: str) -> dict:
+    started = time.perf_counter()
+    session = await diagram_store.get(gen_req.diagramId)
+    source_key = RequestFingerprint(gen_req).source
+    classes = [cls.model_dump(mode="json") for cls in gen_req.classes]
+    if session is None:
+        reason = "diagram not found"
+    elif session.classes is None:
+        reason = "no class model on record"
+    elif session.source_key != source_key:
+        reason = "requirements or options changed"
+    else:
+        reason = None
+    if reason is not None:
+        log.info(f"Full regeneration for diagram {gen_req.diagramId}: {reason}", extra={'correlation_id': correlation_id})
+        result = await run_generation(gen_req, correlation_id)
+        if session is None:
+            placement = await open_diagram_session(result, gen_req)
+        else:
+            placement = {"diagramId": session.diagram_id, "version": await diagram_store.append(session, result["diagramCode"], classes, source_key)}
+        return {**result, **placement, "incremental": {"strategy": "full", "reason": reason, "elapsedMs": _elapsed_ms(started)}}
+    base_version = session.version
+    base_code = session.code()
+    old_classes = [ClassModel(**cls) for cls in session.classes]
+    delta = diff_classes(old_classes, gen_req.classes)
+    diagramType, language = gen_req.diagramType.value, gen_req.codeType.upper()
+    render_mode = RenderMode.llm
+    if delta.is_empty():
+        code, strategy = base_code, "unchanged"
+    elif (code := rerender(base_code, diagramType, language, old_classes, gen_req.classes)) is not None:
+        strategy, render_mode = "rerendered", RenderMode.deterministic
+    elif (code := patch_diagram(base_code, delta, diagramType, language)) is not None:
+        strategy = "patched"
+    else:
+        code, strategy = await patch_with_llm(gen_req, base_code, delta, correlation_id), "llm_patch"
+    # a non-empty delta always gets a version, so the next diff starts from this class model
+    version = base_version if delta.is_empty() else await diagram_store.append(session, code, classes, source_key)
+    log.info(
+        f"Incremental regeneration of {diagramType} diagram {session.diagram_id} via {strategy} "
+        f"({len(delta.describe())} change(s))", extra={'correlation_id': correlation_id}
+    )
+    return {
+        **output_meta(gen_req),
+        "diagramCode": code,
+        "renderMode": render_mode,
+        "diagramId": session.diagram_id,
+        "version": version,
+        "baseVersion": base_version,
+        "incremental": {"strategy": strategy, "delta": delta.summary(), "elapsedMs": _elapsed_ms(started)},
+    }
+
+async def get_diagram_version(diagram_id: str, version: Optional[int] = None) -> dict:
+    session = await diagram_store.get(diagram_id)
+    if session is None:
+        raise DiagramNotFoundError(f"Diagram {diagram_id} was not found or has expired.")
+    code = session.code(version)
+    if code is None:
+        raise DiagramNotFoundError(f"Version {version} of diagram {diagram_id} is no longer available.")
+    return {
+        "diagramId": diagram_id,
+        "diagramType": session.diagram_type,
+        "codeType": session.code_type,
+        "isRenderable": session.is_renderable,
+        "version": version or session.version,
+        "latestVersion": session.version,
+        "diagramCode": code,
+    }
+
+async def record_refinement(ref_req: RefineRequest, session: Optional[DiagramSession], base_version: Optional[int], base_code: str, refined_code: str) -> dict:
+    meta = refine_meta(ref_req)
+    if session is None:
+        session = await diagram_store.create(ref_req.diagramType.value, meta["codeType"], meta["isRenderable"], base_code)
+        base_version = session.version
+    version = await diagram_store.append(session, refined_code)
+    return {"diagramId": session.diagram_id, "version": version, "baseVersion": base_version}
+
+async def run_refinement(ref_req: RefineRequest, correlation_id: str) -> dict:
+    session, base_version, base_code = await resolve_refine_base(ref_req)
+    diagramType = ref_req.diagramType
+    meta = refine_meta(ref_req)
+    if not meta["isRenderable"]:
+        refined_code = await refine_derived_artifact(diagramType.value, base_code, ref_req.userInstruction, correlation_id=correlation_id)
+    else:
+        span = select_fragment(base_code, ref_req.userInstruction)
+        if span is None:
+            refined_code = await refine_diagram(diagramType.value, base_code, ref_req.userInstruction, ref_req.codeType, correlation_id=correlation_id)
+        else:
+            refined_code = await refine_diagram_fragment(diagramType.value, base_code, span, ref_req.userInstruction, ref_req.codeType, correlation_id=correlation_id)
+    placement = await record_refinement(ref_req, session, base_version, base_code, refined_code)
+    result = {**meta, **placement}
+    if ref_req.responseFormat == RefineFormat.diff:
+        result["diff"] = unified_diff(base_code, refined_code, placement["baseVersion"], placement["version"])
+    else:
+        result["diagramCode"] = refined_code
+    return result
+
+async def prepare_refine_stream(ref_req: RefineRequest) -> Tuple[list, dict, Callable[[str], Awaitable[dict]]]:
+    session, base_version, base_code = await resolve_refine_base(ref_req)
+    diagramType = ref_req.diagramType
+    meta = refine_meta(ref_req)
+    if not meta["isRenderable"]:
+        messages = build_refine_artifact_messages(diagramType.value, base_code, ref_req.userInstruction)
+    else:
+        messages = build_refine_diagram_messages(diagramType.value, base_code, ref_req.userInstruction, ref_req.codeType)
+
+    async def on_complete(refined_code: str) -> dict:
+        # the streamed result becomes a version like any other refinement, so the next /refine builds on it
+        return await record_refinement(ref_req, session, base_version, base_code, refined_code)
+    return messages, meta, on_complete
+
+async def run_batch_generation(batch_req: BatchGenerateRequest, correlation_id: str):
+    class_json = serialize_classes(batch_req.classes, batch_req.classEncoding)
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+    log.info(f"Batch generation started for {len(batch_req.targets)} targets", extra={'correlation_id': correlation_id})
+
+    async def run_target(index: int, target) -> dict:
+        gen_req = GenerateRequest.model_construct(
+            diagramType=target.diagramType,
+            codeType=target.codeType,
+            requirementsText=batch_req.requirementsText,
+            classes=batch_req.classes,
+            databaseStrategy=target.databaseStrategy,
+            renderMode=target.renderMode,
+            polish=target.polish,
+            classEncoding=batch_req.classEncoding,
+            partitionMode=target.partitionMode
+        )
+        outcome = {"index": index, "diagramType": target.diagramType, "codeType": target.codeType}
+        try:
+            async with semaphore:
+                result = await run_generation(gen_req, correlation_id, class_json=class_json)
+            return {**outcome, "status": "SUCCESS", "data": result, "error": None}
+        except (LLMServiceError, ServiceOverloadedError, PromptTooLargeError) as e:
+            error = describe_error(e)
+            record_error(error["code"])
+            return {**outcome, "status": "FAILURE", "data": None, "error": error}
+        except Exception as e:
+            log.exception(f"Batch target {target.diagramType.value} failed: {str(e)}", extra={'correlation_id': correlation_id})
+            error = describe_error(e)
+            record_error(error["code"])
+            return {**outcome, "status": "FAILURE", "data": None, "error": error}
+
+    tasks = [asyncio.create_task(run_target(i, t)) for i, t in enumerate(batch_req.targets)]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,272 @@
+import re
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Tuple
+from app.model import ClassModel, Attribute, Relationship, AttributeNature
+from app.services.render import (alias, get_renderer, plantuml_class_attribute, plantuml_erd_attribute,
+    mermaid_class_attribute, class_relationship, plantuml_erd_relationship)
+from app.services.codegen import GENERATORS
+from app.services.lint import lint_diagram
+
+_BLOCK_START = re.compile(
+    r'^\s*(?:abstract\s+class|class|entity|interface|enum)\s+(?:"(?P<quoted>[^"]+)"|(?P<bare>[\w.]+))'
+    r'(?:\s+as\s+(?P<alias>[\w.]+))?[^{]*\{\s*$'
+)
+_BLOCK_END = re.compile(r"^\s*\}\s*$")
+_FOOTER = re.compile(r"^\s*@enduml\b")
+_LINK = re.compile(r"--|\.\.")
+_INDENT = re.compile(r"^\s*")
+
+def _rel_key(rel: Relationship) -> tuple:
+    return (rel.source.strip(), rel.target.strip(), rel.nature.value, rel.sourcetype.value, rel.targettype.value, (rel.label or "").strip())
+
+def _flags(attr: Attribute) -> str:
+    return f"{attr.nature.value}, {'required' if attr.required else 'optional'}"
+
+def _label(rel: Relationship) -> str:
+    return f' labelled "{rel.label}"' if rel.label else ""
+
+class ClassDelta:
+    def __init__(self):
+        self.added_classes: List[ClassModel] = []
+        self.removed_classes: List[str] = []
+        self.added_attributes: List[Tuple[str, Attribute]] = []
+        self.removed_attributes: List[Tuple[str, Attribute]] = []
+        self.changed_attributes: List[Tuple[str, Attribute]] = []
+        self.added_relationships: List[Relationship] = []
+        self.removed_relationships: List[Relationship] = []
+
+    def is_empty(self) -> bool:
+        return not (self.added_classes or self.removed_classes or self.added_attributes or self.removed_attributes
+                    or self.changed_attributes or self.added_relationships or self.removed_relationships)
+
+    def terms(self) -> str:
+        # names the patch touches, used to pick the fragment of the diagram an LLM patch sees
+        names = {cls.className for cls in self.added_classes} | set(self.removed_classes)
+        for name, attr in self.added_attributes + self.removed_attributes + self.changed_attributes:
+            names |= {name, attr.name}
+        for rel in self.added_relationships + self.removed_relationships:
+            names |= {rel.source, rel.target}
+        return " ".join(sorted(names))
+
+    def describe(self) -> List[str]:
+        lines = []
+        for cls in self.added_classes:
+            attrs = ", ".join(f"{a.name}: {a.type} ({_flags(a)})" for a in cls.attributes) or "no attributes"
+            lines.append(f"Add class {cls.className} with {attrs}")
+        for name in self.removed_classes:
+            lines.append(f"Remove class {name} and every relationship that touches it")
+        for name, attr in self.removed_attributes:
+            lines.append(f"Remove attribute {attr.name} from {name}")
+        for name, attr in self.changed_attributes:
+            lines.append(f"Change attribute {attr.name} of {name} to {attr.type} ({_flags(attr)})")
+        for name, attr in self.added_attributes:
+            lines.append(f"Add attribute {attr.name}: {attr.type} ({_flags(attr)}) to {name}")
+        for rel in self.removed_relationships:
+            lines.append(f"Remove the {rel.nature.value} relationship {rel.source} -> {rel.target}{_label(rel)}")
+        for rel in self.added_relationships:
+            lines.append(
+                f"Add a {rel.nature.value} relationship {rel.source} ({rel.sourcetype.value}) -> "
+                f"{rel.target} ({rel.targettype.value}){_label(rel)}"
+            )
+        return lines
+
+    def summary(self) -> dict:
+        changed = {name for name, _ in self.added_attributes + self.removed_attributes + self.changed_attributes}
+        return {
+            "addedClasses": [cls.className for cls in self.added_classes],
+            "removedClasses": self.removed_classes,
+            "changedClasses": sorted(changed),
+            "addedRelationships": len(self.added_relationships),
+            "removedRelationships": len(self.removed_relationships),
+        }
+
+def diff_classes(old: List[ClassModel], new: List[ClassModel]) -> ClassDelta:
+    # structural diff keyed by class and attribute name; order never counts as a change
+    delta = ClassDelta()
+    old_by_name = {cls.className.strip(): cls for cls in old}
+    new_by_name = {cls.className.strip(): cls for cls in new}
+    for name, cls in new_by_name.items():
+        previous = old_by_name.get(name)
+        if previous is None:
+            delta.added_classes.append(cls)
+            continue
+        old_attrs = {attr.name.strip(): attr for attr in previous.attributes}
+        for attr in cls.attributes:
+            before = old_attrs.pop(attr.name.strip(), None)
+            if before is None:
+                delta.added_attributes.append((name, attr))
+            elif before != attr:
+                delta.changed_attributes.append((name, attr))
+        delta.removed_attributes.extend((name, attr) for attr in old_attrs.values())
+    delta.removed_classes = [name for name in old_by_name if name not in new_by_name]
+    old_rels = {_rel_key(rel): rel for cls in old for rel in cls.relationships}
+    new_rels = {_rel_key(rel): rel for cls in new for rel in cls.relationships}
+    old_counts = Counter(_rel_key(rel) for cls in old for rel in cls.relationships)
+    new_counts = Counter(_rel_key(rel) for cls in new for rel in cls.relationships)
+    for key, count in (new_counts - old_counts).items():
+        delta.added_relationships.extend([new_rels[key]] * count)
+    for key, count in (old_counts - new_counts).items():
+        delta.removed_relationships.extend([old_rels[key]] * count)
+    return delta
+
+def rerender(code: str, diagram_type: str, language: str, old: List[ClassModel], new: List[ClassModel]) -> Optional[str]:
+    # output that came from a deterministic renderer is reproduced from the new model outright
+    render = GENERATORS.get(diagram_type) or get_renderer(diagram_type, language)
+    if render is None or render(old) != code:
+        return None
+    return render(new)
+
+class _Unpatchable(Exception):
+    pass
+
+class _Syntax:
+    def __init__(self, attribute: Callable, relationship: Callable, attribute_indent: str, relationship_indent: str,
+                 keys_first: bool = False):
+        self.attribute = attribute
+        self.relationship = relationship
+        self.attribute_indent = attribute_indent
+        self.relationship_indent = relationship_indent
+        # ERD entities list identifying attributes above the separator
+        self.keys_first = keys_first
+
+PATCHABLE = {
+    ("CLASS", "PLANTUML"): _Syntax(plantuml_class_attribute, class_relationship, "  ", ""),
+    ("ERD", "PLANTUML"): _Syntax(plantuml_erd_attribute, plantuml_erd_relationship, "  ", "", keys_first=True),
+    ("CLASS", "MERMAID"): _Syntax(mermaid_class_attribute, class_relationship, "    ", "  "),
+}
+
+def _word(term: str):
+    return re.compile(rf"(?<![\w]){re.escape(term)}(?![\w])")
+
+def _blocks(lines: List[str]) -> Dict[str, Tuple[int, int, str]]:
+    # declared name (and alias) -> (start line, closing brace line, identifier used by relationships)
+    blocks = {}
+    i = 0
+    while i < len(lines):
+        match = _BLOCK_START.match(lines[i])
+        if match is None:
+            i += 1
+            continue
+        end = next((j for j in range(i + 1, len(lines)) if _BLOCK_END.match(lines[j])), None)
+        if end is None:
+            raise _Unpatchable("unterminated block")
+        name = match.group("quoted") or match.group("bare")
+        identifier = match.group("alias") or (name if match.group("bare") else f'"{name}"')
+        blocks[name] = (i, end, identifier)
+        if match.group("alias"):
+            blocks.setdefault(match.group("alias"), (i, end, identifier))
+        i = end + 1
+    return blocks
+
+def _block(lines: List[str], class_name: str) -> Tuple[int, int, str]:
+    blocks = _blocks(lines)
+    found = blocks.get(class_name.strip()) or blocks.get(alias(class_name))
+    if found is None:
+        raise _Unpatchable(f"no block for {class_name}")
+    return found
+
+def class_identifier(code: str, class_name: str) -> Optional[str]:
+    # the name relationship lines use for a declared class, or None when no block declares it
+    try:
+        return _block(code.splitlines(), class_name)[2]
+    except _Unpatchable:
+        return None
+
+def _links(lines: List[str]) -> List[int]:
+    inside = set()
+    for start, end, _ in _blocks(lines).values():
+        inside.update(range(start, end + 1))
+    return [i for i, line in enumerate(lines) if i not in inside and _LINK.search(line) and not _FOOTER.match(line)]
+
+def _attribute_line(lines: List[str], start: int, end: int, name: str) -> int:
+    pattern = _word(name.strip())
+    hits = [i for i in range(start + 1, end) if pattern.search(lines[i])]
+    if len(hits) != 1:
+        raise _Unpatchable(f"attribute {name} matched {len(hits)} lines")
+    return hits[0]
+
+def _indent(lines: List[str], start: int, end: int, default: str) -> str:
+    for i in range(start + 1, end):
+        if lines[i].strip() and lines[i].strip() != "--":
+            return _INDENT.match(lines[i]).group(0)
+    return default
+
+def _remove_relationship(lines: List[str], rel: Relationship):
+    source = _block(lines, rel.source)[2]
+    target = _block(lines, rel.target)[2]
+    hits = [i for i in _links(lines) if _word(source).search(lines[i]) and _word(target).search(lines[i])]
+    if rel.label and len(hits) > 1:
+        hits = [i for i in hits if rel.label in lines[i]]
+    if len(hits) != 1:
+        raise _Unpatchable(f"relationship {rel.source} -> {rel.target} matched {len(hits)} lines")
+    del lines[hits[0]]
+
+def _remove_class(lines: List[str], name: str):
+    start, end, identifier = _block(lines, name)
+    stop = end + 1
+    if stop < len(lines) and not lines[stop].strip():
+        stop += 1
+    del lines[start:stop]
+    pattern = _word(identifier)
+    for i in reversed(_links(lines)):
+        if pattern.search(lines[i]):
+            del lines[i]
+
+def _add_class(lines: List[str], cls: ClassModel, diagram_type: str, language: str):
+    rendered = get_renderer(diagram_type, language)([ClassModel(className=cls.className, attributes=cls.attributes, relationships=[])]).splitlines()
+    start, end, _ = _block(rendered, cls.className)
+    existing = _blocks(lines)
+    if not existing:
+        raise _Unpatchable("no class blocks to anchor on")
+    after = max(block_end for _, block_end, _ in existing.values()) + 1
+    block = rendered[start:end + 1]
+    if language == "PLANTUML":
+        block = [""] + block
+    lines[after:after] = block
+
+def _add_relationship(lines: List[str], rel: Relationship, syntax: _Syntax):
+    source = _block(lines, rel.source)[2]
+    target = _block(lines, rel.target)[2]
+    line = syntax.relationship_indent + syntax.relationship(rel, source, target)
+    links = _links(lines)
+    if links:
+        lines.insert(links[-1] + 1, line)
+    elif lines and _FOOTER.match(lines[-1]):
+        lines.insert(len(lines) - 1, line)
+    else:
+        lines.append(line)
+
+def patch_diagram(code: str, delta: ClassDelta, diagram_type: str, language: str) -> Optional[str]:
+    # applies the delta to the existing text so edits made since generation survive; None when the text
+    # does not have the shape a safe patch needs and the caller should fall back to an LLM patch
+    syntax = PATCHABLE.get((diagram_type.upper(), language.upper()))
+    if syntax is None:
+        return None
+    diagram_type, language = diagram_type.upper(), language.upper()
+    lines = code.splitlines()
+    try:
+        for rel in delta.removed_relationships:
+            _remove_relationship(lines, rel)
+        for name in delta.removed_classes:
+            _remove_class(lines, name)
+        for name, attr in delta.removed_attributes:
+            start, end, _ = _block(lines, name)
+            del lines[_attribute_line(lines, start, end, attr.name)]
+        for name, attr in delta.changed_attributes:
+            start, end, _ = _block(lines, name)
+            i = _attribute_line(lines, start, end, attr.name)
+            lines[i] = _INDENT.match(lines[i]).group(0) + syntax.attribute(attr)
+        for name, attr in delta.added_attributes:
+            start, end, _ = _block(lines, name)
+            line = _indent(lines, start, end, syntax.attribute_indent) + syntax.attribute(attr)
+            lines.insert(start + 1 if syntax.keys_first and attr.nature == AttributeNature.Identifying else end, line)
+        for cls in delta.added_classes:
+            _add_class(lines, cls, diagram_type, language)
+        for rel in delta.added_relationships:
+            _add_relationship(lines, rel, syntax)
+    except _Unpatchable:
+        return None
+    patched = "\n".join(lines)
+    if len(lint_diagram(patched, language)) > len(lint_diagram(code, language)):
+        return None
+    return patched
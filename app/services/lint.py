@@ -0,0 +1,272 @@
+import os
+import re
+from collections import Counter
+from typing import List, Optional, Tuple
+
+DIAGRAM_LINT_ENABLED = os.getenv("DIAGRAM_LINT_ENABLED", "true").lower() == "true"
+LINT_REPAIR_ENABLED = os.getenv("LINT_REPAIR_ENABLED", "true").lower() == "true"
+
+MERMAID_HEADERS = {
+    "ERD": "flowchart TD",
+    "SEQUENCE": "sequenceDiagram",
+    "CLASS": "classDiagram",
+    "USE_CASE": "flowchart LR",
+    "COMPONENT": "flowchart TD",
+}
+_MERMAID_HEADER = re.compile(
+    r"^(flowchart|graph|sequenceDiagram|classDiagram|erDiagram|stateDiagram(-v2)?|journey|gantt|mindmap)\b"
+)
+_PLANTUML_TAG = re.compile(r"^@(start|end)uml\b")
+_SEPARATOR = re.compile(r"^(--|==|\.\.|__)$")
+_PLANTUML_BLOCK_OPEN = re.compile(r"^(alt|opt|loop|par|break|critical|group)\b")
+_MERMAID_BLOCK_OPEN = re.compile(r"^(alt|opt|loop|par|break|critical|rect|box|subgraph)\b")
+_BLOCK_END = re.compile(r"^end\b(?!\s*(note|box|legend|ref)\b)")
+_BLOCK_ELSE = re.compile(r"^(else|and|option)\b")
+_QUOTED = re.compile(r'"[^"]*"')
+# crow's foot ends such as ||--o{ would otherwise count as braces
+_CROWS_FOOT = re.compile(r'(\|o|\|\||\}o|\}\|)(-+|\.+)(o\||\|\||o\{|\|\{)')
+_CLASS_BLOCK = re.compile(r'^class\s.*\{$|^\}$')
+_BRACKETS = {"[": "]", "(": ")", "{": "}"}
+_ACTIVATE = re.compile(r"^activate\s+(\S+)")
+_DEACTIVATE = re.compile(r"^deactivate\s+(\S+)")
+_DESTROY = re.compile(r"^destroy\s+(\S+)")
+_RETURN = re.compile(r"^return\b")
+# A -> B ++ : call, with the activation shorthand (++ activates B, -- deactivates A, !! destroys B) after the target
+_MESSAGE = re.compile(
+    r'^(?P<source>"[^"]+"|[\w.]+)\s*[<ox\\/]*[-.]+(?:\[[^\]]*\][-.]*)?[>ox\\/]*\s*'
+    r'(?P<target>"[^"]+"|[\w.]+)\s*(?P<shorthand>(?:[+\-*!]{2}\s*)*)(?::|$)'
+)
+DEACTIVATE_ISSUE = "deactivate of a participant that is not active"
+SEPARATOR_ISSUE = "separator outside entity braces"
+TAGS_ISSUE = "missing or misplaced @startuml/@enduml"
+HEADER_ISSUE = "missing Mermaid diagram header"
+MERMAID_TAG_ISSUE = "PlantUML tag in Mermaid output"
+OPEN_BLOCKS_ISSUE = "block(s) left open"
+OPEN_BRACES_ISSUE = "brace(s) left open"
+
+class LintIssue:
+    def __init__(self, line: Optional[int], message: str):
+        self.line = line
+        self.message = message
+
+    def describe(self) -> str:
+        return f"line {self.line + 1}: {self.message}" if self.line is not None else self.message
+
+def _bare(line: str) -> str:
+    return _CROWS_FOOT.sub("--", _QUOTED.sub('""', line.strip()))
+
+def _inactive_deactivations(lines: List[str]) -> List[int]:
+    # lines deactivating a participant that no path through the diagram has active; every branch of a
+    # block starts from the state before the block, and after `end` a participant counts as active
+    # if any branch left it active, so only deactivations that are wrong on every path are reported
+    active: Counter = Counter()
+    stack: List[str] = []
+    scopes: List[Tuple[Counter, List[Counter]]] = []
+    flagged = []
+    for index, line in enumerate(lines):
+        text = line.strip()
+        bare = _bare(line)
+        if _PLANTUML_BLOCK_OPEN.match(bare):
+            scopes.append((active.copy(), []))
+            continue
+        if _BLOCK_ELSE.match(bare) and scopes:
+            scopes[-1][1].append(active)
+            active = scopes[-1][0].copy()
+            continue
+        if _BLOCK_END.match(bare) and scopes:
+            _, branches = scopes.pop()
+            for branch in branches:
+                active |= branch
+            continue
+        match = _ACTIVATE.match(text)
+        if match:
+            active[match.group(1)] += 1
+            stack.append(match.group(1))
+            continue
+        match = _DEACTIVATE.match(text) or _DESTROY.match(text)
+        if match:
+            name = match.group(1)
+            if active[name] > 0:
+                active[name] -= 1
+            elif text.startswith("deactivate"):
+                flagged.append(index)
+            continue
+        if _RETURN.match(text):
+            while stack and active[stack[-1]] <= 0:
+                stack.pop()
+            if stack:
+                active[stack.pop()] -= 1
+            continue
+        match = _MESSAGE.match(text)
+        if match and match.group("shorthand"):
+            shorthand = match.group("shorthand").replace(" ", "")
+            source, target = match.group("source"), match.group("target")
+            if "++" in shorthand:
+                active[target] += 1
+                stack.append(target)
+            if "--" in shorthand and active[source] > 0:
+                active[source] -= 1
+            if "!!" in shorthand:
+                active[target] = 0
+    return flagged
+
+def _fix_plantuml(lines: List[str], fixes: List[str], issues: List[LintIssue]) -> List[str]:
+    # each fix only runs for an issue lint_diagram reported, so valid output passes through untouched
+    messages = {issue.message for issue in issues}
+    flagged = {issue.line for issue in issues if issue.message in (DEACTIVATE_ISSUE, SEPARATOR_ISSUE)}
+    tags = [i for i, line in enumerate(lines) if _PLANTUML_TAG.match(line.strip())]
+    if TAGS_ISSUE in messages:
+        fixes.append("normalised @startuml/@enduml tags")
+        start = lines[0].strip() if lines[0].strip().startswith("@startuml") else "@startuml"
+        body = [(i, line) for i, line in enumerate(lines) if i not in tags]
+    else:
+        start = None
+        body = list(enumerate(lines))
+    out, depth, blocks = [], 0, 0
+    for i, line in body:
+        bare = _bare(line)
+        if i in flagged:
+            fixes.append("dropped separator outside entity braces" if _SEPARATOR.match(bare) else f"dropped {bare}")
+            continue
+        if _PLANTUML_BLOCK_OPEN.match(bare):
+            blocks += 1
+        elif _BLOCK_END.match(bare) and blocks:
+            blocks -= 1
+        depth = max(0, depth + bare.count("{") - bare.count("}"))
+        out.append(line)
+    footer = []
+    if start is None:
+        # tags are where they belong; closers go in before @enduml
+        start, footer = out.pop(0), [out.pop()]
+    else:
+        footer = ["@enduml"]
+    if depth and _reported(issues, OPEN_BRACES_ISSUE):
+        fixes.append(f"closed {depth} unclosed brace(s)")
+        out.extend(["}"] * depth)
+    if blocks and _reported(issues, OPEN_BLOCKS_ISSUE):
+        fixes.append(f"closed {blocks} unclosed block(s)")
+        out.extend(["end"] * blocks)
+    return [start] + out + footer
+
+def _fix_mermaid(lines: List[str], diagram_type: str, fixes: List[str], issues: List[LintIssue]) -> List[str]:
+    out = lines
+    if _reported(issues, MERMAID_TAG_ISSUE):
+        out = [line for line in lines if not _PLANTUML_TAG.match(line.strip())]
+        fixes.append("removed PlantUML tags from Mermaid output")
+    header = MERMAID_HEADERS.get(diagram_type)
+    first = next((i for i, line in enumerate(out) if line.strip() and not line.strip().startswith("%%")), None)
+    # a header hidden behind a stray @startuml is fine once the tag is gone
+    if _reported(issues, HEADER_ISSUE) and header and (first is None or not _MERMAID_HEADER.match(out[first].strip())):
+        fixes.append(f"added missing '{header}' header")
+        out.insert(0, header)
+    blocks, depth = 0, 0
+    for line in out:
+        bare = _bare(line)
+        if _MERMAID_BLOCK_OPEN.match(bare):
+            blocks += 1
+        elif _BLOCK_END.match(bare) and blocks:
+            blocks -= 1
+        if bare.startswith("class ") or bare == "}":
+            depth = max(0, depth + bare.count("{") - bare.count("}"))
+    if depth and _reported(issues, OPEN_BRACES_ISSUE):
+        fixes.append(f"closed {depth} unclosed class block(s)")
+        out.extend(["}"] * depth)
+    if blocks and _reported(issues, OPEN_BLOCKS_ISSUE):
+        fixes.append(f"closed {blocks} unclosed block(s)")
+        out.extend(["end"] * blocks)
+    return out
+
+def fix_diagram(code: str, language: str, diagram_type: str) -> Tuple[str, List[str]]:
+    fixes: List[str] = []
+    stripped = code.strip()
+    lines = stripped.splitlines()
+    if not lines:
+        return code, fixes
+    issues = lint_diagram(stripped, language)
+    if not issues:
+        return code, fixes
+    if language.upper() == "MERMAID":
+        lines = _fix_mermaid(lines, diagram_type.upper(), fixes, issues)
+    else:
+        lines = _fix_plantuml(lines, fixes, issues)
+    return "\n".join(lines), fixes
+
+def _reported(issues: List[LintIssue], message: str) -> bool:
+    return any(issue.message.endswith(message) for issue in issues)
+
+def _check_brackets(bare: str) -> bool:
+    stack = []
+    for ch in bare:
+        if ch in _BRACKETS:
+            stack.append(_BRACKETS[ch])
+        elif ch in _BRACKETS.values():
+            if not stack or stack.pop() != ch:
+                return False
+    return not stack
+
+def lint_diagram(code: str, language: str) -> List[LintIssue]:
+    issues: List[LintIssue] = []
+    lines = code.splitlines()
+    mermaid = language.upper() == "MERMAID"
+    flowchart = mermaid and bool(lines) and re.match(r"^\s*(flowchart|graph)\b", lines[0]) is not None
+    opener = _MERMAID_BLOCK_OPEN if mermaid else _PLANTUML_BLOCK_OPEN
+    blocks, depth = 0, 0
+    content = [line.strip() for line in lines if line.strip() and not line.strip().startswith("%%")]
+    if mermaid and not (content and _MERMAID_HEADER.match(content[0])):
+        issues.append(LintIssue(None, HEADER_ISSUE))
+    if not mermaid:
+        tags = [i for i, line in enumerate(content) if _PLANTUML_TAG.match(line)]
+        if tags != [0, len(content) - 1] or not content[0].startswith("@startuml"):
+            issues.append(LintIssue(None, TAGS_ISSUE))
+        issues.extend(LintIssue(index, DEACTIVATE_ISSUE) for index in _inactive_deactivations(lines))
+    for index, line in enumerate(lines):
+        bare = _bare(line)
+        if not bare or bare.startswith("'") or bare.startswith("%%"):
+            continue
+        if mermaid and _PLANTUML_TAG.match(bare):
+            issues.append(LintIssue(index, MERMAID_TAG_ISSUE))
+        if not mermaid and _MERMAID_HEADER.match(bare):
+            issues.append(LintIssue(index, "Mermaid header in PlantUML output"))
+        if not mermaid and _SEPARATOR.match(bare) and depth == 0:
+            issues.append(LintIssue(index, SEPARATOR_ISSUE))
+        if opener.match(bare):
+            blocks += 1
+        elif _BLOCK_ELSE.match(bare) and not blocks:
+            issues.append(LintIssue(index, f"'{bare.split()[0]}' outside of a block"))
+        elif _BLOCK_END.match(bare):
+            if blocks:
+                blocks -= 1
+            else:
+                issues.append(LintIssue(index, "'end' without an open block"))
+        if flowchart and not _CLASS_BLOCK.match(bare):
+            # node shapes must open and close on the same line
+            if not _check_brackets(bare):
+                issues.append(LintIssue(index, "unbalanced brackets"))
+        elif not mermaid or _CLASS_BLOCK.match(bare):
+            depth += bare.count("{") - bare.count("}")
+            if depth < 0:
+                issues.append(LintIssue(index, "'}' without a matching '{'"))
+                depth = 0
+    if blocks:
+        issues.append(LintIssue(None, f"{blocks} {OPEN_BLOCKS_ISSUE}"))
+    if depth:
+        issues.append(LintIssue(None, f"{depth} {OPEN_BRACES_ISSUE}"))
+    return issues
+
+def issue_span(issues: List[LintIssue], total: int, context: int = 2) -> Optional[Tuple[int, int]]:
+    lines = [issue.line for issue in issues if issue.line is not None]
+    if not lines:
+        return None
+    return max(0, min(lines) - context), min(total, max(lines) + context + 1)
+
+class LintStats:
+    def __init__(self):
+        self.checked = 0
+        self.fixed = 0
+        self.repaired = 0
+        self.unresolved = 0
+
+    def stats(self) -> dict:
+        return {"checked": self.checked, "fixed": self.fixed, "repaired": self.repaired, "unresolved": self.unresolved}
+
+lint_stats = LintStats()
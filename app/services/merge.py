@@ -0,0 +1,89 @@
+import re
+from typing import Dict, List, Tuple
+
+NATURE_RANK = {"Optional": 0, "Descriptive": 1, "Identifying": 2}
+RELATIONSHIP_RANK = {"Association": 0, "Aggregation": 1, "Composition": 2}
+GENERIC_TYPES = {"", "string", "str", "object", "any"}
+
+def normalize_name(name: str) -> str:
+    key = re.sub(r'[^a-z0-9]', '', name.lower())
+    if key.endswith("ies") and len(key) > 4:
+        return key[:-3] + "y"
+    if key.endswith("s") and not key.endswith("ss") and len(key) > 3:
+        return key[:-1]
+    return key
+
+def _merge_attribute(current: dict, incoming: dict):
+    if NATURE_RANK.get(incoming["nature"], 0) > NATURE_RANK.get(current["nature"], 0):
+        current["nature"] = incoming["nature"]
+    current["required"] = current["required"] or incoming["required"]
+    if current["type"].strip().lower() in GENERIC_TYPES and incoming["type"].strip().lower() not in GENERIC_TYPES:
+        current["type"] = incoming["type"]
+
+def _merge_relationship(current: dict, incoming: dict, reversed_: bool):
+    source_type, target_type = incoming["sourcetype"], incoming["targettype"]
+    if reversed_:
+        source_type, target_type = target_type, source_type
+    # chunks that disagree on multiplicity saw different parts of the rule; Many covers both
+    if source_type == "Many":
+        current["sourcetype"] = "Many"
+    if target_type == "Many":
+        current["targettype"] = "Many"
+    if RELATIONSHIP_RANK.get(incoming["nature"], 0) > RELATIONSHIP_RANK.get(current["nature"], 0):
+        current["nature"] = incoming["nature"]
+    if not current.get("label") and incoming.get("label"):
+        current["label"] = incoming["label"]
+
+def _label_key(rel: dict) -> str:
+    return re.sub(r'[^a-z0-9]', '', (rel.get("label") or "").lower())
+
+def _find_relationship(candidates: List[Tuple[dict, bool]], label: str):
+    # the same label is the same relationship; an unlabelled one is taken to be whichever labelled one is there
+    for current, reversed_ in candidates:
+        if _label_key(current) == label:
+            return current, reversed_
+    for current, reversed_ in candidates:
+        if not label or not _label_key(current):
+            return current, reversed_
+    return None, False
+
+def merge_class_models(fragments: List[List[dict]]) -> List[dict]:
+    classes: Dict[str, dict] = {}
+    attributes: Dict[str, Dict[str, dict]] = {}
+    relationships: Dict[Tuple[str, str], List[dict]] = {}
+    pending = []
+    for fragment in fragments:
+        for cls in fragment:
+            key = normalize_name(cls["className"])
+            if not key:
+                continue
+            if key not in classes:
+                classes[key] = {"className": cls["className"], "attributes": [], "relationships": []}
+                attributes[key] = {}
+            for attr in cls["attributes"]:
+                attr_key = normalize_name(attr["name"]) or attr["name"]
+                current = attributes[key].get(attr_key)
+                if current is None:
+                    current = attributes[key][attr_key] = dict(attr)
+                    classes[key]["attributes"].append(current)
+                else:
+                    _merge_attribute(current, attr)
+            pending.extend(cls["relationships"])
+    for rel in pending:
+        source, target = normalize_name(rel["source"]), normalize_name(rel["target"])
+        # several relationships may join the same two classes, so each pair keeps a list
+        candidates = [(current, False) for current in relationships.get((source, target), [])]
+        if source != target:
+            candidates += [(current, True) for current in relationships.get((target, source), [])]
+        current, reversed_ = _find_relationship(candidates, _label_key(rel))
+        if current is not None:
+            _merge_relationship(current, rel, reversed_)
+            continue
+        merged = dict(rel)
+        merged["source"] = classes[source]["className"] if source in classes else rel["source"]
+        merged["target"] = classes[target]["className"] if target in classes else rel["target"]
+        relationships.setdefault((source, target), []).append(merged)
+        owner = classes.get(source) or classes.get(target)
+        if owner is not None:
+            owner["relationships"].append(merged)
+    return list(classes.values())
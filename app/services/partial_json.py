@@ -0,0 +1,102 @@
+import re
+import json
+from typing import List, Optional
+
+_CLASSES_KEY = re.compile(r'"classes"\s*:\s*$')
+_TRAILING_COMMA = re.compile(r',(\s*[}\]])')
+MAX_REPAIR_ATTEMPTS = 64
+
+class ClassStreamParser:
+    # scans streamed JSON once, returning each element of the top-level "classes" array as soon as it closes
+    def __init__(self):
+        self.buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._array_depth = None
+        self._item_start = None
+
+    def feed(self, chunk: str) -> List[dict]:
+        self.buffer += chunk
+        items = []
+        buffer = self.buffer
+        while self._pos < len(buffer):
+            ch = buffer[self._pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                if (ch == "[" and self._array_depth is None and self._depth == 1
+                        and _CLASSES_KEY.search(buffer, max(0, self._pos - 64), self._pos)):
+                    self._array_depth = self._depth + 1
+                elif ch == "{" and self._array_depth is not None and self._depth == self._array_depth:
+                    self._item_start = self._pos
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if ch == "}" and self._item_start is not None and self._depth == self._array_depth:
+                    try:
+                        items.append(json.loads(buffer[self._item_start:self._pos + 1]))
+                    except json.JSONDecodeError:
+                        pass
+                    self._item_start = None
+                elif ch == "]" and self._array_depth is not None and self._depth == self._array_depth - 1:
+                    # closed the classes array; nested arrays named "classes" are never matched again
+                    self._array_depth = -1
+            self._pos += 1
+        return items
+
+def _strip_fences(text: str) -> str:
+    cleaned = re.sub(r'```(?:json)?', '', text)
+    start = cleaned.find("{")
+    return cleaned[start:] if start >= 0 else cleaned
+
+def _cut_points(text: str):
+    # positions after which the text is a valid prefix, with the closers it still needs
+    stack = []
+    in_string = escape = False
+    points = []
+    for index, ch in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+            points.append((index + 1, "".join(reversed(stack))))
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+            points.append((index + 1, "".join(reversed(stack))))
+        elif ch == ",":
+            points.append((index, "".join(reversed(stack))))
+    return points
+
+def repair_json(text: str) -> Optional[dict]:
+    # closes a truncated object, dropping only the element that was cut off mid-way
+    text = _strip_fences(text).strip()
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    for cut, closers in reversed(_cut_points(text)[-MAX_REPAIR_ATTEMPTS:]):
+        candidate = _TRAILING_COMMA.sub(r'\1', text[:cut].rstrip().rstrip(",") + closers)
+        try:
+            value = json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(value, dict):
+            return value
+    return None
@@ -0,0 +1,275 @@
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Set, Tuple
+from app.model import ClassModel, Relationship
+from app.services.render import alias
+from app.services.incremental import PATCHABLE, class_identifier
+from app.logger import log
+
+PARTITION_MODE = os.getenv("PARTITION_MODE", "auto")
+PARTITION_THRESHOLD = int(os.getenv("PARTITION_THRESHOLD", "100"))
+PARTITION_MAX_CLASSES = int(os.getenv("PARTITION_MAX_CLASSES", "25"))
+PARTITION_MAX_CONCURRENCY = int(os.getenv("PARTITION_MAX_CONCURRENCY", "4"))
+PARTITION_REFINE_PASSES = int(os.getenv("PARTITION_REFINE_PASSES", "2"))
+
+_HEADER = re.compile(r"^\s*(@startuml|classDiagram|erDiagram)\b")
+_FOOTER = re.compile(r"^\s*@enduml\b")
+_TITLE = re.compile(r"^\s*title\b", re.IGNORECASE)
+# document-wide settings that every part repeats; the stitched document keeps one copy
+_SETTING = re.compile(r"^\s*(skinparam|hide|show|!|left to right direction|top to bottom direction)", re.IGNORECASE)
+
+Graph = Dict[str, Counter]
+
+def relationship_graph(classes: List[ClassModel]) -> Graph:
+    # undirected, weighted by how many relationships join two classes; unknown endpoints are ignored
+    # built in class order so the same model always partitions the same way
+    graph: Graph = {cls.className.strip(): Counter() for cls in classes}
+    names = graph.keys()
+    for cls in classes:
+        for rel in cls.relationships:
+            source, target = rel.source.strip(), rel.target.strip()
+            if source in names and target in names and source != target:
+                graph[source][target] += 1
+                graph[target][source] += 1
+    return graph
+
+def connected_components(graph: Graph) -> List[List[str]]:
+    seen: Set[str] = set()
+    components = []
+    for start in graph:
+        if start in seen:
+            continue
+        seen.add(start)
+        component, frontier = [], [start]
+        while frontier:
+            node = frontier.pop()
+            component.append(node)
+            for neighbour in graph[node]:
+                if neighbour not in seen:
+                    seen.add(neighbour)
+                    frontier.append(neighbour)
+        components.append(component)
+    return components
+
+def _cluster(nodes: List[str], graph: Graph, max_size: int) -> List[List[str]]:
+    # average-linkage agglomeration: repeatedly merge the two clusters with the densest connection
+    # (joining relationships per possible pair) whose union still fits
+    clusters: Dict[int, List[str]] = {i: [node] for i, node in enumerate(nodes)}
+    owner = {node: i for i, node in enumerate(nodes)}
+    links: Dict[int, Counter] = {i: Counter() for i in clusters}
+    for node in nodes:
+        for neighbour, weight in graph[node].items():
+            links[owner[node]][owner[neighbour]] += weight
+    while True:
+        best, best_density = None, 0.0
+        for a, neighbours in links.items():
+            for b, weight in neighbours.items():
+                if a < b and len(clusters[a]) + len(clusters[b]) <= max_size:
+                    density = weight / (len(clusters[a]) * len(clusters[b]))
+                    if density > best_density:
+                        best, best_density = (a, b), density
+        if best is None:
+            break
+        a, b = best
+        clusters[a].extend(clusters.pop(b))
+        merged = links.pop(b)
+        del merged[a]
+        links[a].pop(b, None)
+        for other, weight in merged.items():
+            links[a][other] += weight
+            links[other][a] += weight
+            del links[other][b]
+    return list(clusters.values())
+
+def _refine(parts: List[List[str]], graph: Graph, max_size: int, passes: int) -> List[List[str]]:
+    # single-node moves that cut fewer relationships (a Kernighan-Lin style pass without swaps)
+    owner = {node: i for i, part in enumerate(parts) for node in part}
+    sizes = Counter(owner.values())
+    for _ in range(passes):
+        moved = False
+        for node in sorted(owner):
+            here = owner[node]
+            pull = Counter()
+            for neighbour, weight in graph[node].items():
+                pull[owner[neighbour]] += weight
+            target, gain = here, 0
+            for part, weight in pull.items():
+                if part != here and sizes[part] < max_size and sizes[here] > 1 and weight - pull[here] > gain:
+                    target, gain = part, weight - pull[here]
+            if target != here:
+                owner[node] = target
+                sizes[here] -= 1
+                sizes[target] += 1
+                moved = True
+        if not moved:
+            break
+    refined: Dict[int, List[str]] = {}
+    for node, part in owner.items():
+        refined.setdefault(part, []).append(node)
+    return list(refined.values())
+
+def _pack(groups: List[List[str]], graph: Graph, max_size: int) -> List[List[str]]:
+    # first fit decreasing, preferring the bin a group has the most relationships with
+    bins: List[List[str]] = []
+    for group in sorted(groups, key=len, reverse=True):
+        members = set(group)
+        fitting = [b for b in bins if len(b) + len(group) <= max_size]
+        if fitting:
+            target = max(fitting, key=lambda b: sum(graph[node][other] for node in members for other in b))
+            target.extend(group)
+        else:
+            bins.append(list(group))
+    return bins
+
+def partition_names(classes: List[ClassModel], max_size: int, passes: int = PARTITION_REFINE_PASSES) -> List[List[str]]:
+    graph = relationship_graph(classes)
+    groups = []
+    for component in connected_components(graph):
+        if len(component) <= max_size:
+            groups.append(component)
+        else:
+            groups.extend(_cluster(component, graph, max_size))
+    parts = _refine(_pack(groups, graph, max_size), graph, max_size, passes)
+    order = {cls.className.strip(): i for i, cls in enumerate(classes)}
+    parts = [sorted(part, key=order.__getitem__) for part in parts]
+    return sorted(parts, key=lambda part: order[part[0]])
+
+class Partition:
+    def __init__(self, index: int, classes: List[ClassModel]):
+        self.index = index
+        self.classes = classes
+
+    @property
+    def hub(self) -> str:
+        # the class with the most relationships inside the part names it
+        degree = Counter()
+        for cls in self.classes:
+            for rel in cls.relationships:
+                degree[rel.source.strip()] += 1
+                degree[rel.target.strip()] += 1
+        return max((cls.className.strip() for cls in self.classes), key=lambda name: degree[name])
+
+    @property
+    def title(self) -> str:
+        return f"Part {self.index + 1}: {self.hub}"
+
+def merge_duplicates(classes: List[ClassModel]) -> List[ClassModel]:
+    # parts are keyed by class name, so two classes sharing one would silently lose the second;
+    # merge them instead, keeping the first declaration of each attribute and every distinct relationship
+    merged: Dict[str, ClassModel] = {}
+    for cls in classes:
+        name = cls.className.strip()
+        first = merged.get(name)
+        if first is None:
+            merged[name] = ClassModel(className=cls.className, attributes=list(cls.attributes), relationships=list(cls.relationships))
+            continue
+        log.warning(f"Class {name!r} is declared more than once; merging the declarations before partitioning")
+        known = {attr.name.strip() for attr in first.attributes}
+        first.attributes.extend(attr for attr in cls.attributes if attr.name.strip() not in known)
+        first.relationships.extend(rel for rel in cls.relationships if rel not in first.relationships)
+    return list(merged.values())
+
+def partition_classes(classes: List[ClassModel], max_size: int) -> Tuple[List[Partition], List[Tuple[Relationship, int, int]]]:
+    # relationships inside a part stay on its classes; the ones crossing parts are returned for stitching
+    classes = merge_duplicates(classes)
+    names = partition_names(classes, max_size)
+    part_of = {name: i for i, part in enumerate(names) for name in part}
+    by_name = {cls.className.strip(): cls for cls in classes}
+    cross = []
+    partitions = []
+    for i, part in enumerate(names):
+        members = []
+        for name in part:
+            cls = by_name[name]
+            inside = []
+            for rel in cls.relationships:
+                source, target = part_of.get(rel.source.strip(), i), part_of.get(rel.target.strip(), i)
+                if source == target:
+                    inside.append(rel)
+                else:
+                    cross.append((rel, source, target))
+            members.append(ClassModel(className=cls.className, attributes=cls.attributes, relationships=inside))
+        partitions.append(Partition(i, members))
+    return partitions, cross
+
+def can_stitch(diagram_type: str, language: str) -> bool:
+    return (diagram_type.upper(), language.upper()) in PATCHABLE
+
+def _body(code: str, settings: List[str]) -> List[str]:
+    body = []
+    for line in code.splitlines():
+        if _HEADER.match(line) or _FOOTER.match(line) or _TITLE.match(line):
+            continue
+        if _SETTING.match(line):
+            if line.strip() not in settings:
+                settings.append(line.strip())
+            continue
+        body.append(line)
+    while body and not body[0].strip():
+        body.pop(0)
+    while body and not body[-1].strip():
+        body.pop()
+    return body
+
+def stitch(partitions: List[Partition], codes: List[str], cross: List[Tuple[Relationship, int, int]],
+           diagram_type: str, language: str) -> str:
+    # one document: each part in its own package (PlantUML) or section (Mermaid), then the relationships
+    # that cross parts, written against the identifiers the parts actually declared
+    syntax = PATCHABLE[(diagram_type.upper(), language.upper())]
+    plantuml = language.upper() == "PLANTUML"
+    settings: List[str] = []
+    sections = []
+    for partition, code in zip(partitions, codes):
+        body = _body(code, settings)
+        if plantuml:
+            sections.append([f'package "{partition.title}" {{', *body, "}"])
+        else:
+            sections.append([f"  %% {partition.title}", *body])
+    lines = ["@startuml" if plantuml else "classDiagram", *settings]
+    for section in sections:
+        lines.extend(["", *section])
+    if cross:
+        lines.extend(["", "' relationships between parts" if plantuml else "  %% relationships between parts"])
+        stitched = "\n".join(lines)
+        for rel, _, _ in cross:
+            source = class_identifier(stitched, rel.source) or alias(rel.source)
+            target = class_identifier(stitched, rel.target) or alias(rel.target)
+            lines.append(syntax.relationship_indent + syntax.relationship(rel, source, target))
+    if plantuml:
+        lines.append("@enduml")
+    return "\n".join(lines)
+
+def overview(partitions: List[Partition], cross: List[Tuple[Relationship, int, int]], language: str) -> str:
+    # index diagram for linked subdiagrams: one node per part, edges counting the relationships between them
+    weights = Counter((min(a, b), max(a, b)) for _, a, b in cross)
+    if language.upper() == "PLANTUML":
+        lines = ["@startuml"]
+        lines.extend(f'rectangle "{p.title}\\n{len(p.classes)} classes" as P{p.index + 1}' for p in partitions)
+        lines.extend(f"P{a + 1} -- P{b + 1} : {n}" for (a, b), n in sorted(weights.items()))
+        lines.append("@enduml")
+    else:
+        lines = ["flowchart LR"]
+        lines.extend(f'  P{p.index + 1}["{p.title}<br/>{len(p.classes)} classes"]' for p in partitions)
+        lines.extend(f"  P{a + 1} ---|{n}| P{b + 1}" for (a, b), n in sorted(weights.items()))
+    return "\n".join(lines)
+
+def cross_links(partition: Partition, cross: List[Tuple[Relationship, int, int]]) -> List[dict]:
+    links = []
+    for rel, source, target in cross:
+        if partition.index in (source, target):
+            links.append({
+                "source": rel.source,
+                "target": rel.target,
+                "nature": rel.nature,
+                "label": rel.label,
+                "subdiagram": target if source == partition.index else source,
+            })
+    return links
+
+def partition_stats(partitions: List[Partition], cross: list) -> dict:
+    return {
+        "count": len(partitions),
+        "sizes": [len(p.classes) for p in partitions],
+        "crossRelationships": len(cross),
+    }
@@ -1,147 +1,186 @@
 from app.services.rules import (
     ERD_SPECIFIC_RULES, SEQUENCE_RULES, CLASS_RULES, COMPONENT_RULES, USE_CASE_RULES, 
-    ERD_MERMAID_RULES, SEQUENCE_MERMAID_RULES, CLASS_MERMAID_RULES, USE_CASE_MERMAID_RULES, COMPONENT_MERMAID_RULES
+    ERD_MERMAID_RULES, SEQUENCE_MERMAID_RULES, CLASS_MERMAID_RULES, USE_CASE_MERMAID_RULES, COMPONENT_MERMAID_RULES,
+    DATABASE_CODE_RULES, API_CONTRACT_RULES
     )
+from typing import Dict, Optional, Tuple
+from app.logger import log
+from app.metrics import timed
 import re
 
-def get_prompt_message(diagram_type:  str, extra_context: str, requirements: str,language:str):
-    lang = language.upper()
-    if lang == "MERMAID":
-        syntax_header = "appropriate Mermaid header (e.g., erDiagram, sequenceDiagram, graph TD, etc.)"
-        constraint_text = f"""
-        Constraint: Return ONLY raw Mermaid.js code. 
-        NO markdown (```), NO introductory text. 
-        Ensure the code starts with the {syntax_header}.
-        NEVER use @startuml or @enduml tags."""
-    else:
-        constraint_text = """
-        Constraint: Return ONLY raw PlantUML code. 
-        NO markdown (```), NO introductory text. 
-        Ensure code starts with @startuml and ends with @enduml."""
-    prompt = f"""
-    Task: Generate a {diagram_type} in {language}.
-    Critical Formatting Rules:
-    {extra_context}
-    User Requirements:
-    {requirements}
-    {constraint_text}
-    """
-    messages = [
-        {"role": "system", "content": f"You are a software architect expert in {language}. You output ONLY valid, error-free {language} code without markdown decoration."},
-        {"role": "user", "content": prompt}
-    ]
-    return messages
-
-def get_prompt_derived_artifact(extra_context, source_uml, requirements):
-    prompt = f"""
-    {extra_context}
-    ### STRUCTURED DATA MODEL (SOURCE OF TRUTH)
-    {requirements}
-    ### UML CONTEXT (ONLY FOR DATABASE, EMPTY FOR API)
-    {source_uml}
-    ### FINAL RULES
-    You are a CODE GENERATOR ONLY.
-    - API → Output ONLY OpenAPI YAML
-    - DATABASE → Output ONLY SQL + MongoDB
-    - NO UML
-    - NO PlantUML
-    - NO @startuml
-    - NO diagrams
-    - NO markdown
-    """
-    messages = [
-        {
-            "role": "system",
-            "content": "You are a strict code generator. You never output UML, diagrams, markdown, or explanations."
-        },
-        {"role": "user", "content": prompt}
-    ]
-    return messages
+class PromptTemplate:
+    # the system message is compiled once and never varies, so upstream prefix caching can reuse it
+    def __init__(self, system: str, user: str):
+        self.system = system.strip()
+        self.user = user
 
-def get_prompt_extract_structure(requirements: str, project_name: str):
-    prompt = f"""
-    Task: Analyze the requirements and extract a structured Class Diagram JSON.
-    Rules for Enums:
-    - Attribute "nature": Must be one of ["Identifying", "Descriptive", "Optional"]
-    - Relationship "nature": Must be one of ["Association", "Aggregation", "Composition"]
-    - Relationship "sourcetype"/"targettype": Must be one of ["One", "Many"]
-    Constraint: Return ONLY a raw JSON object. No markdown, no triple backticks (```).
-    Structure:
-    {{
-        "projectName": "{project_name}",
-        "classes": [
-            {{
-                "className": "Name",
-                "attributes": [
-                    {{ "name": "attrName", "type": "String", "nature": "Identifying", "required": true }}
-                ],
-                "relationships": [
-                    {{ "source": "ClassA", "target": "ClassB", "nature": "Association", "sourcetype": "One", "targettype": "Many", "label": "has" }}
-                ]
-            }}
+    def render(self, **values) -> list:
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": self.user.format(**values)}
         ]
-    }}
-    User Requirements:
-    {requirements}
-    """
-    messages = [
-        {"role": "system", "content": "You are a software architect that outputs ONLY valid JSON based on class structures."},
-        {"role": "user", "content": prompt}
-    ]
-    return messages
-
-def get_prompt_refine_diagram(extra_context, existing_code, instruction,language):
-    lang = language.upper()
-    if lang == "MERMAID":
-        header_instruction = "appropriate Mermaid header (e.g., erDiagram, sequenceDiagram, graph TD)"
-        constraint_text = f"""
-        Constraint: Return ONLY raw Mermaid.js code. 
-        NO markdown (```), NO introductory text. 
-        Ensure the code starts with the {header_instruction}.
-        NEVER use @startuml or @enduml tags."""
-    else:
-        constraint_text = """
-        Constraint: Return ONLY raw PlantUML code. 
-        NO markdown (```), NO introductory text. 
-        Ensure code starts with @startuml and ends with @enduml."""
-    prompt = f"""
-    Task: Refine the following {language} diagram based on the user instructions.
-    Critical Formatting Rules:
-    {extra_context}
-    [Existing {language} Code]:
-    {existing_code}
-    [User Instructions]:
-    {instruction}
-    {constraint_text}
-    """
-    messages = [
-        {"role": "system", "content": f"You are a software architect expert in {language} refinement. You output ONLY valid, error-free raw code without markdown decoration."},
-        {"role": "user", "content": prompt}
-    ]
-    return messages
-
-def get_prompt_refine_artifact(extra_context, existing_code, instruction):
-    prompt = f"""
-    Task: Refine the following technical artifact (JSON/SQL/Code).
-    Rules for this artifact type:
-    {extra_context}
-    [Existing Code]:
-    {existing_code}
-    [Refinement Instructions]:
-    {instruction}
-    Constraint: Return ONLY the raw code or JSON. No markdown blocks or explanations.
-    """
-    messages = [
-        {"role": "system", "content": "You are a technical expert. Refine the provided artifact strictly following instructions."},
-        {"role": "user", "content": prompt}
+
+MERMAID_CONSTRAINT = """Constraint: Return ONLY raw Mermaid.js code. 
+NO markdown (```), NO introductory text. 
+Ensure the code starts with the appropriate Mermaid header (e.g., erDiagram, sequenceDiagram, graph TD, etc.).
+NEVER use @startuml or @enduml tags."""
+
+PLANTUML_CONSTRAINT = """Constraint: Return ONLY raw PlantUML code. 
+NO markdown (```), NO introductory text. 
+Ensure code starts with @startuml and ends with @enduml."""
+
+DERIVED_FINAL_RULES = """### FINAL RULES
+You are a CODE GENERATOR ONLY.
+- API → Output ONLY OpenAPI YAML
+- DATABASE → Output ONLY SQL + MongoDB
+- NO UML
+- NO PlantUML
+- NO @startuml
+- NO diagrams
+- NO markdown"""
+
+ARTIFACT_RULES = {
+    "DATABASE": DATABASE_CODE_RULES,
+    "API": API_CONTRACT_RULES,
+}
+
+def _constraint(language: str) -> str:
+    return MERMAID_CONSTRAINT if language == "MERMAID" else PLANTUML_CONSTRAINT
+
+def _generate_template(diagram_type: str, language: str, rules: Optional[str]) -> PromptTemplate:
+    rules = rules or f"Generate a standard, clean {language} diagram."
+    system = f"""
+You are a software architect expert in {language}. You output ONLY valid, error-free {language} code without markdown decoration.
+Task: Generate a {diagram_type} in {language}.
+Critical Formatting Rules:
+STRICT SCHEMA MAPPING: Transform the provided class model into a {diagram_type}. {rules}
+{_constraint(language)}
+"""
+    return PromptTemplate(system, "{requirements}")
+
+def _refine_template(diagram_type: str, language: str, rules: Optional[str]) -> PromptTemplate:
+    rules = rules or f"Maintain standard {language} syntax."
+    system = f"""
+You are a software architect expert in {language} refinement. You output ONLY valid, error-free raw code without markdown decoration.
+Task: Refine the given {language} {diagram_type} diagram based on the user instructions.
+Critical Formatting Rules:
+REFINEMENT MODE: {rules}
+{_constraint(language)}
+"""
+    user = f"[Existing {language} Code]:\n{{existing_code}}\n[User Instructions]:\n{{instruction}}"
+    return PromptTemplate(system, user)
+
+def _refine_fragment_template(diagram_type: str, language: str, rules: Optional[str]) -> PromptTemplate:
+    rules = rules or f"Maintain standard {language} syntax."
+    system = f"""
+You are a software architect expert in {language} refinement. You edit one fragment of a larger {language} {diagram_type} diagram.
+Rules for the full diagram:
+{rules}
+Constraint: Return ONLY the lines that replace the given fragment, keeping unchanged lines exactly as they are.
+NO markdown (```), NO introductory text, NO @startuml/@enduml or diagram header lines.
+Elements declared elsewhere in the diagram may be referenced but must not be redefined.
+"""
+    user = (
+        "[Elements declared elsewhere]:\n{outline}\n"
+        "[Fragment, lines {start}-{end} of {total}]:\n{fragment}\n"
+        "[User Instructions]:\n{instruction}"
+    )
+    return PromptTemplate(system, user)
+
+def _derive_template(artifact_type: str) -> PromptTemplate:
+    system = f"""
+You are a strict code generator. You never output UML, diagrams, markdown, or explanations.
+{ARTIFACT_RULES[artifact_type]}
+{DERIVED_FINAL_RULES}
+"""
+    user = (
+        "### STRUCTURED DATA MODEL (SOURCE OF TRUTH)\n{requirements}\n"
+        "### UML CONTEXT (ONLY FOR DATABASE, EMPTY FOR API)\n{source_uml}"
+    )
+    return PromptTemplate(system, user)
+
+def _refine_artifact_template(artifact_type: str) -> PromptTemplate:
+    system = f"""
+You are a technical expert. Refine the provided artifact strictly following instructions.
+Task: Refine the given technical artifact (JSON/SQL/Code).
+Rules for this artifact type:
+{ARTIFACT_RULES[artifact_type]}
+Constraint: Return ONLY the raw code or JSON. No markdown blocks or explanations.
+"""
+    return PromptTemplate(system, "[Existing Code]:\n{existing_code}\n[Refinement Instructions]:\n{instruction}")
+
+def _extract_template() -> PromptTemplate:
+    system = """
+You are a software architect that outputs ONLY valid JSON based on class structures.
+Task: Analyze the requirements and extract a structured Class Diagram JSON.
+Rules for Enums:
+- Attribute "nature": Must be one of ["Identifying", "Descriptive", "Optional"]
+- Relationship "nature": Must be one of ["Association", "Aggregation", "Composition"]
+- Relationship "sourcetype"/"targettype": Must be one of ["One", "Many"]
+Constraint: Return ONLY a raw JSON object. No markdown, no triple backticks (```).
+Set "projectName" to the project name given by the user.
+Structure:
+{
+    "projectName": "<project name>",
+    "classes": [
+        {
+            "className": "Name",
+            "attributes": [
+                { "name": "attrName", "type": "String", "nature": "Identifying", "required": true }
+            ],
+            "relationships": [
+                { "source": "ClassA", "target": "ClassB", "nature": "Association", "sourcetype": "One", "targettype": "Many", "label": "has" }
+            ]
+        }
     ]
-    return messages
+}
+"""
+    return PromptTemplate(system, "Project Name: {project_name}\nUser Requirements:\n{requirements}")
 
 def strip_markdown(text: str) -> str:
     if not text: return ""
     cleaned = re.sub(r'```(?:\w+)?', '', text)
     return cleaned.replace('```', '').strip()
 
+class MarkdownStreamStripper:
+    # incremental strip_markdown: holds back partial fences and trailing whitespace until they resolve
+    _PARTIAL_FENCE = re.compile(r'`{1,3}\w*$')
+
+    def __init__(self):
+        self._pending = ""
+        self._whitespace = ""
+        self._started = False
+
+    def feed(self, chunk: str) -> str:
+        text = self._pending + chunk
+        match = self._PARTIAL_FENCE.search(text)
+        if match:
+            text, self._pending = text[:match.start()], text[match.start():]
+        else:
+            self._pending = ""
+        return self._emit(re.sub(r'```(?:\w+)?', '', text))
+
+    def flush(self) -> str:
+        tail = re.sub(r'```(?:\w+)?', '', self._pending)
+        self._pending = ""
+        out = self._emit(tail)
+        self._whitespace = ""
+        return out
+
+    def _emit(self, text: str) -> str:
+        if not self._started:
+            text = text.lstrip()
+            if not text:
+                return ""
+            self._started = True
+        body = text.rstrip()
+        if not body:
+            self._whitespace += text
+            return ""
+        out = self._whitespace + body
+        self._whitespace = text[len(body):]
+        return out
+
 MAPPING = {
         "PLANTUML": {
             ("ERD", "ENTITY RELATIONSHIP"): ERD_SPECIFIC_RULES,
@@ -157,4 +196,82 @@ MAPPING = {
             ("USE CASE", "USE_CASE"): USE_CASE_MERMAID_RULES,
             ("COMPONENT",): COMPONENT_MERMAID_RULES,
         }
-    }
\ No newline at end of file
+    }
+# keyword -> rules, flattened from MAPPING so rule selection is a dict lookup
+RULES: Dict[Tuple[str, str], str] = {
+    (keyword, language): rules
+    for language, by_type in MAPPING.items()
+    for keywords, rules in by_type.items()
+    for keyword in keywords
+}
+DIAGRAM_TYPES = ("ERD", "SEQUENCE", "CLASS", "USE_CASE", "COMPONENT")
+
+DIAGRAM_BUILDERS = {
+    "generate": _generate_template,
+    "refine": _refine_template,
+    "refine_fragment": _refine_fragment_template,
+}
+
+def compile_templates() -> Dict[tuple, PromptTemplate]:
+    templates = {("extract", None, None): _extract_template()}
+    for artifact_type in ARTIFACT_RULES:
+        templates[("derive", artifact_type, None)] = _derive_template(artifact_type)
+        templates[("refine_artifact", artifact_type, None)] = _refine_artifact_template(artifact_type)
+    for language in MAPPING:
+        for diagram_type in DIAGRAM_TYPES:
+            rules = RULES.get((diagram_type, language))
+            for operation, builder in DIAGRAM_BUILDERS.items():
+                templates[(operation, diagram_type, language)] = builder(diagram_type, language, rules)
+    return templates
+
+TEMPLATES = compile_templates()
+log.info(f"Compiled {len(TEMPLATES)} prompt templates")
+
+def get_template(operation: str, diagram_type: Optional[str] = None, language: Optional[str] = None) -> PromptTemplate:
+    diagram_key = diagram_type.upper().replace(" ", "_") if diagram_type else None
+    language_key = language.upper() if language else None
+    template = TEMPLATES.get((operation, diagram_key, language_key))
+    if template is None:
+        if operation in ("derive", "refine_artifact"):
+            raise ValueError("Invalid derived artifact type")
+        # diagram types without dedicated rules get a generic template, compiled on first use; other languages
+        # are named as requested and borrow the PlantUML rules, as they always have
+        rules = None
+        if language_key not in MAPPING:
+            log.warning(f"No dedicated rules for language {language}; using the PlantUML rules for {diagram_key}")
+            rules = RULES.get((diagram_key, "PLANTUML"))
+        builder = DIAGRAM_BUILDERS[operation]
+        template = TEMPLATES[(operation, diagram_key, language_key)] = builder(diagram_key, language_key, rules)
+    return template
+
+@timed("prompt_build")
+def get_prompt_message(diagram_type: str, requirements: str, language: str):
+    return get_template("generate", diagram_type, language).render(requirements=requirements)
+
+@timed("prompt_build")
+def get_prompt_derived_artifact(artifact_type: str, source_uml: str, requirements: str):
+    return get_template("derive", artifact_type).render(requirements=requirements, source_uml=source_uml)
+
+@timed("prompt_build")
+def get_prompt_extract_structure(requirements: str, project_name: str):
+    return get_template("extract").render(requirements=requirements, project_name=project_name)
+
+@timed("prompt_build")
+def get_prompt_refine_diagram(diagram_type: str, existing_code: str, instruction: str, language: str):
+    return get_template("refine", diagram_type, language).render(existing_code=existing_code, instruction=instruction)
+
+@timed("prompt_build")
+def get_prompt_refine_artifact(artifact_type: str, existing_code: str, instruction: str):
+    return get_template("refine_artifact", artifact_type).render(existing_code=existing_code, instruction=instruction)
+
+@timed("prompt_build")
+def get_prompt_refine_fragment(diagram_type: str, code: str, span: Tuple[int, int], outline: str, instruction: str, language: str):
+    lines = code.splitlines()
+    return get_template("refine_fragment", diagram_type, language).render(
+        outline=outline,
+        start=span[0] + 1,
+        end=span[1],
+        total=len(lines),
+        fragment="\n".join(lines[span[0]:span[1]]),
+        instruction=instruction
+    )
@@ -0,0 +1,148 @@
+import re
+from typing import List
+from app.model import ClassModel, AttributeNature, RelationshipNature, RelationshipType
+
+PLANTUML_CROWS_FOOT_LEFT = {RelationshipType.One: "||", RelationshipType.Many: "}o"}
+PLANTUML_CROWS_FOOT_RIGHT = {RelationshipType.One: "||", RelationshipType.Many: "o{"}
+PLANTUML_CLASS_ARROWS = {
+    RelationshipNature.Association: "-->",
+    RelationshipNature.Aggregation: "o--",
+    RelationshipNature.Composition: "*--",
+}
+MERMAID_CLASS_ARROWS = PLANTUML_CLASS_ARROWS
+MULTIPLICITY = {RelationshipType.One: "1", RelationshipType.Many: "*"}
+MERMAID_ERD_CARDINALITY = {RelationshipType.One: "1", RelationshipType.Many: "M"}
+
+def alias(name: str) -> str:
+    cleaned = re.sub(r'\W', '_', name.strip())
+    return cleaned if cleaned and not cleaned[0].isdigit() else f"_{cleaned}"
+
+def plantuml_erd_attribute(attr) -> str:
+    return f"* **{attr.name}** : {attr.type}" if attr.nature == AttributeNature.Identifying else f"{attr.name} : {attr.type}"
+
+def plantuml_erd_relationship(rel, source: str, target: str) -> str:
+    label = f" : {rel.label}" if rel.label else ""
+    return f"{source} {PLANTUML_CROWS_FOOT_LEFT[rel.sourcetype]}--{PLANTUML_CROWS_FOOT_RIGHT[rel.targettype]} {target}{label}"
+
+def render_erd_plantuml(classes: List[ClassModel]) -> str:
+    lines = ["@startuml", "skinparam linetype ortho", "hide circle", "hide methods", ""]
+    for cls in classes:
+        keys = [a for a in cls.attributes if a.nature == AttributeNature.Identifying]
+        others = [a for a in cls.attributes if a.nature != AttributeNature.Identifying]
+        lines.append(f'entity "{cls.className}" as {alias(cls.className)} {{')
+        for attr in keys:
+            lines.append(f"  {plantuml_erd_attribute(attr)}")
+        if keys and others:
+            lines.append("  --")
+        for attr in others:
+            lines.append(f"  {plantuml_erd_attribute(attr)}")
+        lines.append("}")
+        lines.append("")
+    for cls in classes:
+        for rel in cls.relationships:
+            lines.append(plantuml_erd_relationship(rel, alias(rel.source), alias(rel.target)))
+    lines.append("@enduml")
+    return "\n".join(lines)
+
+def _visibility(attr) -> str:
+    return "+" if attr.nature == AttributeNature.Identifying else "-"
+
+def plantuml_class_attribute(attr) -> str:
+    return f"{_visibility(attr)} {attr.name} : {attr.type}"
+
+def class_relationship(rel, source: str, target: str) -> str:
+    # PlantUML and Mermaid class diagrams share the arrow and multiplicity syntax
+    label = f" : {rel.label}" if rel.label else ""
+    return f'{source} "{MULTIPLICITY[rel.sourcetype]}" {PLANTUML_CLASS_ARROWS[rel.nature]} "{MULTIPLICITY[rel.targettype]}" {target}{label}'
+
+def render_class_plantuml(classes: List[ClassModel]) -> str:
+    lines = ["@startuml", "hide empty methods", ""]
+    for cls in classes:
+        lines.append(f'class "{cls.className}" as {alias(cls.className)} {{')
+        for attr in cls.attributes:
+            lines.append(f"  {plantuml_class_attribute(attr)}")
+        lines.append("}")
+        lines.append("")
+    for cls in classes:
+        for rel in cls.relationships:
+            lines.append(class_relationship(rel, alias(rel.source), alias(rel.target)))
+    lines.append("@enduml")
+    return "\n".join(lines)
+
+def mermaid_class_attribute(attr) -> str:
+    return f"{_visibility(attr)}{attr.type} {attr.name}"
+
+def render_class_mermaid(classes: List[ClassModel]) -> str:
+    lines = ["classDiagram"]
+    for cls in classes:
+        lines.append(f"  class {alias(cls.className)} {{")
+        for attr in cls.attributes:
+            lines.append(f"    {mermaid_class_attribute(attr)}")
+        lines.append("  }")
+    for cls in classes:
+        for rel in cls.relationships:
+            lines.append(f"  {class_relationship(rel, alias(rel.source), alias(rel.target))}")
+    return "\n".join(lines)
+
+def _underline(text: str) -> str:
+    return "".join(f"{ch}̲" for ch in text)
+
+def render_erd_mermaid(classes: List[ClassModel]) -> str:
+    weak = {rel.target for cls in classes for rel in cls.relationships if rel.nature == RelationshipNature.Composition}
+    lines = ["flowchart TD"]
+    strong_nodes, weak_nodes, attr_nodes, strong_rels, weak_rels = [], [], [], [], []
+    for cls in classes:
+        node = alias(cls.className)
+        if cls.className in weak:
+            lines.append(f"  {node}[[{cls.className}]]")
+            weak_nodes.append(node)
+        else:
+            lines.append(f"  {node}[**{cls.className}**]")
+            strong_nodes.append(node)
+        for attr in cls.attributes:
+            if attr.nature == AttributeNature.Identifying:
+                attr_node = f"PK_{node}_{alias(attr.name)}"
+                lines.append(f"  {attr_node}([{_underline(attr.name)}])")
+            else:
+                attr_node = f"Attr_{node}_{alias(attr.name)}"
+                lines.append(f"  {attr_node}([{attr.name}])")
+            lines.append(f"  {node} --- {attr_node}")
+            attr_nodes.append(attr_node)
+    index = 0
+    for cls in classes:
+        for rel in cls.relationships:
+            index += 1
+            label = rel.label or "relates"
+            if rel.nature == RelationshipNature.Composition:
+                rel_node = f"WeakRel{index}"
+                lines.append(f'  {rel_node}{{{{"{label}"}}}}')
+                weak_rels.append(rel_node)
+            else:
+                rel_node = f"Rel{index}"
+                lines.append(f'  {rel_node}{{"{label}"}}')
+                strong_rels.append(rel_node)
+            lines.append(
+                f"  {alias(rel.source)} ---|{MERMAID_ERD_CARDINALITY[rel.sourcetype]}| {rel_node} "
+                f"---|{MERMAID_ERD_CARDINALITY[rel.targettype]}| {alias(rel.target)}"
+            )
+    for node in strong_nodes:
+        lines.append(f"  style {node} fill:#e1f5fe,stroke:#01579b,stroke-width:2px")
+    for node in weak_nodes:
+        lines.append(f"  style {node} fill:#fce4ec,stroke:#880e4f,stroke-width:4px,color:#000")
+    for node in attr_nodes:
+        lines.append(f"  style {node} fill:#f5f5f5,stroke:#616161,stroke-width:1px")
+    for node in strong_rels:
+        lines.append(f"  style {node} fill:#e8f5e9,stroke:#1b5e20,stroke-width:2px")
+    for node in weak_rels:
+        lines.append(f"  style {node} fill:#fff9c4,stroke:#fbc02d,stroke-width:4px")
+    return "\n".join(lines)
+
+RENDERERS = {
+    ("CLASS", "PLANTUML"): render_class_plantuml,
+    ("CLASS", "MERMAID"): render_class_mermaid,
+    ("ERD", "PLANTUML"): render_erd_plantuml,
+    ("ERD", "MERMAID"): render_erd_mermaid,
+}
+
+def get_renderer(diagram_type: str, language: str):
+    return RENDERERS.get((diagram_type.upper(), language.upper()))
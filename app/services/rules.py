@@ -228,4 +228,10 @@ COMPONENT_MERMAID_RULES = """
    'classDef comp fill:#ffffff,stroke:#333,stroke-width:2px,color:#000;'
    'class <<ALL_DEFINED_IDS>> comp'
 8. FORBIDDEN: Do not use 'erDiagram', 'classDiagram', 'sequenceDiagram', or any code-level syntax.
-"""
\ No newline at end of file
+"""
+POLISH_INSTRUCTION = """
+The artifact below was generated mechanically from the structured data model.
+Keep every table, collection, schema, path, column and constraint exactly as defined.
+Only improve naming consistency, add sensible indexes, descriptions and examples where useful.
+Do not remove or rename anything that other parts of the artifact reference.
+"""
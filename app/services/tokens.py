@@ -0,0 +1,56 @@
+import re
+import math
+from app.logger import log
+
+try:
+    import tiktoken
+    _encoder = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _encoder = None
+    log.info("tiktoken not available, prompt token counts are estimated")
+
+_PIECES = re.compile(r"[A-Za-z]+|\d+|\n[ \t]*| {2,}|[^\sA-Za-z\d]")
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    if _encoder is not None:
+        return len(_encoder.encode(text, disallowed_special=()))
+    # BPE vocabularies average roughly four characters per word piece
+    return sum(math.ceil(len(piece) / 4) if piece[0].isalnum() else 1 for piece in _PIECES.findall(text))
+
+def count_message_tokens(messages: list) -> int:
+    # per-message framing overhead used by the chat format
+    return sum(count_tokens(m.get("content") or "") + 4 for m in messages) + 2
+
+class PromptStats:
+    def __init__(self):
+        self.calls = 0
+        self.total_tokens = 0
+        self.max_tokens = 0
+        self.rejected = 0
+        self.upstream_prompt_tokens = 0
+        self.cached_prompt_tokens = 0
+
+    def record(self, tokens: int):
+        self.calls += 1
+        self.total_tokens += tokens
+        self.max_tokens = max(self.max_tokens, tokens)
+
+    def record_usage(self, prompt_tokens: int, cached_tokens: int):
+        self.upstream_prompt_tokens += prompt_tokens
+        self.cached_prompt_tokens += cached_tokens
+
+    def stats(self) -> dict:
+        return {
+            "exact": _encoder is not None,
+            "calls": self.calls,
+            "avgPromptTokens": round(self.total_tokens / self.calls, 1) if self.calls else 0,
+            "maxPromptTokens": self.max_tokens,
+            "rejected": self.rejected,
+            "upstreamPromptTokens": self.upstream_prompt_tokens,
+            "cachedPromptTokens": self.cached_prompt_tokens,
+            "prefixCacheHitRate": round(self.cached_prompt_tokens / self.upstream_prompt_tokens, 4) if self.upstream_prompt_tokens else 0.0,
+        }
+
+prompt_stats = PromptStats()
@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+from dotenv import load_dotenv
+from app.logger import log
+
+load_dotenv()
+DIAGRAM_STORE_MAX_SESSIONS = int(os.getenv("DIAGRAM_STORE_MAX_SESSIONS", "1000"))
+DIAGRAM_STORE_MAX_VERSIONS = int(os.getenv("DIAGRAM_STORE_MAX_VERSIONS", "20"))
+DIAGRAM_STORE_TTL_SECONDS = float(os.getenv("DIAGRAM_STORE_TTL_SECONDS", "86400"))
+DIAGRAM_STORE_SQLITE_PATH = os.getenv("DIAGRAM_STORE_SQLITE_PATH", "")
+
+class DiagramSession:
+    def __init__(self, diagram_id: str, diagram_type: str, code_type: str, is_renderable: bool,
+                 versions: List[str], first_version: int = 1, classes: Optional[list] = None, source_key: Optional[str] = None):
+        self.diagram_id = diagram_id
+        self.diagram_type = diagram_type
+        self.code_type = code_type
+        self.is_renderable = is_renderable
+        # only the newest max_versions texts are kept; first_version is the number of versions[0]
+        self.versions = versions
+        self.first_version = first_version
+        # the class model and request fingerprint the latest generation came from, for incremental regeneration
+        self.classes = classes
+        self.source_key = source_key
+
+    @property
+    def version(self) -> int:
+        return self.first_version + len(self.versions) - 1
+
+    def code(self, version: Optional[int] = None) -> Optional[str]:
+        index = (version or self.version) - self.first_version
+        if index < 0 or index >= len(self.versions):
+            return None
+        return self.versions[index]
+
+    def append(self, code: str, max_versions: int) -> int:
+        self.versions.append(code)
+        overflow = len(self.versions) - max_versions
+        if overflow > 0:
+            del self.versions[:overflow]
+            self.first_version += overflow
+        return self.version
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "diagramType": self.diagram_type,
+            "codeType": self.code_type,
+            "isRenderable": self.is_renderable,
+            "versions": self.versions,
+            "firstVersion": self.first_version,
+            "classes": self.classes,
+            "sourceKey": self.source_key,
+        })
+
+    @classmethod
+    def from_json(cls, diagram_id: str, payload: str) -> "DiagramSession":
+        data = json.loads(payload)
+        return cls(diagram_id, data["diagramType"], data["codeType"], data["isRenderable"],
+                   data["versions"], data["firstVersion"], data.get("classes"), data.get("sourceKey"))
+
+class SQLiteSessionTier:
+    def __init__(self, path: str, max_entries: int, ttl: float):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS diagram_sessions ("
+            "id TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_diagram_sessions_accessed ON diagram_sessions (accessed_at)")
+        self._conn.commit()
+
+    def get(self, diagram_id: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM diagram_sessions WHERE id = ?", (diagram_id,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._conn.execute("DELETE FROM diagram_sessions WHERE id = ?", (diagram_id,))
+                self._conn.commit()
+                return None
+            self._conn.execute(
+                "UPDATE diagram_sessions SET accessed_at = ?, expires_at = ? WHERE id = ?",
+                (now, now + self.ttl, diagram_id)
+            )
+            self._conn.commit()
+            return row[0]
+
+    def set(self, diagram_id: str, value: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO diagram_sessions (id, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (diagram_id, value, now + self.ttl, now)
+            )
+            self._conn.execute("DELETE FROM diagram_sessions WHERE expires_at < ?", (now,))
+            self._conn.execute(
+                "DELETE FROM diagram_sessions WHERE id IN ("
+                "SELECT id FROM diagram_sessions ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM diagram_sessions").fetchone()[0]
+
+class DiagramStore:
+    def __init__(self, max_sessions: int, max_versions: int, ttl: float, sqlite_path: str = ""):
+        self.max_sessions = max_sessions
+        self.max_versions = max_versions
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, tuple]" = OrderedDict()
+        self.disk = SQLiteSessionTier(sqlite_path, max_sessions, ttl) if sqlite_path else None
+        # keeps append + persist ordered so the disk tier never ends up with an older snapshot
+        self._write_lock = asyncio.Lock()
+        self.created = 0
+        self.evicted = 0
+
+    def _remember(self, session: DiagramSession):
+        self._sessions[session.diagram_id] = (session, time.monotonic() + self.ttl)
+        self._sessions.move_to_end(session.diagram_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.evicted += 1
+
+    async def _persist(self, session: DiagramSession):
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.set, session.diagram_id, session.to_json())
+
+    async def create(self, diagram_type: str, code_type: str, is_renderable: bool, code: str,
+                     classes: Optional[list] = None, source_key: Optional[str] = None) -> DiagramSession:
+        session = DiagramSession(uuid.uuid4().hex, diagram_type, code_type, is_renderable, [code], classes=classes, source_key=source_key)
+        self.created += 1
+        self._remember(session)
+        await self._persist(session)
+        return session
+
+    async def get(self, diagram_id: str) -> Optional[DiagramSession]:
+        entry = self._sessions.get(diagram_id)
+        if entry is not None:
+            session, expires_at = entry
+            if expires_at >= time.monotonic():
+                self._remember(session)
+                return session
+            del self._sessions[diagram_id]
+        if self.disk is not None:
+            payload = await asyncio.to_thread(self.disk.get, diagram_id)
+            if payload is not None:
+                session = DiagramSession.from_json(diagram_id, payload)
+                self._remember(session)
+                return session
+        return None
+
+    async def append(self, session: DiagramSession, code: str, classes: Optional[list] = None, source_key: Optional[str] = None) -> int:
+        async with self._write_lock:
+            if classes is not None:
+                session.classes = classes
+                session.source_key = source_key
+            version = session.append(code, self.max_versions)
+            self._remember(session)
+            await self._persist(session)
+        return version
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "created": self.created,
+            "evicted": self.evicted,
+            "diskSessions": len(self.disk) if self.disk is not None else None,
+        }
+
+diagram_store = DiagramStore(
+    DIAGRAM_STORE_MAX_SESSIONS, DIAGRAM_STORE_MAX_VERSIONS, DIAGRAM_STORE_TTL_SECONDS, DIAGRAM_STORE_SQLITE_PATH
+)
+log.info(
+    f"Diagram store initialised (sessions={DIAGRAM_STORE_MAX_SESSIONS}, versions={DIAGRAM_STORE_MAX_VERSIONS}, "
+    f"sqlite={'on' if DIAGRAM_STORE_SQLITE_PATH else 'off'})"
+)
@@ -0,0 +1,294 @@
+import os
+import time
+import uuid
+import asyncio
+import sqlite3
+import threading
+import importlib.util
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Tuple
+from dotenv import load_dotenv
+from app.logger import log
+
+load_dotenv()
+# disk is opt-in: only an explicit path (or the old per-process cache path) selects the SQLite backend,
+# so cached completions never land in a shared temp directory other processes can read or lock
+SHARED_SQLITE_PATH = os.getenv("SHARED_SQLITE_PATH", os.getenv("LLM_CACHE_SQLITE_PATH", ""))
+SHARED_BACKEND = os.getenv("SHARED_BACKEND", "sqlite" if SHARED_SQLITE_PATH else "memory").lower()
+SHARED_SQLITE_BUSY_TIMEOUT = float(os.getenv("SHARED_SQLITE_BUSY_TIMEOUT", "5"))
+SHARED_REDIS_URL = os.getenv("SHARED_REDIS_URL", "redis://127.0.0.1:6379/0")
+SHARED_MAX_ENTRIES = int(os.getenv("SHARED_MAX_ENTRIES", os.getenv("LLM_CACHE_SQLITE_MAX_ENTRIES", "10000")))
+SHARED_LOCKS_ENABLED = os.getenv("SHARED_LOCKS_ENABLED", "true").lower() == "true"
+SHARED_LOCK_TTL = float(os.getenv("SHARED_LOCK_TTL", "120"))
+SHARED_LOCK_WAIT = float(os.getenv("SHARED_LOCK_WAIT", "60"))
+SHARED_LOCK_POLL_MAX = float(os.getenv("SHARED_LOCK_POLL_MAX", "0.25"))
+
+class SharedBackend(ABC):
+    # Redis-shaped: string values with a TTL, plus SET NX PX style locks that expire if their owner dies
+    name = "none"
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ttl: float):
+        ...
+
+    @abstractmethod
+    async def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        ...
+
+    @abstractmethod
+    async def release(self, key: str, owner: str):
+        ...
+
+    async def size(self) -> Optional[int]:
+        return None
+
+    @abstractmethod
+    async def clear(self):
+        ...
+
+    async def close(self):
+        pass
+
+class MemoryBackend(SharedBackend):
+    # per-process only; also the stand-in for Redis when exercising the shared code paths locally
+    name = "memory"
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._values: Dict[str, Tuple[str, float]] = {}
+        self._locks: Dict[str, Tuple[str, float]] = {}
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        if entry[1] < time.monotonic():
+            del self._values[key]
+            return None
+        return entry[0]
+
+    async def set(self, key: str, value: str, ttl: float):
+        self._values.pop(key, None)
+        self._values[key] = (value, time.monotonic() + ttl)
+        while len(self._values) > self.max_entries:
+            # dicts keep insertion order, so this drops the oldest write
+            del self._values[next(iter(self._values))]
+
+    async def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        holder = self._locks.get(key)
+        if holder is not None and holder[1] >= time.monotonic():
+            return False
+        self._locks[key] = (owner, time.monotonic() + ttl)
+        return True
+
+    async def release(self, key: str, owner: str):
+        holder = self._locks.get(key)
+        if holder is not None and holder[0] == owner:
+            del self._locks[key]
+
+    async def size(self) -> Optional[int]:
+        return len(self._values)
+
+    async def clear(self):
+        self._values.clear()
+        self._locks.clear()
+
+class SQLiteBackend(SharedBackend):
+    # WAL lets every worker on the box read while one writes; each process keeps its own connection
+    name = "sqlite"
+
+    def __init__(self, path: str, max_entries: int, busy_timeout: float):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS shared_values ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, written_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_shared_values_written ON shared_values (written_at)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS shared_locks (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def _get(self, key: str) -> Optional[str]:
+        # reads stay read-only so concurrent workers never queue behind each other for a hit
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM shared_values WHERE key = ? AND expires_at >= ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def _set(self, key: str, value: str, ttl: float):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO shared_values (key, value, expires_at, written_at) VALUES (?, ?, ?, ?)",
+                (key, value, now + ttl, now)
+            )
+            self._writes += 1
+            if self._writes % 64 == 0:
+                # trimming scans the index, so it runs every few writes rather than on each one
+                self._conn.execute("DELETE FROM shared_values WHERE expires_at < ?", (now,))
+                self._conn.execute(
+                    "DELETE FROM shared_values WHERE key IN ("
+                    "SELECT key FROM shared_values ORDER BY written_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+
+    def _acquire(self, key: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM shared_locks WHERE key = ? AND expires_at < ?", (key, now))
+                inserted = self._conn.execute(
+                    "INSERT OR IGNORE INTO shared_locks (key, owner, expires_at) VALUES (?, ?, ?)", (key, owner, now + ttl)
+                ).rowcount
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return inserted == 1
+
+    def _release(self, key: str, owner: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM shared_locks WHERE key = ? AND owner = ?", (key, owner))
+
+    def _size(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM shared_values").fetchone()[0]
+
+    def _clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM shared_values")
+            self._conn.execute("DELETE FROM shared_locks")
+
+    async def get(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: str, ttl: float):
+        await asyncio.to_thread(self._set, key, value, ttl)
+
+    async def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        return await asyncio.to_thread(self._acquire, key, owner, ttl)
+
+    async def release(self, key: str, owner: str):
+        await asyncio.to_thread(self._release, key, owner)
+
+    async def size(self) -> Optional[int]:
+        return await asyncio.to_thread(self._size)
+
+    async def clear(self):
+        await asyncio.to_thread(self._clear)
+
+    async def close(self):
+        with self._lock:
+            self._conn.close()
+
+KEY_PREFIX = "archie:"
+_RELEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+class RedisBackend(SharedBackend):
+    # shares state across boxes, not just across the workers of one
+    name = "redis"
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+        self.url = url
+        self._client = redis.from_url(url, decode_responses=True)
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._client.get(key)
+
+    async def set(self, key: str, value: str, ttl: float):
+        await self._client.set(key, value, px=max(1, int(ttl * 1000)))
+
+    async def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        return bool(await self._client.set(key, owner, nx=True, px=max(1, int(ttl * 1000))))
+
+    async def release(self, key: str, owner: str):
+        # only the owner may delete, so a lock that expired and was re-taken is left alone
+        await self._client.eval(_RELEASE_SCRIPT, 1, key, owner)
+
+    async def clear(self):
+        async for key in self._client.scan_iter(match=f"{KEY_PREFIX}*"):
+            await self._client.delete(key)
+
+    async def close(self):
+        await self._client.aclose()
+
+def create_backend() -> SharedBackend:
+    if SHARED_BACKEND == "redis":
+        if importlib.util.find_spec("redis") is not None:
+            return RedisBackend(SHARED_REDIS_URL)
+        log.warning("SHARED_BACKEND=redis but the 'redis' package is not installed; falling back")
+    elif SHARED_BACKEND == "memory":
+        return MemoryBackend(SHARED_MAX_ENTRIES)
+    elif SHARED_BACKEND != "sqlite":
+        log.warning(f"Unknown SHARED_BACKEND {SHARED_BACKEND!r}; falling back")
+    if not SHARED_SQLITE_PATH:
+        if SHARED_BACKEND == "sqlite":
+            log.warning("SHARED_BACKEND=sqlite needs SHARED_SQLITE_PATH; state stays per process")
+        return MemoryBackend(SHARED_MAX_ENTRIES)
+    try:
+        return SQLiteBackend(SHARED_SQLITE_PATH, SHARED_MAX_ENTRIES, SHARED_SQLITE_BUSY_TIMEOUT)
+    except sqlite3.Error as e:
+        log.warning(f"Shared SQLite store at {SHARED_SQLITE_PATH} unavailable ({e}); state stays per process")
+        return MemoryBackend(SHARED_MAX_ENTRIES)
+
+class LockStats:
+    def __init__(self):
+        self.acquired = 0
+        self.waited = 0
+        self.timed_out = 0
+
+    def stats(self) -> dict:
+        return {"enabled": SHARED_LOCKS_ENABLED, "acquired": self.acquired, "waited": self.waited, "timedOut": self.timed_out}
+
+shared_backend = create_backend()
+lock_stats = LockStats()
+
+@asynccontextmanager
+async def shared_lock(key: str, wait: float):
+    # yields whether another holder was waited on; after `wait` seconds the caller proceeds unlocked
+    if not SHARED_LOCKS_ENABLED:
+        yield False
+        return
+    lock_key = f"{KEY_PREFIX}lock:{key}"
+    owner = uuid.uuid4().hex
+    deadline = time.monotonic() + wait
+    delay = 0.01
+    acquired = await shared_backend.acquire(lock_key, owner, SHARED_LOCK_TTL)
+    waited = not acquired
+    while not acquired and time.monotonic() < deadline:
+        await asyncio.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+        delay = min(SHARED_LOCK_POLL_MAX, delay * 2)
+        acquired = await shared_backend.acquire(lock_key, owner, SHARED_LOCK_TTL)
+    if acquired:
+        lock_stats.acquired += 1
+    else:
+        lock_stats.timed_out += 1
+    if waited:
+        lock_stats.waited += 1
+    try:
+        yield waited
+    finally:
+        if acquired:
+            # shielded so a cancelled request still hands the key over instead of leaving it until the TTL
+            await asyncio.shield(shared_backend.release(lock_key, owner))
+
+log.info(
+    f"Shared state backend initialised ({shared_backend.name}"
+    + (f" at {SHARED_SQLITE_PATH}" if shared_backend.name == "sqlite" else "")
+    + f", locks={'on' if SHARED_LOCKS_ENABLED else 'off'})"
+)
@@ -0,0 +1,200 @@
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+from dotenv import load_dotenv
+from app.cache import fingerprint, cache_bypass_ctx, CACHE_TTL_SECONDS
+from app.model import ClassModel, GenerateRequest, RenderMode
+from app.logger import log
+
+load_dotenv()
+SIMILARITY_CACHE_ENABLED = os.getenv("SIMILARITY_CACHE_ENABLED", "true").lower() == "true"
+SIMILARITY_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", "0.9"))
+SIMILARITY_CACHE_MAX_ENTRIES = int(os.getenv("SIMILARITY_CACHE_MAX_ENTRIES", "512"))
+SIMILARITY_SHINGLE_WORDS = int(os.getenv("SIMILARITY_SHINGLE_WORDS", "3"))
+SIMILARITY_BANDS = int(os.getenv("SIMILARITY_BANDS", "16"))
+SIMILARITY_ROWS = int(os.getenv("SIMILARITY_ROWS", "4"))
+SIMILARITY_HEADER = "X-Similarity-Threshold"
+
+_WORD = re.compile(r"\w+")
+_MERSENNE = (1 << 61) - 1
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+def _sorted(items: list) -> list:
+    return sorted(items, key=lambda item: json.dumps(item, sort_keys=True))
+
+def canonical_classes(classes: List[ClassModel]) -> list:
+    # class, attribute and relationship order carries no meaning, so it must not change the hash
+    canonical = []
+    for cls in classes:
+        data = cls.model_dump(mode="json")
+        data["className"] = data["className"].strip()
+        data["attributes"] = _sorted(data["attributes"])
+        data["relationships"] = _sorted(data["relationships"])
+        canonical.append(data)
+    return _sorted(canonical)
+
+def graph_fingerprint(classes: List[ClassModel]) -> str:
+    return fingerprint(canonical_classes(classes))
+
+class RequestFingerprint:
+    # scope is everything but the requirements text; only requests with the same scope can be near duplicates
+    def __init__(self, gen_req: GenerateRequest):
+        options = gen_req.model_dump(mode="json", exclude={"requirementsText", "classes", "diagramId"})
+        options["codeType"] = options["codeType"].strip().upper()
+        self.scope = fingerprint({**options, "classes": graph_fingerprint(gen_req.classes)})
+        self.text = normalize_text(gen_req.requirementsText)
+        self.key = fingerprint([self.scope, self.text])
+        # everything the output depends on besides the class model
+        self.source = fingerprint([options, self.text])
+        self.signature: Optional[Tuple[int, ...]] = None
+
+class MinHasher:
+    def __init__(self, num_perm: int, shingle_words: int, seed: int = 1):
+        rng = random.Random(seed)
+        self.shingle_words = shingle_words
+        self.perms = [(rng.randrange(1, _MERSENNE), rng.randrange(0, _MERSENNE)) for _ in range(num_perm)]
+
+    def shingles(self, text: str) -> Set[int]:
+        words = _WORD.findall(text)
+        n = self.shingle_words
+        grams = {" ".join(words[i:i + n]) for i in range(max(1, len(words) - n + 1))}
+        return {int.from_bytes(hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest(), "big") for gram in grams}
+
+    def signature(self, text: str) -> Tuple[int, ...]:
+        hashes = self.shingles(text)
+        return tuple(min((a * h + b) % _MERSENNE for h in hashes) for a, b in self.perms)
+
+def estimate_jaccard(left: Tuple[int, ...], right: Tuple[int, ...]) -> float:
+    return sum(1 for a, b in zip(left, right) if a == b) / len(left)
+
+def similarity_threshold(header_value: Optional[str]) -> float:
+    # clients may only ask for a stricter match: 1 means canonical duplicates only, above 1 disables the lookup
+    if header_value:
+        try:
+            return max(SIMILARITY_THRESHOLD, float(header_value))
+        except ValueError:
+            log.warning(f"Ignoring malformed {SIMILARITY_HEADER} header: {header_value!r}")
+    return SIMILARITY_THRESHOLD
+
+class _Entry:
+    def __init__(self, scope: str, signature: Tuple[int, ...], result: dict, expires_at: float):
+        self.scope = scope
+        self.signature = signature
+        self.result = result
+        self.expires_at = expires_at
+
+class SimilarityCache:
+    # MinHash over word shingles with LSH banding: a lookup only scores entries sharing at least one band
+    def __init__(self, max_entries: int, ttl: float, bands: int, rows: int, shingle_words: int):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.bands = bands
+        self.rows = rows
+        self.hasher = MinHasher(bands * rows, shingle_words)
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._buckets: Dict[tuple, Set[str]] = {}
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    def _band_keys(self, scope: str, signature: Tuple[int, ...]) -> List[tuple]:
+        return [(scope, band, signature[band * self.rows:(band + 1) * self.rows]) for band in range(self.bands)]
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        for band_key in self._band_keys(entry.scope, entry.signature):
+            bucket = self._buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band_key]
+
+    def _live(self, key: str) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def lookup(self, request_fp: RequestFingerprint, threshold: float) -> Optional[Tuple[dict, float]]:
+        if not SIMILARITY_CACHE_ENABLED:
+            return None
+        if cache_bypass_ctx.get() or threshold > 1:
+            self.bypassed += 1
+            return None
+        entry = self._live(request_fp.key)
+        if entry is not None:
+            self.exact_hits += 1
+            return entry.result, 1.0
+        if threshold >= 1:
+            self.misses += 1
+            return None
+        request_fp.signature = self.hasher.signature(request_fp.text)
+        candidates = set()
+        for band_key in self._band_keys(request_fp.scope, request_fp.signature):
+            candidates.update(self._buckets.get(band_key, ()))
+        best_key, best_score = None, 0.0
+        for key in candidates:
+            entry = self._live(key)
+            if entry is None:
+                continue
+            score = estimate_jaccard(request_fp.signature, entry.signature)
+            if score > best_score:
+                best_key, best_score = key, score
+        if best_key is None or best_score < threshold:
+            self.misses += 1
+            return None
+        self.similar_hits += 1
+        return self._entries[best_key].result, round(best_score, 4)
+
+    def store(self, request_fp: RequestFingerprint, result: dict):
+        # deterministic renders cost less than the lookup, so only LLM output is worth keeping, and only
+        # when no part of it is a fallback for a failed completion
+        if not SIMILARITY_CACHE_ENABLED or result.get("renderMode") != RenderMode.llm or result.get("degraded"):
+            return
+        if request_fp.signature is None:
+            request_fp.signature = self.hasher.signature(request_fp.text)
+        if request_fp.key in self._entries:
+            self._remove(request_fp.key)
+        self._entries[request_fp.key] = _Entry(request_fp.scope, request_fp.signature, result, time.monotonic() + self.ttl)
+        for band_key in self._band_keys(request_fp.scope, request_fp.signature):
+            self._buckets.setdefault(band_key, set()).add(request_fp.key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        self._entries.clear()
+        self._buckets.clear()
+
+    def stats(self) -> dict:
+        lookups = self.exact_hits + self.similar_hits + self.misses
+        return {
+            "enabled": SIMILARITY_CACHE_ENABLED,
+            "threshold": SIMILARITY_THRESHOLD,
+            "entries": len(self._entries),
+            "exactHits": self.exact_hits,
+            "similarHits": self.similar_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hitRate": round((self.exact_hits + self.similar_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+similarity_cache = SimilarityCache(
+    SIMILARITY_CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS, SIMILARITY_BANDS, SIMILARITY_ROWS, SIMILARITY_SHINGLE_WORDS
+)
+log.info(
+    f"Similarity cache initialised (enabled={SIMILARITY_CACHE_ENABLED}, threshold={SIMILARITY_THRESHOLD}, "
+    f"bands={SIMILARITY_BANDS}x{SIMILARITY_ROWS}, shingles={SIMILARITY_SHINGLE_WORDS} words)"
+)
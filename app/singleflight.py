@@ -0,0 +1,73 @@
+import asyncio
+import contextvars
+from typing import Any, Awaitable, Callable, Dict
+from app.logger import log, correlation_id_ctx
+from app.cache import cache_bypass_ctx
+from app.deadline import deadline_ctx, shared_deadline
+from app.admission import priority_ctx, PRIORITY_INTERACTIVE
+from app.metrics import request_metrics_ctx
+
+class _Call:
+    def __init__(self, task: asyncio.Task, correlation_id: str):
+        self.task = task
+        self.correlation_id = correlation_id
+        self.waiters = 0
+
+def _detach():
+    # runs inside the shared call's copied context, so nothing of the leader's request leaks into it:
+    # a bounded deadline of its own, interactive priority since any waiter may be interactive,
+    # its own log tag and its own stage timings
+    deadline_ctx.set(shared_deadline())
+    priority_ctx.set(PRIORITY_INTERACTIVE)
+    correlation_id_ctx.set(f"{correlation_id_ctx.get()}:shared")
+    current = request_metrics_ctx.get()
+    if current is not None:
+        request_metrics_ctx.set(current.detached())
+    return correlation_id_ctx.get()
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[str, _Call] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.bypassed = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        if cache_bypass_ctx.get():
+            # a caller asking for a fresh answer must not be handed someone else's in-flight one
+            self.bypassed += 1
+            return await fn()
+        call = self._calls.get(key)
+        if call is None:
+            context = contextvars.copy_context()
+            shared_id = context.run(_detach)
+            call = _Call(asyncio.create_task(fn(), context=context), shared_id)
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _t, k=key, c=call: self._forget(k, c))
+            self.leaders += 1
+            log.info(f"Started shared {self.name} call {shared_id}")
+        else:
+            self.coalesced += 1
+            log.info(f"Coalesced with in-flight {self.name} call {call.correlation_id}")
+        call.waiters += 1
+        try:
+            # shield so a disconnecting caller does not cancel the shared upstream call
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                log.info(f"Last waiter left, cancelling in-flight {self.name} call {call.correlation_id}")
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _forget(self, key: str, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        if not call.task.cancelled():
+            # mark the exception as retrieved when every waiter has gone away
+            call.task.exception()
+
+    def stats(self) -> dict:
+        return {"inFlight": len(self._calls), "leaders": self.leaders, "coalesced": self.coalesced, "bypassed": self.bypassed}
@@ -0,0 +1,75 @@
+import json
+from typing import Awaitable, Callable, Optional
+from fastapi.responses import StreamingResponse
+from app.handlers import LLMServiceError, ServiceOverloadedError, PromptTooLargeError, describe_error
+from app.kadalClient import stream_chat_completion
+from app.services.prompts import MarkdownStreamStripper, strip_markdown
+from app.services.lint import fix_diagram, lint_diagram, lint_stats, DIAGRAM_LINT_ENABLED
+from app.logger import log
+from app.metrics import record_error
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def sse_error(exc: Exception, correlation_id: str) -> str:
+    error = describe_error(exc)
+    record_error(error["code"])
+    return sse_event("error", {**error, "correlation_id": correlation_id})
+
+def checked_output(code: str, meta: dict, correlation_id: str) -> dict:
+    # tokens are already on the wire, so the done event carries the fixed code and whatever is still wrong
+    # instead of a repair round trip
+    if not DIAGRAM_LINT_ENABLED or not meta.get("isRenderable"):
+        return {"diagramCode": code}
+    lint_stats.checked += 1
+    fixed, fixes = fix_diagram(code, meta["codeType"], meta["diagramType"].value)
+    if fixes:
+        lint_stats.fixed += 1
+        log.info(f"Applied lint fixes to streamed output: {'; '.join(fixes)}", extra={'correlation_id': correlation_id})
+    issues = lint_diagram(fixed, meta["codeType"])
+    if not fixes and not issues:
+        return {"diagramCode": fixed}
+    if issues:
+        lint_stats.unresolved += 1
+        log.warning(f"Unresolved lint issues in streamed output: {'; '.join(i.describe() for i in issues)}", extra={'correlation_id': correlation_id})
+    return {"diagramCode": fixed, "lint": {"fixes": fixes, "issues": [issue.describe() for issue in issues]}}
+
+async def completion_events(messages: Optional[list], meta: dict, correlation_id: str, operation: str = "generate",
+                            on_complete: Optional[Callable[[str], Awaitable[dict]]] = None):
+    if messages is None:
+        # already complete (deterministic render or stitched partitions): emit it as a single token
+        yield sse_event("token", {"delta": meta["diagramCode"]})
+        yield sse_event("done", {**meta, "correlation_id": correlation_id})
+        return
+    stripper = MarkdownStreamStripper()
+    raw_parts = []
+    try:
+        async for delta in stream_chat_completion(messages, correlation_id=correlation_id, operation=operation):
+            raw_parts.append(delta)
+            cleaned = stripper.feed(delta)
+            if cleaned:
+                yield sse_event("token", {"delta": cleaned})
+        tail = stripper.flush()
+        if tail:
+            yield sse_event("token", {"delta": tail})
+    except (LLMServiceError, ServiceOverloadedError, PromptTooLargeError) as e:
+        yield sse_error(e, correlation_id)
+        return
+    except Exception as e:
+        log.exception(f"Unhandled Exception while streaming: {str(e)}", extra={'correlation_id': correlation_id})
+        yield sse_error(e, correlation_id)
+        return
+    output = checked_output(strip_markdown("".join(raw_parts)), meta, correlation_id)
+    if on_complete is not None:
+        try:
+            output.update(await on_complete(output["diagramCode"]))
+        except Exception as e:
+            log.exception(f"Failed to record streamed output: {str(e)}", extra={'correlation_id': correlation_id})
+            yield sse_error(e, correlation_id)
+            return
+    yield sse_event("done", {**meta, **output, "correlation_id": correlation_id})
+
+def event_stream_response(events) -> StreamingResponse:
+    return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
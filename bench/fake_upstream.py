@@ -0,0 +1,185 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse, Response
+from starlette.routing import Route
+from bench.payloads import sample_request
+
+class UpstreamConfig:
+    def __init__(self, latency_ms: float, jitter: float, tokens_per_second: float, error_rate: float,
+                 throttle_rate: float, cached_ratio: float):
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.cached_ratio = cached_ratio
+
+    def time_to_first_token(self) -> float:
+        # lognormal around the configured median, so the tail looks like a real provider
+        return self.latency_ms / 1000 * random.lognormvariate(0, self.jitter) if self.jitter else self.latency_ms / 1000
+
+class UpstreamStats:
+    def __init__(self):
+        self.calls = 0
+        self.streamed = 0
+        self.errors = 0
+        self.throttled = 0
+        self.busy_seconds = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "streamed": self.streamed,
+            "errors": self.errors,
+            "throttled": self.throttled,
+            "busySeconds": round(self.busy_seconds, 4),
+        }
+
+def _plantuml_class_diagram(classes) -> str:
+    lines = ["@startuml"]
+    for cls in classes:
+        lines.append(f"class {cls['className']} {{")
+        lines.extend(f"  - {a['name']} : {a['type']}" for a in cls["attributes"])
+        lines.append("}")
+    for cls in classes:
+        lines.extend(f"{r['source']} --> {r['target']} : {r.get('label') or ''}" for r in cls["relationships"])
+    lines.append("@enduml")
+    return "\n".join(lines)
+
+def _mermaid_class_diagram(classes) -> str:
+    lines = ["classDiagram"]
+    for cls in classes:
+        lines.append(f"  class {cls['className']} {{")
+        lines.extend(f"    -{a['type']} {a['name']}" for a in cls["attributes"])
+        lines.append("  }")
+    for cls in classes:
+        lines.extend(f"  {r['source']} --> {r['target']}" for r in cls["relationships"])
+    return "\n".join(lines)
+
+def _sql(classes) -> str:
+    tables = []
+    for cls in classes:
+        columns = ",\n".join(f"    {a['name']} VARCHAR(255)" for a in cls["attributes"])
+        tables.append(f"CREATE TABLE {cls['className'].lower()} (\n{columns}\n);")
+    return "### SQL\n\n" + "\n\n".join(tables) + "\n\n### NoSQL\n\ndb.createCollection(\"placeholder\");"
+
+SAMPLE_CLASSES = sample_request()["classes"]
+RESPONSES = {
+    "extract": json.dumps({"projectName": "Bench", "classes": SAMPLE_CLASSES}),
+    "derived": _sql(SAMPLE_CLASSES),
+    "plantuml": "```plantuml\n" + _plantuml_class_diagram(SAMPLE_CLASSES) + "\n```",
+    "mermaid": _mermaid_class_diagram(SAMPLE_CLASSES),
+}
+
+def pick_response(body: dict) -> str:
+    system = body["messages"][0]["content"]
+    user = body["messages"][-1]["content"]
+    if body.get("response_format") or "valid JSON" in system:
+        return RESPONSES["extract"]
+    if "strict code generator" in system or "technical expert" in system:
+        return RESPONSES["derived"]
+    if "[Fragment" in user:
+        # fragment refinements echo the fragment back unchanged
+        return user.split("]:\n", 2)[2].rsplit("\n[User Instructions]", 1)[0]
+    return RESPONSES["mermaid"] if "Mermaid" in system or "MERMAID" in system else RESPONSES["plantuml"]
+
+def _usage(body: dict, content: str, config: UpstreamConfig) -> dict:
+    prompt_tokens = sum(len(m.get("content") or "") for m in body["messages"]) // 4
+    completion_tokens = max(1, len(content) // 4)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": int(prompt_tokens * config.cached_ratio) // 128 * 128},
+    }
+
+def create_app(config: UpstreamConfig) -> Starlette:
+    stats = UpstreamStats()
+
+    async def chat_completions(request: Request):
+        body = await request.json()
+        started = time.perf_counter()
+        stats.calls += 1
+        roll = random.random()
+        if roll < config.throttle_rate:
+            stats.throttled += 1
+            return JSONResponse({"error": {"code": "429", "message": "Rate limit exceeded"}}, status_code=429, headers={"Retry-After": "1"})
+        if roll < config.throttle_rate + config.error_rate:
+            stats.errors += 1
+            return JSONResponse({"error": {"code": "500", "message": "Injected upstream failure"}}, status_code=500)
+        content = pick_response(body)
+        usage = _usage(body, content, config)
+        per_token = 1 / config.tokens_per_second if config.tokens_per_second else 0
+        await asyncio.sleep(config.time_to_first_token())
+        if not body.get("stream"):
+            await asyncio.sleep(usage["completion_tokens"] * per_token)
+            # hedged calls that lost the race were abandoned by the service and did not make it wait
+            if not await request.is_disconnected():
+                stats.busy_seconds += time.perf_counter() - started
+            return JSONResponse({
+                "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()), "model": body.get("model", "bench"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+        stats.streamed += 1
+
+        async def events():
+            try:
+                for i in range(0, len(content), 4):
+                    chunk = {
+                        "id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()), "model": body.get("model", "bench"),
+                        "choices": [{"index": 0, "delta": {"content": content[i:i + 4]}, "finish_reason": None}],
+                    }
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                    if per_token:
+                        await asyncio.sleep(per_token)
+                yield "data: [DONE]\n\n"
+            finally:
+                stats.busy_seconds += time.perf_counter() - started
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    async def upstream_stats(request: Request):
+        return JSONResponse(stats.as_dict())
+
+    async def reset_stats(request: Request):
+        nonlocal stats
+        stats = UpstreamStats()
+        return JSONResponse(stats.as_dict())
+
+    async def anything(request: Request):
+        # connection warm-up probes from the service
+        return Response("ok")
+
+    return Starlette(routes=[
+        Route("/openai/deployments/{model}/chat/completions", chat_completions, methods=["POST"]),
+        Route("/__stats", upstream_stats, methods=["GET"]),
+        Route("/__reset", reset_stats, methods=["POST"]),
+        Route("/{path:path}", anything, methods=["GET", "HEAD"]),
+    ])
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the Azure OpenAI chat completions endpoint")
+    parser.add_argument("--port", type=int, default=int(os.getenv("FAKE_UPSTREAM_PORT", "9100")))
+    parser.add_argument("--latency-ms", type=float, default=800, help="median time to first token")
+    parser.add_argument("--jitter", type=float, default=0.3, help="lognormal sigma applied to the latency")
+    parser.add_argument("--tokens-per-second", type=float, default=0, help="output token rate, 0 for instant")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls answered with a 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of calls answered with a 429")
+    parser.add_argument("--cached-ratio", type=float, default=0.0, help="share of prompt tokens reported as cached")
+    return parser.parse_args(argv)
+
+def config_from_args(args) -> UpstreamConfig:
+    return UpstreamConfig(args.latency_ms, args.jitter, args.tokens_per_second, args.error_rate,
+                          args.throttle_rate, args.cached_ratio)
+
+if __name__ == "__main__":
+    import uvicorn
+    args = parse_args(sys.argv[1:])
+    uvicorn.run(create_app(config_from_args(args)), host="127.0.0.1", port=args.port, log_level="warning")
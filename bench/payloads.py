@@ -0,0 +1,51 @@
+import json
+import itertools
+from pathlib import Path
+
+README = Path(__file__).resolve().parent.parent / "readme.md"
+_counter = itertools.count()
+
+def sample_request() -> dict:
+    # readme.md holds the sample request body the service was built around
+    return json.loads(README.read_text(encoding="utf-8"))
+
+def _unique(text: str) -> str:
+    # defeats single-flight coalescing so every request reaches the upstream
+    return f"{text}\n\n(bench request {next(_counter)})"
+
+def generate_payload(diagram_type: str, code_type: str, **extra) -> dict:
+    sample = sample_request()
+    return {
+        "diagramType": diagram_type,
+        "codeType": code_type,
+        "requirementsText": _unique(sample["requirementsText"]),
+        "classes": sample["classes"],
+        **extra,
+    }
+
+def extract_payload() -> dict:
+    return {"projectName": "Student Management System", "requirementsText": _unique(sample_request()["requirementsText"])}
+
+def refine_payload() -> dict:
+    lines = ["@startuml"]
+    for cls in sample_request()["classes"]:
+        lines.append(f"class {cls['className']} {{")
+        lines.extend(f"  - {a['name']} : {a['type']}" for a in cls["attributes"])
+        lines.append("}")
+    lines.append("@enduml")
+    return {
+        "diagramType": "CLASS",
+        "codeType": "PLANTUML",
+        "diagramCode": "\n".join(lines),
+        "userInstruction": _unique("Rename Financial to Invoice and add a dueDate attribute."),
+    }
+
+# name -> (path, payload factory, weight)
+SCENARIOS = {
+    "generate-class": ("/generate", lambda: generate_payload("CLASS", "PLANTUML"), 4),
+    "generate-class-deterministic": ("/generate", lambda: generate_payload("CLASS", "PLANTUML", renderMode="deterministic"), 1),
+    "generate-erd-mermaid": ("/generate", lambda: generate_payload("ERD", "MERMAID"), 2),
+    "generate-database": ("/generate", lambda: generate_payload("DATABASE", "PLANTUML"), 1),
+    "extract": ("/extract", extract_payload, 2),
+    "refine": ("/refine", refine_payload, 3),
+}
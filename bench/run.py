@@ -0,0 +1,280 @@
+# Load benchmark for the service against a local fake upstream.
+#
+#   python -m bench.run --duration 30 --concurrency 32 --latency-ms 800 --throttle-rate 0.02
+#   python -m bench.run --workers 4 --output bench_output.txt --max-overhead-ms 50
+#
+# Exits non-zero when a --min-rps / --max-p99-ms / --max-overhead-ms budget is missed.
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import httpx
+from bench.payloads import SCENARIOS
+
+ROOT = Path(__file__).resolve().parent.parent
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark /generate, /extract and /refine against a fake upstream")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--upstream-port", type=int, default=9100)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes for the service")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight")
+    parser.add_argument("--duration", type=float, default=20, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3, help="unmeasured seconds before the run")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma separated subset of " + ", ".join(SCENARIOS))
+    parser.add_argument("--latency-ms", type=float, default=800)
+    parser.add_argument("--jitter", type=float, default=0.3)
+    parser.add_argument("--tokens-per-second", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--cached-ratio", type=float, default=0.0)
+    parser.add_argument("--service-env", action="append", default=[], metavar="KEY=VALUE", help="extra environment for the service")
+    parser.add_argument("--use-cache", action="store_true", help="let the completion cache answer repeated prompts")
+    parser.add_argument("--payload-pool", type=int, default=0, help="draw requests from this many fixed payloads per scenario instead of unique ones")
+    parser.add_argument("--output", help="also write the report to this file")
+    parser.add_argument("--json", help="write the raw results as JSON to this file")
+    parser.add_argument("--min-rps", type=float)
+    parser.add_argument("--max-p99-ms", type=float)
+    parser.add_argument("--max-overhead-ms", type=float)
+    return parser.parse_args(argv)
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))]
+
+def _rss_kb(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+def _children(pid: int) -> List[int]:
+    children = []
+    for entry in Path("/proc").iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            # the command name may contain spaces, the ppid follows the closing parenthesis
+            fields = (entry / "stat").read_text().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(entry.name))
+    return children
+
+def worker_rss(pid: int) -> Dict[int, int]:
+    # with --workers > 1 uvicorn's parent only supervises; the children serve requests
+    pids = _children(pid) or [pid]
+    return {p: rss for p in pids if (rss := _rss_kb(p)) is not None}
+
+def start_process(args: List[str], env: dict) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, *args], cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+async def wait_ready(client: httpx.AsyncClient, url: str, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited during startup: {process.stderr.read().decode(errors='replace')[-2000:]}")
+        try:
+            await client.get(url)
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready within {timeout}s")
+
+class Recorder:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self.statuses: Dict[str, Dict[int, int]] = {}
+
+    def add(self, scenario: str, status: int, latency: float):
+        self.samples.setdefault(scenario, []).append(latency)
+        counts = self.statuses.setdefault(scenario, {})
+        counts[status] = counts.get(status, 0) + 1
+
+def payload_pools(scenarios: List[str], size: int) -> Dict[str, list]:
+    # repeated payloads let a run measure cache hit rates; unique ones measure the full pipeline
+    return {name: [SCENARIOS[name][1]() for _ in range(size)] for name in scenarios} if size else {}
+
+async def drive(client: httpx.AsyncClient, base_url: str, scenarios: List[str], concurrency: int, duration: float, headers: dict,
+                pools: Optional[Dict[str, list]] = None) -> Recorder:
+    recorder = Recorder()
+    weights = [SCENARIOS[name][2] for name in scenarios]
+    deadline = time.monotonic() + duration
+
+    async def loop():
+        while time.monotonic() < deadline:
+            name = random.choices(scenarios, weights)[0]
+            path, payload, _ = SCENARIOS[name]
+            body = random.choice(pools[name]) if pools else payload()
+            started = time.perf_counter()
+            try:
+                response = await client.post(base_url + path, json=body, headers=headers)
+                status = response.status_code
+            except httpx.HTTPError:
+                status = 0
+            recorder.add(name, status, time.perf_counter() - started)
+
+    await asyncio.gather(*(loop() for _ in range(concurrency)))
+    return recorder
+
+async def sample_memory(pid: int, peaks: Dict[int, int], stop: asyncio.Event):
+    while not stop.is_set():
+        for worker, rss in worker_rss(pid).items():
+            peaks[worker] = max(peaks.get(worker, 0), rss)
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=1)
+        except asyncio.TimeoutError:
+            pass
+
+def summarize(recorder: Recorder, elapsed: float, upstream: dict, peaks: Dict[int, int], final_rss: Dict[int, int]) -> dict:
+    scenarios = {}
+    all_latencies = []
+    for name, latencies in sorted(recorder.samples.items()):
+        statuses = recorder.statuses[name]
+        all_latencies.extend(latencies)
+        scenarios[name] = {
+            "requests": len(latencies),
+            "errors": sum(count for status, count in statuses.items() if status != 200),
+            "statuses": {str(status): count for status, count in sorted(statuses.items())},
+            "rps": round(len(latencies) / elapsed, 2),
+            "p50Ms": round(percentile(latencies, 50) * 1000, 1),
+            "p95Ms": round(percentile(latencies, 95) * 1000, 1),
+            "p99Ms": round(percentile(latencies, 99) * 1000, 1),
+        }
+    total = len(all_latencies)
+    # every upstream call belongs to exactly one request, so the difference is time spent in the service
+    overhead = (sum(all_latencies) - upstream.get("busySeconds", 0)) / total if total else 0.0
+    return {
+        "elapsedSeconds": round(elapsed, 2),
+        "requests": total,
+        "rps": round(total / elapsed, 2) if elapsed else 0.0,
+        "p50Ms": round(percentile(all_latencies, 50) * 1000, 1),
+        "p95Ms": round(percentile(all_latencies, 95) * 1000, 1),
+        "p99Ms": round(percentile(all_latencies, 99) * 1000, 1),
+        "overheadMs": round(overhead * 1000, 2),
+        "upstreamCallsPerRequest": round(upstream.get("calls", 0) / total, 3) if total else 0.0,
+        "upstream": upstream,
+        "workers": [
+            {"pid": pid, "rssMb": round(final_rss.get(pid, 0) / 1024, 1), "peakRssMb": round(peaks.get(pid, 0) / 1024, 1)}
+            for pid in sorted(set(peaks) | set(final_rss))
+        ],
+        "scenarios": scenarios,
+    }
+
+def format_report(summary: dict, args) -> str:
+    lines = [
+        f"workers={args.workers} concurrency={args.concurrency} duration={summary['elapsedSeconds']}s "
+        f"upstream latency={args.latency_ms}ms jitter={args.jitter} tps={args.tokens_per_second or 'instant'} "
+        f"errors={args.error_rate} throttles={args.throttle_rate}",
+        "",
+        f"{'scenario':<30}{'reqs':>7}{'errs':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}",
+    ]
+    for name, row in summary["scenarios"].items():
+        lines.append(f"{name:<30}{row['requests']:>7}{row['errors']:>6}{row['rps']:>9}{row['p50Ms']:>10}{row['p95Ms']:>10}{row['p99Ms']:>10}")
+    lines.append(
+        f"{'total':<30}{summary['requests']:>7}{sum(r['errors'] for r in summary['scenarios'].values()):>6}"
+        f"{summary['rps']:>9}{summary['p50Ms']:>10}{summary['p95Ms']:>10}{summary['p99Ms']:>10}"
+    )
+    upstream = summary["upstream"]
+    lines += [
+        "",
+        f"upstream calls={upstream.get('calls', 0)} streamed={upstream.get('streamed', 0)} "
+        f"errors={upstream.get('errors', 0)} throttled={upstream.get('throttled', 0)} busy={upstream.get('busySeconds', 0)}s",
+        f"service overhead (latency minus upstream time) per request: {summary['overheadMs']} ms",
+        f"upstream calls per request: {summary['upstreamCallsPerRequest']}",
+    ]
+    for worker in summary["workers"]:
+        lines.append(f"worker pid={worker['pid']} rss={worker['rssMb']} MB peak={worker['peakRssMb']} MB")
+    return "\n".join(lines)
+
+def check_budgets(summary: dict, args) -> List[str]:
+    failures = []
+    if args.min_rps is not None and summary["rps"] < args.min_rps:
+        failures.append(f"rps {summary['rps']} below {args.min_rps}")
+    if args.max_p99_ms is not None and summary["p99Ms"] > args.max_p99_ms:
+        failures.append(f"p99 {summary['p99Ms']}ms above {args.max_p99_ms}ms")
+    if args.max_overhead_ms is not None and summary["overheadMs"] > args.max_overhead_ms:
+        failures.append(f"overhead {summary['overheadMs']}ms above {args.max_overhead_ms}ms")
+    return failures
+
+async def measure(args) -> Tuple[dict, dict]:
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(unknown)}")
+    upstream_url = f"http://127.0.0.1:{args.upstream_port}"
+    service_url = f"http://127.0.0.1:{args.port}"
+    env = {**os.environ, "PYTHONPATH": str(ROOT)}
+    upstream = start_process([
+        "-m", "bench.fake_upstream", "--port", str(args.upstream_port),
+        "--latency-ms", str(args.latency_ms), "--jitter", str(args.jitter),
+        "--tokens-per-second", str(args.tokens_per_second), "--error-rate", str(args.error_rate),
+        "--throttle-rate", str(args.throttle_rate), "--cached-ratio", str(args.cached_ratio),
+    ], env)
+    service_env = {**env, "LLM_ENDPOINT": upstream_url, "LLM_API_KEY": env.get("LLM_API_KEY", "bench")}
+    for item in args.service_env:
+        key, _, value = item.partition("=")
+        service_env[key] = value
+    service = start_process([
+        "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(args.port),
+        "--workers", str(args.workers), "--log-level", "warning",
+    ], service_env)
+    headers = {} if args.use_cache else {"X-Cache-Bypass": "1"}
+    pools = payload_pools(scenarios, args.payload_pool)
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+    try:
+        async with httpx.AsyncClient(timeout=300, limits=limits) as client:
+            await wait_ready(client, upstream_url + "/__stats", upstream)
+            await wait_ready(client, service_url + "/stats", service)
+            if args.warmup:
+                await drive(client, service_url, scenarios, args.concurrency, args.warmup, headers, pools)
+            await client.post(upstream_url + "/__reset")
+            peaks: Dict[int, int] = {}
+            stop = asyncio.Event()
+            sampler = asyncio.create_task(sample_memory(service.pid, peaks, stop))
+            started = time.perf_counter()
+            recorder = await drive(client, service_url, scenarios, args.concurrency, args.duration, headers, pools)
+            elapsed = time.perf_counter() - started
+            stop.set()
+            await sampler
+            final_rss = worker_rss(service.pid)
+            upstream_stats = (await client.get(upstream_url + "/__stats")).json()
+            service_stats = (await client.get(service_url + "/stats")).json()
+    finally:
+        for process in (service, upstream):
+            process.terminate()
+        for process in (service, upstream):
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+    return summarize(recorder, elapsed, upstream_stats, peaks, final_rss), service_stats
+
+async def run(args) -> int:
+    summary, service_stats = await measure(args)
+    report = format_report(summary, args)
+    print(report)
+    if args.output:
+        Path(args.output).write_text(report + "\n", encoding="utf-8")
+    if args.json:
+        Path(args.json).write_text(json.dumps({**summary, "serviceStats": service_stats}, indent=2), encoding="utf-8")
+    failures = check_budgets(summary, args)
+    for failure in failures:
+        print(f"BUDGET EXCEEDED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(run(parse_args(sys.argv[1:]))))
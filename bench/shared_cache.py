@@ -0,0 +1,73 @@
+# Compares per-process and shared completion caching across uvicorn workers.
+#
+#   python -m bench.shared_cache --workers 4 --payload-pool 200 --duration 20
+#   python -m bench.shared_cache --backends memory,sqlite,redis --service-env SHARED_REDIS_URL=redis://127.0.0.1:6379/1
+#
+# Every request draws from a fixed pool of payloads, so each distinct prompt should reach the
+# upstream once. With per-process state every worker pays for its own miss.
+import sys
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+from bench.run import parse_args as parse_run_args, measure
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Hit rate and latency of per-process vs shared completion caching")
+    parser.add_argument("--backends", default="memory,sqlite", help="SHARED_BACKEND values to compare; memory is per-process")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--payload-pool", type=int, default=200)
+    parser.add_argument("--scenarios", default="generate-class")
+    parser.add_argument("--latency-ms", type=float, default=800)
+    parser.add_argument("--service-env", action="append", default=[], metavar="KEY=VALUE")
+    parser.add_argument("--output", help="also write the report to this file")
+    return parser.parse_args(argv)
+
+def run_args(args, backend: str, store: Path) -> argparse.Namespace:
+    service_env = [
+        f"SHARED_BACKEND={backend}",
+        f"SHARED_SQLITE_PATH={store}",
+        # the similarity cache is per-process and would answer repeats before the completion cache sees them
+        "SIMILARITY_CACHE_ENABLED=false",
+        *args.service_env,
+    ]
+    argv = [
+        "--workers", str(args.workers), "--concurrency", str(args.concurrency), "--duration", str(args.duration),
+        "--warmup", "0", "--scenarios", args.scenarios, "--latency-ms", str(args.latency_ms),
+        "--payload-pool", str(args.payload_pool), "--use-cache",
+    ]
+    for item in service_env:
+        argv += ["--service-env", item]
+    return parse_run_args(argv)
+
+async def compare(args) -> str:
+    rows = []
+    for backend in [name.strip() for name in args.backends.split(",") if name.strip()]:
+        with tempfile.TemporaryDirectory() as tmp:
+            summary, service_stats = await measure(run_args(args, backend, Path(tmp) / "shared.sqlite3"))
+        requests = summary["requests"]
+        calls = summary["upstream"].get("calls", 0)
+        rows.append((backend, requests, calls, 1 - calls / requests if requests else 0.0, summary["rps"], summary["p50Ms"], summary["p95Ms"]))
+        print(f"{backend}: done ({requests} requests)", file=sys.stderr)
+    lines = [
+        f"workers={args.workers} concurrency={args.concurrency} duration={args.duration}s pool={args.payload_pool} "
+        f"scenarios={args.scenarios} upstream latency={args.latency_ms}ms",
+        "",
+        f"{'backend':<10}{'reqs':>8}{'upstream':>10}{'hit rate':>10}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}",
+    ]
+    for backend, requests, calls, hit_rate, rps, p50, p95 in rows:
+        lines.append(f"{backend:<10}{requests:>8}{calls:>10}{hit_rate:>10.1%}{rps:>9}{p50:>10}{p95:>10}")
+    return "\n".join(lines)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    report = asyncio.run(compare(args))
+    print(report)
+    if args.output:
+        Path(args.output).write_text(report + "\n", encoding="utf-8")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,29 @@
+import os
+
+# app modules read their settings at import time; keep tests off the network and the log file
+os.environ.setdefault("LLM_API_KEY", "test")
+os.environ.setdefault("LOG_SINKS", "console")
+os.environ.setdefault("SHARED_BACKEND", "memory")
+
+import pytest
+from app.model import ClassModel
+
+@pytest.fixture
+def sample_classes():
+    # a strong entity, a referencing entity and a weak child whose name needs aliasing
+    return [ClassModel(**cls) for cls in [
+        {"className": "Customer", "attributes": [
+            {"name": "id", "type": "int", "nature": "Identifying", "required": True},
+            {"name": "fullName", "type": "string", "nature": "Descriptive", "required": True},
+            {"name": "email", "type": "string", "nature": "Optional", "required": False}],
+         "relationships": [{"source": "Customer", "target": "Order", "nature": "Association",
+                            "sourcetype": "One", "targettype": "Many", "label": "places"}]},
+        {"className": "Order", "attributes": [
+            {"name": "id", "type": "int", "nature": "Identifying", "required": True},
+            {"name": "placedAt", "type": "datetime", "nature": "Descriptive", "required": True}],
+         "relationships": [{"source": "Order", "target": "Order Line", "nature": "Composition",
+                            "sourcetype": "One", "targettype": "Many"}]},
+        {"className": "Order Line", "attributes": [
+            {"name": "quantity", "type": "int", "nature": "Descriptive", "required": True}],
+         "relationships": []},
+    ]]
@@ -0,0 +1,74 @@
+import json
+import asyncio
+import pytest
+from app.admission import AdaptiveLimiter, PRIORITY_BATCH, PRIORITY_INTERACTIVE
+from app.handlers import PriorityQuotaError, ServiceOverloadedError, global_exception_handler
+
+def _limiter() -> AdaptiveLimiter:
+    return AdaptiveLimiter(16, 1, 64, 100, 5, 10)
+
+def _next_window(limiter: AdaptiveLimiter):
+    limiter._last_decrease -= 60
+
+def test_throttles_in_one_window_halve_the_limit_once():
+    limiter = _limiter()
+    # two retried 429s and the final failure of the same call
+    limiter.on_throttle()
+    limiter.on_throttle()
+    limiter.record(0.1, throttled=True)
+    assert limiter.limit == 8
+    assert limiter.throttled == 3
+
+def test_throttles_in_later_windows_halve_again():
+    limiter = _limiter()
+    limiter.on_throttle()
+    _next_window(limiter)
+    limiter.on_throttle()
+    assert limiter.limit == 4
+
+def test_limit_never_drops_below_the_minimum():
+    limiter = _limiter()
+    for _ in range(10):
+        limiter.record(0.1, throttled=True)
+        _next_window(limiter)
+    assert limiter.limit == 1
+
+def test_healthy_calls_grow_the_limit_additively():
+    limiter = _limiter()
+    limiter.record(0.1, throttled=False)
+    assert limiter.limit == 16 + 1 / 16
+
+def _shed(max_queue: int, batch_max_queue: int, queued: list, priority: int):
+    # one slot taken and the given priorities waiting for it; returns the error a new caller gets, if any
+    async def main():
+        limiter = AdaptiveLimiter(1, 1, 1, max_queue, 5, 10, batch_max_queue)
+        await limiter.acquire(PRIORITY_INTERACTIVE)
+        waiters = [asyncio.create_task(limiter.acquire(p)) for p in queued]
+        caller = asyncio.create_task(limiter.acquire(priority))
+        await asyncio.sleep(0)
+        error = caller.exception() if caller.done() else None
+        for task in waiters + [caller]:
+            task.cancel()
+        await asyncio.gather(*waiters, caller, return_exceptions=True)
+        return error
+    return asyncio.run(main())
+
+def test_batch_over_its_queue_share_gets_a_quota_error():
+    assert isinstance(_shed(4, 2, [PRIORITY_BATCH, PRIORITY_BATCH], PRIORITY_BATCH), PriorityQuotaError)
+
+def test_interactive_callers_still_queue_while_batch_is_over_quota():
+    assert _shed(4, 2, [PRIORITY_BATCH, PRIORITY_BATCH], PRIORITY_INTERACTIVE) is None
+
+def test_a_full_queue_is_upstream_saturation():
+    error = _shed(2, 2, [PRIORITY_INTERACTIVE, PRIORITY_INTERACTIVE], PRIORITY_INTERACTIVE)
+    assert type(error) is ServiceOverloadedError
+
+@pytest.mark.parametrize("error, status, code", [
+    (PriorityQuotaError("over quota", 3), 429, "PRIORITY_QUOTA_EXCEEDED"),
+    (ServiceOverloadedError("saturated", 3), 503, "SERVICE_OVERLOADED"),
+])
+def test_shed_requests_carry_retry_after(error, status, code):
+    response = asyncio.run(global_exception_handler(None, error))
+    assert response.status_code == status
+    assert response.headers["Retry-After"] == "3"
+    assert json.loads(response.body)["error"]["code"] == code
@@ -0,0 +1,71 @@
+import json
+import asyncio
+from fastapi.testclient import TestClient
+import app.services.generate as generate
+from app.handlers import LLMServiceError
+from app.main import app
+
+CLASSES = [{"className": "Customer", "attributes": [], "relationships": []}]
+DELAYS = {"CLASS": 0.05, "ERD": 0.0, "SEQUENCE": 0.02}
+
+def _batch(*diagram_types):
+    return {"requirementsText": "Customers place orders.", "classes": CLASSES,
+            "targets": [{"diagramType": diagram_type} for diagram_type in diagram_types]}
+
+def _fake_generation(monkeypatch) -> dict:
+    load = {"running": 0, "peak": 0}
+
+    async def fake_run_generation(gen_req, correlation_id, class_json=None):
+        load["running"] += 1
+        load["peak"] = max(load["peak"], load["running"])
+        try:
+            await asyncio.sleep(DELAYS.get(gen_req.diagramType.value, 0.0))
+        finally:
+            load["running"] -= 1
+        if gen_req.diagramType.value == "USE_CASE":
+            raise LLMServiceError("no use cases today")
+        return {"diagramCode": f"{gen_req.diagramType.value} for {class_json is not None}"}
+
+    monkeypatch.setattr(generate, "run_generation", fake_run_generation)
+    return load
+
+def _frames(body: str) -> list:
+    assert body.endswith("\n\n")
+    frames = []
+    for block in body[:-2].split("\n\n"):
+        event, data = block.split("\n")
+        frames.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return frames
+
+def test_stream_emits_results_as_they_finish_then_done(monkeypatch):
+    _fake_generation(monkeypatch)
+    response = TestClient(app).post("/generate/batch/stream", json=_batch("CLASS", "ERD", "SEQUENCE"))
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    frames = _frames(response.text)
+    assert [event for event, _ in frames] == ["result", "result", "result", "done"]
+    # completion order, with the index tying each result back to its target
+    assert [(data["index"], data["diagramType"]) for _, data in frames[:-1]] == [(1, "ERD"), (2, "SEQUENCE"), (0, "CLASS")]
+    assert all(data["status"] == "SUCCESS" and data["data"]["diagramCode"].endswith("True") for _, data in frames[:-1])
+    assert frames[-1][1]["correlation_id"]
+
+def test_buffered_batch_is_sorted_and_failures_stay_per_target(monkeypatch):
+    _fake_generation(monkeypatch)
+    response = TestClient(app).post("/generate/batch", json=_batch("CLASS", "USE_CASE", "ERD"))
+    assert response.status_code == 200
+    results = response.json()["data"]["results"]
+    assert [r["index"] for r in results] == [0, 1, 2]
+    assert [r["status"] for r in results] == ["SUCCESS", "FAILURE", "SUCCESS"]
+    assert results[1]["error"]["code"] == "LLM_PROVIDER_ERROR"
+    assert results[1]["data"] is None
+
+def test_fan_out_is_bounded_by_the_batch_concurrency(monkeypatch):
+    load = _fake_generation(monkeypatch)
+    monkeypatch.setattr(generate, "BATCH_MAX_CONCURRENCY", 2)
+    request = generate.BatchGenerateRequest(**_batch("CLASS", "ERD", "SEQUENCE", "CLASS", "ERD"))
+
+    async def collect():
+        return [result async for result in generate.run_batch_generation(request, "test")]
+
+    assert sorted(result["index"] for result in asyncio.run(collect())) == [0, 1, 2, 3, 4]
+    assert load["peak"] == 2
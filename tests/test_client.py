@@ -0,0 +1,24 @@
+import asyncio
+import httpx
+from app.kadalClient import CountingTransport, _connection_counts
+
+def test_counting_transport_tracks_requests_in_flight():
+    seen = []
+
+    async def main():
+        async def handler(request):
+            seen.append(counting.in_flight)
+            return httpx.Response(200, json={})
+
+        counting = CountingTransport(httpx.MockTransport(handler))
+        async with httpx.AsyncClient(transport=counting) as client:
+            await asyncio.gather(client.get("http://upstream/a"), client.get("http://upstream/b"))
+        return counting
+
+    counting = asyncio.run(main())
+    assert counting.in_flight == 0
+    assert counting.sent == 2
+    assert all(count >= 1 for count in seen)
+
+def test_connection_counts_degrade_when_pool_internals_change():
+    assert _connection_counts(None) == {"connections": "unavailable", "idle": "unavailable", "active": "unavailable"}
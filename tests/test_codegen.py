@@ -0,0 +1,96 @@
+import re
+import json
+import sqlite3
+import pytest
+from app.model import ClassModel
+from app.services.codegen import generate_database_code, generate_openapi_contract, schema_name, sql_identifier
+
+SQL = '''### SQL
+
+CREATE TABLE customer (
+    id INTEGER NOT NULL,
+    fullName VARCHAR(255) NOT NULL,
+    email VARCHAR(255),
+    PRIMARY KEY (id)
+);
+
+CREATE TABLE "order" (
+    id INTEGER NOT NULL,
+    placedAt TIMESTAMP NOT NULL,
+    customer_id INTEGER,
+    PRIMARY KEY (id)
+);
+
+CREATE TABLE order_line (
+    id BIGINT NOT NULL,
+    quantity INTEGER NOT NULL,
+    order_id INTEGER NOT NULL,
+    PRIMARY KEY (id)
+);
+
+ALTER TABLE "order" ADD CONSTRAINT fk_order_customer FOREIGN KEY (customer_id) REFERENCES customer (id);
+ALTER TABLE order_line ADD CONSTRAINT fk_order_line_order FOREIGN KEY (order_id) REFERENCES "order" (id) ON DELETE CASCADE;
+
+'''
+
+def _collections(code):
+    return {
+        match.group(1): json.loads(match.group(2))
+        for match in re.finditer(r'db\.createCollection\("(\w+)", (\{.*?\n\})\);', code, re.S)
+    }
+
+def test_sql_matches_golden_output(sample_classes):
+    sql, _ = generate_database_code(sample_classes).split("### NoSQL")
+    assert sql == SQL
+
+def test_create_tables_execute(sample_classes):
+    # sqlite has no ALTER TABLE ... ADD CONSTRAINT, so only the table definitions are run
+    tables = re.findall(r"CREATE TABLE .*?\);", generate_database_code(sample_classes), re.S)
+    with sqlite3.connect(":memory:") as db:
+        db.executescript("\n".join(tables))
+        assert {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")} == {"customer", "order", "order_line"}
+
+def test_mongo_validators_mirror_the_tables(sample_classes):
+    collections = _collections(generate_database_code(sample_classes))
+    assert list(collections) == ["customer", "order", "order_line"]
+    schema = collections["order_line"]["validator"]["$jsonSchema"]
+    assert schema["required"] == ["id", "quantity", "order_id"]
+    assert schema["properties"]["id"] == {"bsonType": "long"}
+    assert collections["order"]["validator"]["$jsonSchema"]["properties"]["placedAt"] == {"bsonType": "date"}
+
+def test_many_to_many_gets_a_join_table():
+    classes = [
+        ClassModel(className="Student", attributes=[], relationships=[
+            {"source": "Student", "target": "Course", "nature": "Association", "sourcetype": "Many", "targettype": "Many"}]),
+        ClassModel(className="Course", attributes=[], relationships=[]),
+    ]
+    code = generate_database_code(classes)
+    assert "CREATE TABLE student_course (" in code
+    assert "    PRIMARY KEY (student_id, course_id)" in code
+
+def test_openapi_contract_is_valid_yaml_with_safe_names(sample_classes):
+    yaml = pytest.importorskip("yaml")
+    document = yaml.safe_load(generate_openapi_contract(sample_classes))
+    assert document["openapi"] == "3.1.0"
+    assert list(document["components"]["schemas"]) == ["Customer", "Order", "OrderLine"]
+    assert list(document["paths"]) == ["/customers", "/customers/{id}", "/orders", "/orders/{id}", "/order-lines", "/order-lines/{id}"]
+    operation_ids = [op["operationId"] for path in document["paths"].values() for key, op in path.items() if key != "parameters"]
+    assert all(re.fullmatch(r"[A-Za-z0-9._-]+", op) for op in operation_ids)
+    assert document["paths"]["/order-lines"]["get"]["responses"]["200"]["content"]["application/json"]["schema"]["items"] == {
+        "$ref": "#/components/schemas/OrderLine"
+    }
+    assert document["components"]["schemas"]["Order"] == {
+        "type": "object",
+        "required": ["id", "placedAt"],
+        "properties": {
+            "id": {"type": "integer", "format": "int32"},
+            "placedAt": {"type": "string", "format": "date-time"},
+            "customer_id": {"type": "integer", "format": "int32"},
+        },
+    }
+
+def test_identifiers():
+    assert sql_identifier("order") == '"order"'
+    assert sql_identifier("order_line") == "order_line"
+    assert schema_name("order line") == "OrderLine"
+    assert schema_name("!!") == "Entity"
@@ -0,0 +1,78 @@
+import json
+import asyncio
+import app.services.extract as extract
+
+VALID = {"projectName": "Shop", "classes": [
+    {"className": "Order", "attributes": [{"name": "id", "type": "int", "nature": "Identifying", "required": True}], "relationships": []}
+]}
+
+def test_schema_errors_accepts_a_valid_project():
+    assert extract.schema_errors(json.dumps(VALID), "Shop") == []
+
+def test_schema_errors_reports_missing_fields():
+    broken = {"classes": [{"className": "Order", "attributes": [{"name": "id"}], "relationships": []}]}
+    errors = extract.schema_errors(json.dumps(broken), "Shop")
+    assert "classes.0.attributes.0.type: Field required" in errors
+
+def test_invalid_reply_is_retried_with_the_errors(monkeypatch):
+    replies = ['{"classes": [{"className": "Order"}]}', json.dumps(VALID)]
+    seen = []
+
+    async def fake_completion(messages, **kwargs):
+        seen.append(messages)
+        return replies[len(seen) - 1]
+
+    monkeypatch.setattr(extract, "get_chat_completion", fake_completion)
+    raw = asyncio.run(extract.request_project([{"role": "user", "content": "extract"}], "Shop", "test"))
+    assert json.loads(raw) == VALID
+    assert len(seen) == 2
+    assert seen[1][-2]["role"] == "assistant"
+    assert "classes.0.attributes: Field required" in seen[1][-1]["content"]
+
+def test_json_schema_falls_back_on_old_api_versions(monkeypatch):
+    monkeypatch.setattr(extract, "EXTRACT_RESPONSE_FORMAT", "json_schema")
+    monkeypatch.setattr(extract, "supports_structured_outputs", lambda: False)
+    assert extract.extract_response_format() == {"type": "json_object"}
+    monkeypatch.setattr(extract, "supports_structured_outputs", lambda: True)
+    assert extract.extract_response_format()["type"] == "json_schema"
+
+def _stream_events(monkeypatch, reply: str) -> list:
+    async def fake_stream(messages, **kwargs):
+        for i in range(0, len(reply), 16):
+            yield reply[i:i + 16]
+
+    monkeypatch.setattr(extract, "stream_chat_completion", fake_stream)
+
+    async def collect():
+        return [event async for event in extract.extract_structure_events("requirements", "Shop", "test")]
+
+    events = []
+    for frame in asyncio.run(collect()):
+        lines = frame.strip().splitlines()
+        events.append((lines[0].removeprefix("event: "), json.loads(lines[1].removeprefix("data: "))))
+    return events
+
+def _cls(name):
+    return {"className": name, "attributes": [], "relationships": []}
+
+def test_streamed_classes_match_the_final_parse(monkeypatch):
+    reply = json.dumps({"projectName": "Shop", "classes": [_cls("Order"), _cls("Customer")]})
+    events = _stream_events(monkeypatch, reply)
+    assert [name for name, _ in events] == ["class", "class", "done"]
+    assert [e["class"]["className"] for _, e in events[:2]] == ["Order", "Customer"]
+    assert [c["className"] for c in events[-1][1]["classes"]] == ["Order", "Customer"]
+
+def test_tail_repair_appends_classes_after_the_streamed_prefix(monkeypatch):
+    reply = json.dumps({"projectName": "Shop", "classes": [_cls("Order")]})[:-2] + ', {"className": "Customer", "attributes": [], "relationships": ['
+    events = _stream_events(monkeypatch, reply)
+    assert [(name, e.get("index")) for name, e in events] == [("class", 0), ("class", 1), ("done", None)]
+
+def test_diverging_final_parse_emits_a_correction(monkeypatch):
+    # a repeated key: the streaming parser saw the first list, the final parse keeps the last
+    reply = '{"projectName": "Shop", "classes": [%s, %s], "classes": [%s]}' % (
+        json.dumps(_cls("Order")), json.dumps(_cls("Customer")), json.dumps(_cls("Invoice"))
+    )
+    events = _stream_events(monkeypatch, reply)
+    assert [name for name, _ in events] == ["class", "class", "correction", "done"]
+    assert [c["className"] for c in events[2][1]["classes"]] == ["Invoice"]
+    assert [c["className"] for c in events[3][1]["classes"]] == ["Invoice"]
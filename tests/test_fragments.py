@@ -0,0 +1,42 @@
+from app.services.fragments import is_full_reply, select_fragment, splice_fragment
+
+CLASSES = ["Customer", "Order", "Invoice", "Product", "Warehouse", "Shipment"]
+CODE = "\n".join(
+    ["@startuml"]
+    + [line for name in CLASSES for line in (f"class {name} {{", f"  + id{name} : int", f"  - label{name} : str", "}")]
+    + ["Customer -- Order", "Order -- Invoice", "@enduml"]
+)
+
+def test_fragment_covers_the_named_class_with_context():
+    lines = CODE.splitlines()
+    start, end = select_fragment(CODE, "add a discount field to Warehouse")
+    assert "class Warehouse {" in lines[start:end]
+    assert start > 0 and end < len(lines) - 1
+
+def test_fragment_is_skipped_without_a_specific_target():
+    assert select_fragment(CODE, "make the diagram nicer") is None
+    assert select_fragment("@startuml\nclass A\n@enduml", "change A") is None
+
+def test_fragment_reply_is_spliced_in_place():
+    span = select_fragment(CODE, "add a discount field to Warehouse")
+    lines = CODE.splitlines()
+    fragment = lines[span[0]:span[1]]
+    edited = "\n".join(line + "\n  - discount : float" if line == "  - labelWarehouse : str" else line for line in fragment)
+    spliced = splice_fragment(CODE, span, edited)
+    assert spliced.count("class Warehouse {") == 1
+    assert spliced.count("class Customer {") == 1
+    assert "  - discount : float" in spliced
+    assert not is_full_reply(CODE, span, edited)
+
+def test_full_diagram_reply_with_a_header_replaces_everything():
+    span = select_fragment(CODE, "add a discount field to Warehouse")
+    full = CODE.replace("  - labelWarehouse : str", "  - labelWarehouse : str\n  - discount : float")
+    assert splice_fragment(CODE, span, full) == full
+
+def test_full_diagram_reply_without_a_header_is_not_duplicated():
+    span = select_fragment(CODE, "add a discount field to Warehouse")
+    body = CODE.replace("  - labelWarehouse : str", "  - labelWarehouse : str\n  - discount : float").splitlines()[1:-1]
+    spliced = splice_fragment(CODE, span, "\n".join(body))
+    assert spliced.count("class Customer {") == 1
+    assert spliced.count("class Warehouse {") == 1
+    assert "  - discount : float" in spliced
@@ -0,0 +1,77 @@
+from app.model import ClassModel
+from app.services.incremental import diff_classes, patch_diagram
+
+# hand-edited output: a note, a colour and a renamed label that a re-render would lose
+EDITED = """@startuml
+hide empty methods
+skinparam classBackgroundColor #EEF
+
+class "Order" as Order {
+  + id : int
+  - placed : Date
+}
+note right of Order : created at checkout
+
+class "Customer" as Customer {
+  + id : int
+}
+
+class "Invoice" as Invoice {
+  + number : str
+}
+
+Customer "1" -- "*" Order : places
+Order "1" -- "1" Invoice
+@enduml"""
+
+def _attr(name, type_="int", nature="Descriptive", required=False):
+    return {"name": name, "type": type_, "nature": nature, "required": required}
+
+def _rel(source, target, label=None, targettype="One"):
+    return {"source": source, "target": target, "nature": "Association", "sourcetype": "One", "targettype": targettype, "label": label}
+
+def _model(order_attrs, customer_rels=(), extra=()):
+    return [ClassModel(**cls) for cls in [
+        {"className": "Order", "attributes": order_attrs, "relationships": [_rel("Order", "Invoice")]},
+        {"className": "Customer", "attributes": [_attr("id", nature="Identifying", required=True)],
+         "relationships": list(customer_rels)},
+        {"className": "Invoice", "attributes": [_attr("number", "str", "Identifying", True)], "relationships": []},
+        *extra,
+    ]]
+
+OLD = _model([_attr("id", nature="Identifying", required=True), _attr("placed", "Date")],
+             [_rel("Customer", "Order", "places", "Many")])
+
+def test_patch_keeps_manual_edits():
+    new = _model([_attr("id", nature="Identifying", required=True), _attr("placed", "Date"), _attr("total", "float")],
+                 [_rel("Customer", "Order", "places", "Many")])
+    patched = patch_diagram(EDITED, diff_classes(OLD, new), "CLASS", "PLANTUML")
+    assert "note right of Order : created at checkout" in patched
+    assert "skinparam classBackgroundColor #EEF" in patched
+    order = patched[patched.index('class "Order"'):patched.index("note right")]
+    assert "total : float" in order
+
+def test_removed_class_takes_its_relationships_along():
+    new = [cls for cls in OLD if cls.className != "Invoice"]
+    new[0] = ClassModel(className="Order", attributes=new[0].attributes, relationships=[])
+    patched = patch_diagram(EDITED, diff_classes(OLD, new), "class", "plantuml")
+    assert "Invoice" not in patched
+    assert 'Customer "1" -- "*" Order : places' in patched
+    assert patched.endswith("@enduml")
+
+def test_added_class_and_relationship():
+    address = {"className": "Address", "attributes": [_attr("street", "str")], "relationships": []}
+    new = _model(OLD[0].model_dump()["attributes"],
+                 [_rel("Customer", "Order", "places", "Many"), _rel("Customer", "Address")], [address])
+    patched = patch_diagram(EDITED, diff_classes(OLD, new), "CLASS", "PLANTUML")
+    lines = patched.splitlines()
+    assert any(line.startswith('class "Address"') for line in lines)
+    assert lines.index('Order "1" -- "1" Invoice') < next(i for i, line in enumerate(lines) if "Address" in line and "--" in line)
+    assert lines[-1] == "@enduml"
+
+def test_unpatchable_text_returns_none():
+    new = _model([_attr("id", "str", "Identifying", True), _attr("placed", "Date")], [_rel("Customer", "Order", "places", "Many")])
+    delta = diff_classes(OLD, new)
+    # the attribute line cannot be found once the block is rewritten by hand
+    assert patch_diagram(EDITED.replace("+ id : int\n  - placed", "+ key : int\n  - placed"), delta, "CLASS", "PLANTUML") is None
+    assert patch_diagram(EDITED, delta, "SEQUENCE", "PLANTUML") is None
@@ -0,0 +1,52 @@
+from app.services.lint import fix_diagram, lint_diagram, DEACTIVATE_ISSUE
+
+SHORTHAND = """@startuml
+participant C
+participant S
+C -> S ++ : request
+alt cached
+  S --> C : hit
+  deactivate S
+else miss
+  S -> S : load
+  S --> C : result
+  deactivate S
+end
+@enduml"""
+
+def test_valid_shorthand_and_branch_deactivations_are_kept():
+    assert lint_diagram(SHORTHAND, "PLANTUML") == []
+    fixed, fixes = fix_diagram(SHORTHAND, "PLANTUML", "SEQUENCE")
+    assert fixed == SHORTHAND
+    assert fixes == []
+
+def test_return_and_explicit_activation_are_tracked():
+    code = "@startuml\nA -> B : call\nactivate B\nB -> C ++ : nested\nreturn done\ndeactivate B\n@enduml"
+    assert lint_diagram(code, "PLANTUML") == []
+
+def test_deactivate_of_inactive_participant_is_dropped():
+    code = "@startuml\nA -> B : call\ndeactivate B\n@enduml"
+    issues = lint_diagram(code, "PLANTUML")
+    assert [issue.message for issue in issues] == [DEACTIVATE_ISSUE]
+    fixed, fixes = fix_diagram(code, "PLANTUML", "SEQUENCE")
+    assert fixed == "@startuml\nA -> B : call\n@enduml"
+    assert fixes
+
+def test_plantuml_tags_and_open_blocks_are_repaired():
+    fixed, _ = fix_diagram("A -> B : call\nalt ok\nB --> A : done", "PLANTUML", "SEQUENCE")
+    assert fixed == "@startuml\nA -> B : call\nalt ok\nB --> A : done\nend\n@enduml"
+    assert lint_diagram(fixed, "PLANTUML") == []
+
+def test_separator_outside_entity_is_dropped_but_kept_inside():
+    code = '@startuml\nentity "A" as A {\n  * id : int\n  --\n  name : text\n}\n--\n@enduml'
+    fixed, _ = fix_diagram(code, "PLANTUML", "ERD")
+    assert fixed == code.replace("}\n--\n", "}\n")
+
+def test_mermaid_box_blocks_are_valid():
+    code = "sequenceDiagram\nbox Aqua Backend\n  participant A\n  participant B\nend\nA->>B: call"
+    assert lint_diagram(code, "MERMAID") == []
+    assert fix_diagram(code, "MERMAID", "SEQUENCE") == (code, [])
+
+def test_mermaid_header_and_tags_are_fixed():
+    fixed, _ = fix_diagram("@startuml\nclass A {\n  +String id\n}\n@enduml", "MERMAID", "CLASS")
+    assert fixed == "classDiagram\nclass A {\n  +String id\n}"
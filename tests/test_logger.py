@@ -0,0 +1,87 @@
+import io
+import sys
+import json
+import queue
+import logging
+from logging.handlers import QueueListener
+from pythonjsonlogger import jsonlogger
+from app.logger import (CorrelationIdFilter, InfoSamplingFilter, NonBlockingQueueHandler, correlation_id_ctx,
+                        logging_stats, LOG_SINKS)
+
+def _record(level=logging.INFO, correlation_id="req-1", msg="hello"):
+    record = logging.LogRecord("test", level, __file__, 1, msg, None, None)
+    record.correlation_id = correlation_id
+    return record
+
+def _pipeline(name, log_queue):
+    # the same wiring as get_logger, but with an in-memory JSON sink
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(NonBlockingQueueHandler(log_queue))
+    logger.addFilter(CorrelationIdFilter())
+    stream = io.StringIO()
+    sink = logging.StreamHandler(stream)
+    sink.setFormatter(jsonlogger.JsonFormatter('%(levelname)s %(message)s %(correlation_id)s'))
+    return logger, QueueListener(log_queue, sink), stream
+
+def test_records_cross_the_queue_resolved_and_tagged():
+    logger, listener, stream = _pipeline("test-pipeline", queue.Queue())
+    listener.start()
+    token = correlation_id_ctx.set("req-42")
+    try:
+        logger.info("generated %d diagrams", 3)
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logger.exception("failed")
+    finally:
+        correlation_id_ctx.reset(token)
+        listener.stop()
+    first, second = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert first == {"levelname": "INFO", "message": "generated 3 diagrams", "correlation_id": "req-42"}
+    assert second["correlation_id"] == "req-42"
+    assert "ValueError: boom" in second["exc_info"]
+
+def test_prepare_resolves_arguments_and_tracebacks():
+    handler = NonBlockingQueueHandler(queue.Queue())
+    try:
+        raise KeyError("missing")
+    except KeyError:
+        record = logging.LogRecord("test", logging.ERROR, __file__, 1, "lost %s", ("key",), sys.exc_info())
+    prepared = handler.prepare(record)
+    assert (prepared.msg, prepared.args, prepared.exc_info) == ("lost key", None, None)
+    assert "KeyError: 'missing'" in prepared.exc_text
+    # the caller's record is left alone for any other handler
+    assert record.args == ("key",) and record.exc_info is not None
+
+def test_a_full_queue_drops_instead_of_blocking():
+    handler = NonBlockingQueueHandler(queue.Queue(1))
+    for _ in range(3):
+        handler.handle(_record())
+    assert handler.queue.qsize() == 1
+    assert handler.dropped == 2
+
+def test_correlation_id_comes_from_the_context():
+    record = _record(correlation_id="stale")
+    token = correlation_id_ctx.set("req-7")
+    try:
+        assert CorrelationIdFilter().filter(record)
+    finally:
+        correlation_id_ctx.reset(token)
+    assert record.correlation_id == "req-7"
+
+def test_info_sampling_keeps_whole_requests_and_all_warnings():
+    none, half = InfoSamplingFilter(0.0), InfoSamplingFilter(0.5)
+    assert not none.filter(_record())
+    assert none.filter(_record(level=logging.WARNING))
+    assert none.filter(_record(correlation_id="system"))
+    assert InfoSamplingFilter(1.0).filter(_record())
+    decisions = {cid: half.filter(_record(correlation_id=cid)) for cid in (f"req-{i}" for i in range(200))}
+    assert all(half.filter(_record(correlation_id=cid, msg="later")) == kept for cid, kept in decisions.items())
+    assert 60 < sum(decisions.values()) < 140
+
+def test_logging_stats_describe_the_pipeline():
+    stats = logging_stats()
+    assert stats["sinks"] == sorted(LOG_SINKS)
+    assert stats["dropped"] >= 0 and stats["queued"] >= 0
@@ -0,0 +1,42 @@
+from app.services.merge import merge_class_models
+
+def _cls(name, attributes=(), relationships=()):
+    return {"className": name, "attributes": list(attributes), "relationships": list(relationships)}
+
+def _attr(name, type_="String", nature="Descriptive", required=False):
+    return {"name": name, "type": type_, "nature": nature, "required": required}
+
+def _rel(source, target, label=None, nature="Association", sourcetype="One", targettype="One"):
+    return {"source": source, "target": target, "nature": nature, "sourcetype": sourcetype, "targettype": targettype, "label": label}
+
+def _relationships(classes):
+    return sorted((r["source"], r["target"], r["label"]) for cls in classes for r in cls["relationships"])
+
+def test_distinct_labels_between_the_same_classes_are_kept():
+    merged = merge_class_models([
+        [_cls("Course", relationships=[_rel("Course", "Instructor", "taughtBy")]), _cls("Instructor")],
+        [_cls("Instructor", relationships=[_rel("Instructor", "Course", "coordinates")])],
+    ])
+    assert _relationships(merged) == [("Course", "Instructor", "taughtBy"), ("Instructor", "Course", "coordinates")]
+
+def test_same_relationship_from_two_sections_is_merged():
+    merged = merge_class_models([
+        [_cls("Order", relationships=[_rel("Order", "Customer", "placedBy")])],
+        [_cls("Orders", relationships=[_rel("Customer", "Order", "Placed by", nature="Aggregation", targettype="Many")])],
+        [_cls("Customer", relationships=[_rel("Order", "Customer")])],
+    ])
+    assert _relationships(merged) == [("Order", "Customer", "placedBy")]
+    rel = merged[0]["relationships"][0]
+    assert rel["nature"] == "Aggregation"
+    # reversed duplicate: its target side is this relationship's source side
+    assert rel["sourcetype"] == "Many" and rel["targettype"] == "One"
+
+def test_attributes_merge_by_normalized_name():
+    merged = merge_class_models([
+        [_cls("Student", [_attr("email", type_="string")])],
+        [_cls("students", [_attr("Email", type_="Email", nature="Identifying", required=True), _attr("name")])],
+    ])
+    assert len(merged) == 1
+    email, name = merged[0]["attributes"]
+    assert (email["type"], email["nature"], email["required"]) == ("Email", "Identifying", True)
+    assert name["name"] == "name"
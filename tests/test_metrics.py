@@ -0,0 +1,50 @@
+import re
+from fastapi.testclient import TestClient
+from app.main import app
+from app.metrics import Counter, Histogram, CONTENT_TYPE
+
+SAMPLE = re.compile(r'^(?P<name>[a-zA-Z_:][\w:]*)(?:\{(?P<labels>.*)\})? (?P<value>\S+)$')
+
+def _samples(lines):
+    return [SAMPLE.match(line).groupdict() for line in lines if not line.startswith("#")]
+
+def test_label_values_are_escaped():
+    counter = Counter("test_total", "Test.", ("endpoint",))
+    counter.inc(endpoint='a "quoted"\\path\nnext')
+    assert counter.render() == [
+        "# HELP test_total Test.",
+        "# TYPE test_total counter",
+        'test_total{endpoint="a \\"quoted\\"\\\\path\\nnext"} 1',
+    ]
+
+def test_missing_labels_render_as_none():
+    counter = Counter("test_total", "Test.", ("endpoint", "code"))
+    counter.inc(2.5, endpoint="/x")
+    assert counter.samples() == ['test_total{endpoint="/x",code="none"} 2.5']
+
+def test_histogram_buckets_are_cumulative_and_end_at_the_count():
+    histogram = Histogram("test_seconds", "Test.", ("endpoint",), buckets=(0.1, 1, 10))
+    for value in (0.05, 0.1, 0.5, 3, 30):
+        histogram.observe(value, endpoint="/x")
+    samples = _samples(histogram.samples())
+    buckets = [s for s in samples if s["name"] == "test_seconds_bucket"]
+    assert [s["labels"] for s in buckets] == [f'endpoint="/x",le="{le}"' for le in ("0.1", "1", "10", "+Inf")]
+    assert [int(s["value"]) for s in buckets] == [2, 3, 4, 5]
+    by_name = {s["name"]: s for s in samples}
+    assert by_name["test_seconds_count"]["value"] == "5"
+    assert float(by_name["test_seconds_sum"]["value"]) == 33.65
+    assert by_name["test_seconds_count"]["labels"] == 'endpoint="/x"'
+
+def test_metrics_endpoint_serves_the_text_format():
+    client = TestClient(app)
+    client.get("/stats")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == CONTENT_TYPE
+    lines = response.text.splitlines()
+    assert response.text.endswith("\n")
+    assert "# TYPE archie_requests_total counter" in lines
+    assert "# TYPE process_start_time_seconds gauge" in lines
+    assert any(line.startswith('archie_requests_total{endpoint="/stats"') for line in lines)
+    for line in lines:
+        assert line.startswith("#") or SAMPLE.match(line), line
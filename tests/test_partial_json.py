@@ -0,0 +1,34 @@
+import json
+from app.services.partial_json import ClassStreamParser, repair_json
+
+DOCUMENT = json.dumps({
+    "projectName": "Shop",
+    "classes": [
+        {"className": "Order", "attributes": [{"name": "note", "type": "str \\\"}]"}], "relationships": []},
+        {"className": "Customer", "attributes": [], "relationships": [{"source": "Customer", "target": "Order"}]},
+    ],
+})
+
+def test_stream_parser_emits_each_class_as_it_closes():
+    parser = ClassStreamParser()
+    items = []
+    for i in range(0, len(DOCUMENT), 7):
+        items.extend(parser.feed(DOCUMENT[i:i + 7]))
+    assert [item["className"] for item in items] == ["Order", "Customer"]
+
+def test_stream_parser_ignores_nested_classes_arrays():
+    parser = ClassStreamParser()
+    items = parser.feed('{"meta": {"classes": [{"className": "Nested"}]}, "classes": [{"className": "Top"}]}')
+    assert items == [{"className": "Top"}]
+
+def test_repair_parses_fenced_complete_json():
+    assert repair_json(f"```json\n{DOCUMENT}\n```") == json.loads(DOCUMENT)
+
+def test_repair_keeps_everything_before_the_cut():
+    truncated = DOCUMENT[:DOCUMENT.index('"target"') + 14]
+    repaired = repair_json(truncated)
+    assert [cls["className"] for cls in repaired["classes"]] == ["Order", "Customer"]
+    assert repaired["classes"][1]["relationships"] == [{"source": "Customer"}]
+
+def test_repair_gives_up_on_non_json():
+    assert repair_json("no json here") is None
@@ -0,0 +1,74 @@
+import os
+import sys
+import subprocess
+from app.model import ClassModel
+from app.services.partition import partition_classes, partition_names
+
+def _cls(name, *targets):
+    return ClassModel(className=name, attributes=[], relationships=[
+        {"source": name, "target": t, "nature": "Association", "sourcetype": "One", "targettype": "Many"} for t in targets
+    ])
+
+def _clusters(count, size):
+    # dense rings joined by a single relationship each, so the right cut is obvious
+    classes = []
+    for c in range(count):
+        names = [f"C{c}_{i}" for i in range(size)]
+        for i, name in enumerate(names):
+            targets = [names[(i + 1) % size], names[(i + 2) % size]]
+            if i == 0 and c + 1 < count:
+                targets.append(f"C{c + 1}_0")
+            classes.append(_cls(name, *targets))
+    return classes
+
+def _cut(classes, parts):
+    part_of = {name: i for i, part in enumerate(parts) for name in part}
+    return sum(1 for cls in classes for rel in cls.relationships if part_of[rel.source] != part_of[rel.target])
+
+def test_every_class_lands_in_exactly_one_part_within_the_limit():
+    classes = _clusters(4, 6)
+    parts = partition_names(classes, 8)
+    assert sorted(name for part in parts for name in part) == sorted(cls.className for cls in classes)
+    assert all(len(part) <= 8 for part in parts)
+
+def test_dense_clusters_are_kept_together():
+    classes = _clusters(4, 6)
+    parts = partition_names(classes, 6)
+    assert _cut(classes, parts) == 3
+    assert parts == [[f"C{c}_{i}" for i in range(6)] for c in range(4)]
+
+def test_unconnected_classes_are_packed_into_few_parts():
+    parts = partition_names([_cls(f"Lone{i}") for i in range(10)], 4)
+    assert sorted(len(part) for part in parts) == [2, 4, 4]
+
+def test_result_does_not_depend_on_hash_seed():
+    script = (
+        "import random; from tests.test_partition import _clusters; from app.services.partition import partition_names; "
+        "classes = _clusters(3, 7); random.Random(7).shuffle(classes); print(partition_names(classes, 8))"
+    )
+    outputs = {
+        subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True,
+                       env={**os.environ, "PYTHONHASHSEED": seed, "LOG_SINKS": "file"}).stdout
+        for seed in ("1", "2", "3")
+    }
+    assert len(outputs) == 1 and outputs.pop().startswith("[[")
+
+def test_partition_classes_splits_off_cross_relationships():
+    classes = _clusters(2, 4)
+    partitions, cross = partition_classes(classes, 4)
+    assert [len(p.classes) for p in partitions] == [4, 4]
+    assert [(rel.source, rel.target, a, b) for rel, a, b in cross] == [("C0_0", "C1_0", 0, 1)]
+    assert all(rel.target.startswith(p.classes[0].className[:2]) for p in partitions for cls in p.classes for rel in cls.relationships)
+
+def test_duplicate_class_names_are_merged_not_dropped():
+    first = _cls("Order", "Customer")
+    second = ClassModel(className=" Order ", attributes=[
+        {"name": "total", "type": "float", "nature": "Descriptive", "required": False}
+    ], relationships=[{"source": "Order", "target": "Invoice", "nature": "Association", "sourcetype": "One", "targettype": "One"}])
+    partitions, cross = partition_classes([first, _cls("Customer"), second, _cls("Invoice")], 2)
+    classes = [cls for p in partitions for cls in p.classes]
+    assert sorted(cls.className.strip() for cls in classes) == ["Customer", "Invoice", "Order"]
+    order = next(cls for cls in classes if cls.className == "Order")
+    assert [attr.name for attr in order.attributes] == ["total"]
+    targets = sorted(rel.target for rel in order.relationships) + sorted(rel.target for rel, _, _ in cross)
+    assert sorted(targets) == ["Customer", "Invoice"]
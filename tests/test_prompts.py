@@ -0,0 +1,21 @@
+from app.services.prompts import get_template, get_prompt_message
+
+def test_known_languages_use_their_own_rules():
+    system = get_prompt_message("CLASS", "requirements", "mermaid")[0]["content"]
+    assert "Mermaid" in system
+    assert "@startuml" in system and "NEVER use @startuml" in system
+
+def test_other_languages_are_passed_through_not_replaced():
+    system = get_prompt_message("CLASS", "requirements", "graphviz")[0]["content"]
+    assert "Generate a CLASS in GRAPHVIZ" in system
+    assert "expert in GRAPHVIZ" in system
+    # the language's own name is asked for, with the PlantUML class rules it has always borrowed
+    assert get_template("generate", "CLASS", "PLANTUML").system.split("STRICT SCHEMA MAPPING")[1].split("Constraint")[0] \
+        == system.split("STRICT SCHEMA MAPPING")[1].split("Constraint")[0]
+
+def test_templates_are_compiled_once():
+    assert get_template("refine", "COMPONENT", "graphviz") is get_template("refine", "COMPONENT", "Graphviz")
+
+def test_user_message_carries_only_the_variable_part():
+    messages = get_prompt_message("ERD", "the requirements", "PLANTUML")
+    assert messages[1] == {"role": "user", "content": "the requirements"}
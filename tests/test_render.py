@@ -0,0 +1,118 @@
+import pytest
+from app.services.lint import lint_diagram
+from app.services.render import alias, get_renderer
+
+CLASS_PLANTUML = """@startuml
+hide empty methods
+
+class "Customer" as Customer {
+  + id : int
+  - fullName : string
+  - email : string
+}
+
+class "Order" as Order {
+  + id : int
+  - placedAt : datetime
+}
+
+class "Order Line" as Order_Line {
+  - quantity : int
+}
+
+Customer "1" --> "*" Order : places
+Order "1" *-- "*" Order_Line
+@enduml"""
+
+CLASS_MERMAID = """classDiagram
+  class Customer {
+    +int id
+    -string fullName
+    -string email
+  }
+  class Order {
+    +int id
+    -datetime placedAt
+  }
+  class Order_Line {
+    -int quantity
+  }
+  Customer "1" --> "*" Order : places
+  Order "1" *-- "*" Order_Line"""
+
+ERD_PLANTUML = """@startuml
+skinparam linetype ortho
+hide circle
+hide methods
+
+entity "Customer" as Customer {
+  * **id** : int
+  --
+  fullName : string
+  email : string
+}
+
+entity "Order" as Order {
+  * **id** : int
+  --
+  placedAt : datetime
+}
+
+entity "Order Line" as Order_Line {
+  quantity : int
+}
+
+Customer ||--o{ Order : places
+Order ||--o{ Order_Line
+@enduml"""
+
+ERD_MERMAID = """flowchart TD
+  Customer[**Customer**]
+  PK_Customer_id([i̲d̲])
+  Customer --- PK_Customer_id
+  Attr_Customer_fullName([fullName])
+  Customer --- Attr_Customer_fullName
+  Attr_Customer_email([email])
+  Customer --- Attr_Customer_email
+  Order[**Order**]
+  PK_Order_id([i̲d̲])
+  Order --- PK_Order_id
+  Attr_Order_placedAt([placedAt])
+  Order --- Attr_Order_placedAt
+  Order_Line[[Order Line]]
+  Attr_Order_Line_quantity([quantity])
+  Order_Line --- Attr_Order_Line_quantity
+  Rel1{"places"}
+  Customer ---|1| Rel1 ---|M| Order
+  WeakRel2{{"relates"}}
+  Order ---|1| WeakRel2 ---|M| Order_Line
+  style Customer fill:#e1f5fe,stroke:#01579b,stroke-width:2px
+  style Order fill:#e1f5fe,stroke:#01579b,stroke-width:2px
+  style Order_Line fill:#fce4ec,stroke:#880e4f,stroke-width:4px,color:#000
+  style PK_Customer_id fill:#f5f5f5,stroke:#616161,stroke-width:1px
+  style Attr_Customer_fullName fill:#f5f5f5,stroke:#616161,stroke-width:1px
+  style Attr_Customer_email fill:#f5f5f5,stroke:#616161,stroke-width:1px
+  style PK_Order_id fill:#f5f5f5,stroke:#616161,stroke-width:1px
+  style Attr_Order_placedAt fill:#f5f5f5,stroke:#616161,stroke-width:1px
+  style Attr_Order_Line_quantity fill:#f5f5f5,stroke:#616161,stroke-width:1px
+  style Rel1 fill:#e8f5e9,stroke:#1b5e20,stroke-width:2px
+  style WeakRel2 fill:#fff9c4,stroke:#fbc02d,stroke-width:4px"""
+
+@pytest.mark.parametrize("diagram_type, language, expected", [
+    ("CLASS", "PLANTUML", CLASS_PLANTUML),
+    ("CLASS", "MERMAID", CLASS_MERMAID),
+    ("ERD", "PLANTUML", ERD_PLANTUML),
+    ("ERD", "MERMAID", ERD_MERMAID),
+])
+def test_renderers_match_golden_output_and_lint_clean(sample_classes, diagram_type, language, expected):
+    code = get_renderer(diagram_type, language)(sample_classes)
+    assert code == expected
+    assert lint_diagram(code, language) == []
+
+def test_renderer_lookup_is_case_insensitive_and_limited():
+    assert get_renderer("class", "mermaid") is get_renderer("CLASS", "MERMAID")
+    assert get_renderer("SEQUENCE", "PLANTUML") is None
+
+def test_aliases_are_valid_identifiers():
+    assert alias("Order Line") == "Order_Line"
+    assert alias(" 2FA Token ") == "_2FA_Token"
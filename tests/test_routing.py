@@ -0,0 +1,98 @@
+import asyncio
+import pytest
+import app.kadalClient as kadal
+import app.routing as routing
+from app.handlers import LLMServiceError
+from app.routing import ModelRouter, Route, parse_routes
+
+ROUTES = '[{"operation": "refine", "maxPromptTokens": 1500, "models": ["small"]}, {"operation": "refine", "model": "large"}]'
+
+def test_routes_are_matched_by_operation_and_prompt_size():
+    router = ModelRouter(parse_routes(ROUTES))
+    assert router.route("refine", 1000).models == ["small"]
+    assert router.route("refine", 2000).models == ["large"]
+    # an unknown size cannot satisfy a size cap
+    assert router.route("refine").models == ["large"]
+    assert router.route("generate", 10).models == [routing.LLM_MODEL]
+    assert router.needs_prompt_size("refine") and not router.needs_prompt_size("generate")
+
+def test_a_catch_all_route_is_always_present():
+    assert [r.describe() for r in parse_routes("")] == [{"operation": "*", "models": [routing.LLM_MODEL], "maxPromptTokens": None}]
+    capped = parse_routes('[{"operation": "*", "maxPromptTokens": 100, "models": ["small"]}]')
+    assert capped[-1].max_prompt_tokens is None
+
+def test_fastest_deployment_is_ranked_first(monkeypatch):
+    monkeypatch.setattr(routing, "ROUTE_EXPLORE_RATE", 0.0)
+    router = ModelRouter([Route("*", ["a", "b", "c"])])
+    for model, seconds in (("a", 3.0), ("b", 1.0)):
+        router.record("generate", model, seconds)
+    # unmeasured deployments go first so they get measured
+    assert router.rank(router.routes[0], "generate") == ["c", "b", "a"]
+
+def test_hedge_delay_needs_samples_and_is_clamped(monkeypatch):
+    monkeypatch.setattr(routing, "HEDGE_ENABLED", True)
+    monkeypatch.setattr(routing, "HEDGE_MIN_SAMPLES", 3)
+    monkeypatch.setattr(routing, "HEDGE_MIN_DELAY", 0.5)
+    router = ModelRouter([Route("*", ["a"])])
+    router.record("generate", "a", 0.1)
+    assert router.hedge_delay("generate", "a") is None
+    router.record("generate", "a", 0.1)
+    router.record("generate", "a", 0.2)
+    assert router.hedge_delay("generate", "a") == 0.5
+
+def test_hedges_are_capped_at_a_share_of_calls(monkeypatch):
+    monkeypatch.setattr(routing, "HEDGE_MAX_RATE", 0.1)
+    router = ModelRouter([Route("*", ["a"])])
+    router.calls, router.hedged = 10, 0
+    assert router.allow_hedge()
+    router.hedged = 1
+    assert not router.allow_hedge()
+
+@pytest.fixture
+def hedging(monkeypatch):
+    # every call is hedged after 10ms; each deployment answers after its own delay or fails
+    monkeypatch.setattr(routing, "HEDGE_ENABLED", True)
+    monkeypatch.setattr(routing, "HEDGE_MIN_SAMPLES", 1)
+    monkeypatch.setattr(routing, "HEDGE_MIN_DELAY", 0.01)
+    monkeypatch.setattr(routing, "HEDGE_MAX_DELAY", 0.01)
+    monkeypatch.setattr(routing, "HEDGE_MAX_RATE", 1.0)
+    router = ModelRouter([Route("*", ["primary", "backup"])])
+    router.record("generate", "primary", 0.01)
+    monkeypatch.setattr(kadal, "model_router", router)
+    behaviour = {}
+
+    async def fake_complete(messages, correlation_id, model, temperature, response_format, operation):
+        delay, error = behaviour[model]
+        await asyncio.sleep(delay)
+        if error:
+            raise LLMServiceError(f"{model} failed")
+        return model
+
+    monkeypatch.setattr(kadal, "_complete", fake_complete)
+
+    def run(**models):
+        behaviour.update(models)
+        return asyncio.run(kadal._hedged_complete([], "test", ["primary", "backup"], 0.7, None, "generate"))
+    return router, run
+
+def test_backup_wins_when_the_primary_is_slow(hedging):
+    router, run = hedging
+    assert run(primary=(0.5, False), backup=(0.01, False)) == "backup"
+    assert (router.hedged, router.hedges_won) == (1, 1)
+
+def test_primary_wins_without_a_hedge_when_fast(hedging):
+    router, run = hedging
+    assert run(primary=(0.0, False), backup=(0.0, False)) == "primary"
+    assert router.hedged == 0
+
+def test_both_failing_surfaces_the_primarys_error(hedging):
+    router, run = hedging
+    with pytest.raises(LLMServiceError, match="primary failed"):
+        run(primary=(0.05, True), backup=(0.02, True))
+    assert router.hedges_won == 0
+
+def test_no_hedge_past_the_rate_cap(hedging, monkeypatch):
+    router, run = hedging
+    monkeypatch.setattr(routing, "HEDGE_MAX_RATE", 0.0)
+    assert run(primary=(0.05, False), backup=(0.0, False)) == "primary"
+    assert router.hedged == 0
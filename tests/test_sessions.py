@@ -0,0 +1,56 @@
+import asyncio
+import pytest
+from pydantic import ValidationError
+from app.handlers import DiagramNotFoundError
+from app.model import RefineRequest
+from app.sessions import DiagramSession, DiagramStore, diagram_store
+from app.services.generate import resolve_refine_base
+
+def _refine(**fields):
+    return RefineRequest(diagramType="CLASS", userInstruction="rename", codeType="PLANTUML", **fields)
+
+def test_old_versions_are_trimmed_but_keep_their_numbers():
+    session = DiagramSession("d", "CLASS", "PLANTUML", True, ["v1"])
+    for code in ("v2", "v3", "v4"):
+        session.append(code, max_versions=2)
+    assert session.version == 4
+    assert session.code() == "v4"
+    assert session.code(3) == "v3"
+    assert session.code(2) is None
+
+def test_sessions_survive_a_restart_through_the_disk_tier(tmp_path):
+    path = str(tmp_path / "sessions.sqlite3")
+
+    async def main():
+        store = DiagramStore(10, 5, 60, path)
+        session = await store.create("CLASS", "PLANTUML", True, "v1", classes=[{"className": "A"}])
+        await store.append(session, "v2")
+        reloaded = await DiagramStore(10, 5, 60, path).get(session.diagram_id)
+        return reloaded.version, reloaded.code(1), reloaded.classes
+
+    assert asyncio.run(main()) == (2, "v1", [{"className": "A"}])
+
+def test_refine_base_defaults_to_the_latest_version():
+    async def main():
+        session = await diagram_store.create("CLASS", "PLANTUML", True, "v1")
+        await diagram_store.append(session, "v2")
+        latest = await resolve_refine_base(_refine(diagramId=session.diagram_id))
+        first = await resolve_refine_base(_refine(diagramId=session.diagram_id, baseVersion=1))
+        with pytest.raises(DiagramNotFoundError):
+            await resolve_refine_base(_refine(diagramId=session.diagram_id, baseVersion=3))
+        return latest[1:], first[1:]
+
+    assert asyncio.run(main()) == ((2, "v2"), (1, "v1"))
+
+def test_client_edits_become_a_new_version():
+    async def main():
+        session = await diagram_store.create("CLASS", "PLANTUML", True, "v1")
+        _, version, code = await resolve_refine_base(_refine(diagramId=session.diagram_id, diagramCode="edited"))
+        return version, code, session.code(1)
+
+    assert asyncio.run(main()) == (2, "edited", "v1")
+
+@pytest.mark.parametrize("version", [0, -1])
+def test_base_version_must_be_positive(version):
+    with pytest.raises(ValidationError):
+        _refine(diagramId="d", baseVersion=version)
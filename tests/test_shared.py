@@ -0,0 +1,93 @@
+import asyncio
+import time
+import pytest
+import app.shared as shared
+from app.shared import MemoryBackend, SQLiteBackend, SharedBackend, shared_lock
+
+def _run(coro):
+    return asyncio.run(coro)
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        yield MemoryBackend(100)
+    else:
+        store = SQLiteBackend(str(tmp_path / "shared.sqlite3"), 100, 5)
+        yield store
+        _run(store.close())
+
+def test_backend_contract_is_abstract():
+    with pytest.raises(TypeError):
+        SharedBackend()
+
+def test_values_round_trip_until_their_ttl(backend):
+    async def main():
+        await backend.set("k", "v", 60)
+        await backend.set("short", "v", 0.05)
+        assert await backend.get("k") == "v"
+        assert await backend.get("missing") is None
+        await asyncio.sleep(0.1)
+        assert await backend.get("short") is None
+        assert await backend.get("k") == "v"
+    _run(main())
+
+def test_lock_is_exclusive_until_released_by_its_owner(backend):
+    async def main():
+        assert await backend.acquire("lock", "a", 60)
+        assert not await backend.acquire("lock", "b", 60)
+        await backend.release("lock", "b")
+        assert not await backend.acquire("lock", "b", 60)
+        await backend.release("lock", "a")
+        assert await backend.acquire("lock", "b", 60)
+    _run(main())
+
+def test_lock_expires_when_its_owner_dies(backend):
+    async def main():
+        assert await backend.acquire("lock", "a", 0.05)
+        await asyncio.sleep(0.1)
+        assert await backend.acquire("lock", "b", 60)
+        # the expired owner can no longer release the new holder's lock
+        await backend.release("lock", "a")
+        assert not await backend.acquire("lock", "c", 60)
+    _run(main())
+
+def test_memory_backend_drops_the_oldest_write():
+    async def main():
+        store = MemoryBackend(2)
+        for key in ("a", "b", "c"):
+            await store.set(key, key, 60)
+        assert [await store.get(key) for key in ("a", "b", "c")] == [None, "b", "c"]
+    _run(main())
+
+def test_shared_lock_waits_for_a_holder_on_another_connection(tmp_path, monkeypatch):
+    path = str(tmp_path / "shared.sqlite3")
+    worker_a, worker_b = SQLiteBackend(path, 100, 5), SQLiteBackend(path, 100, 5)
+    monkeypatch.setattr(shared, "shared_backend", worker_b)
+
+    async def main():
+        lock_key = f"{shared.KEY_PREFIX}lock:key"
+        assert await worker_a.acquire(lock_key, "a", 60)
+        asyncio.get_running_loop().call_later(0.1, lambda: asyncio.ensure_future(worker_a.release(lock_key, "a")))
+        started = time.monotonic()
+        async with shared_lock("key", 5) as waited:
+            assert waited
+            assert time.monotonic() - started >= 0.1
+            assert not await worker_a.acquire(lock_key, "a", 60)
+        assert await worker_a.acquire(lock_key, "a", 60)
+    try:
+        _run(main())
+    finally:
+        _run(worker_a.close())
+        _run(worker_b.close())
+
+def test_shared_lock_gives_up_after_its_wait(monkeypatch):
+    store = MemoryBackend(100)
+    monkeypatch.setattr(shared, "shared_backend", store)
+
+    async def main():
+        assert await store.acquire(f"{shared.KEY_PREFIX}lock:key", "other", 60)
+        timed_out = shared.lock_stats.timed_out
+        async with shared_lock("key", 0.05) as waited:
+            assert waited
+        assert shared.lock_stats.timed_out == timed_out + 1
+    _run(main())
@@ -0,0 +1,85 @@
+from app.cache import cache_bypass_ctx
+from app.model import GenerateRequest, RenderMode
+from app.similarity import RequestFingerprint, SimilarityCache
+
+TEXT = (
+    "A library lends books to members. Each member can borrow up to five books at a time, "
+    "and every loan records the date it was taken out and the date it is due back at the desk."
+)
+RESULT = {"diagramCode": "@startuml\n@enduml", "renderMode": RenderMode.llm}
+
+def _cls(name, *targets):
+    return {
+        "className": name,
+        "attributes": [{"name": "id", "type": "int", "nature": "Identifying", "required": True}],
+        "relationships": [
+            {"source": name, "target": t, "nature": "Association", "sourcetype": "One", "targettype": "Many"}
+            for t in targets
+        ],
+    }
+
+def _fp(text=TEXT, classes=None, code_type="PLANTUML"):
+    classes = classes if classes is not None else [_cls("Member", "Loan"), _cls("Loan", "Book"), _cls("Book")]
+    return RequestFingerprint(GenerateRequest(diagramType="CLASS", codeType=code_type, requirementsText=text, classes=classes))
+
+def _cache(max_entries=8, ttl=60.0):
+    return SimilarityCache(max_entries, ttl, 16, 4, 3)
+
+def test_canonical_duplicate_is_an_exact_hit():
+    cache = _cache()
+    cache.store(_fp(), RESULT)
+    reordered = _fp(text="  " + TEXT.upper(), classes=[_cls("Book"), _cls("Loan", "Book"), _cls("Member", "Loan")],
+                    code_type=" plantuml")
+    assert cache.lookup(reordered, 0.9) == (RESULT, 1.0)
+
+def test_near_duplicate_text_is_a_similar_hit():
+    cache = _cache()
+    cache.store(_fp(), RESULT)
+    result, score = cache.lookup(_fp(text=TEXT + " Overdue loans are flagged."), 0.5)
+    assert result is RESULT
+    assert 0.5 <= score < 1.0
+    assert cache.stats()["similarHits"] == 1
+
+def test_threshold_above_the_score_misses():
+    cache = _cache()
+    cache.store(_fp(), RESULT)
+    assert cache.lookup(_fp(text=TEXT + " Overdue loans are flagged."), 1.0) is None
+
+def test_different_scope_never_matches():
+    cache = _cache()
+    cache.store(_fp(), RESULT)
+    assert cache.lookup(_fp(code_type="MERMAID"), 0.0) is None
+    assert cache.lookup(_fp(classes=[_cls("Member"), _cls("Book")]), 0.0) is None
+
+def test_only_complete_llm_results_are_stored():
+    cache = _cache()
+    cache.store(_fp(), {**RESULT, "renderMode": RenderMode.deterministic})
+    cache.store(_fp(), {**RESULT, "degraded": True})
+    assert cache.stats()["entries"] == 0
+
+def test_least_recently_used_entry_is_evicted():
+    cache = _cache(max_entries=2)
+    first, second, third = _fp(text="first " + TEXT), _fp(text="second " + TEXT), _fp(text="third " + TEXT)
+    cache.store(first, RESULT)
+    cache.store(second, RESULT)
+    cache.lookup(first, 1.0)
+    cache.store(third, RESULT)
+    assert cache.lookup(first, 1.0) is not None
+    assert cache.lookup(second, 1.0) is None
+    assert not any(key == second.key for bucket in cache._buckets.values() for key in bucket)
+
+def test_expired_entries_are_not_served():
+    cache = _cache(ttl=-1.0)
+    cache.store(_fp(), RESULT)
+    assert cache.lookup(_fp(), 0.9) is None
+    assert cache.stats()["entries"] == 0
+
+def test_cache_bypass_skips_the_lookup():
+    cache = _cache()
+    cache.store(_fp(), RESULT)
+    token = cache_bypass_ctx.set(True)
+    try:
+        assert cache.lookup(_fp(), 0.9) is None
+    finally:
+        cache_bypass_ctx.reset(token)
+    assert cache.stats()["bypassed"] == 1
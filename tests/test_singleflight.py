@@ -0,0 +1,72 @@
+import time
+import asyncio
+from app.admission import priority_ctx, PRIORITY_BATCH, PRIORITY_INTERACTIVE
+from app.cache import cache_bypass_ctx
+from app.deadline import deadline_ctx, REQUEST_TIMEOUT_SECONDS
+from app.logger import correlation_id_ctx
+from app.singleflight import SingleFlight
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def main():
+        return await asyncio.gather(flight.do("key", fn), flight.do("key", fn))
+
+    assert asyncio.run(main()) == ["result", "result"]
+    assert len(calls) == 1
+    assert flight.stats()["coalesced"] == 1
+
+def test_cache_bypass_skips_coalescing():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    async def bypassing():
+        cache_bypass_ctx.set(True)
+        return await flight.do("key", fn)
+
+    async def main():
+        return await asyncio.gather(flight.do("key", fn), asyncio.create_task(bypassing()))
+
+    asyncio.run(main())
+    assert len(calls) == 2
+    assert flight.stats()["bypassed"] == 1
+
+def _shared_context(deadline, priority):
+    flight = SingleFlight("test")
+    seen = {}
+
+    async def fn():
+        seen.update(deadline=deadline_ctx.get(), priority=priority_ctx.get(), correlation_id=correlation_id_ctx.get())
+
+    async def caller():
+        deadline_ctx.set(deadline)
+        priority_ctx.set(priority)
+        correlation_id_ctx.set("leader")
+        await flight.do("key", fn)
+        # the caller keeps its own context
+        return deadline_ctx.get(), priority_ctx.get()
+
+    assert asyncio.run(caller()) == (deadline, priority)
+    return seen
+
+def test_shared_call_gets_a_bounded_deadline_of_its_own():
+    now = time.monotonic()
+    seen = _shared_context(now + 1, PRIORITY_BATCH)
+    assert now + REQUEST_TIMEOUT_SECONDS <= seen["deadline"] <= time.monotonic() + REQUEST_TIMEOUT_SECONDS
+    assert _shared_context(now + 10 * REQUEST_TIMEOUT_SECONDS, PRIORITY_BATCH)["deadline"] == now + 10 * REQUEST_TIMEOUT_SECONDS
+
+def test_shared_call_runs_at_interactive_priority_under_its_own_tag():
+    seen = _shared_context(None, PRIORITY_BATCH)
+    assert seen["priority"] == PRIORITY_INTERACTIVE
+    assert seen["correlation_id"] == "leader:shared"
@@ -0,0 +1,58 @@
+import json
+from fastapi.testclient import TestClient
+import app.streaming as streaming
+from app.handlers import LLMServiceError
+from app.main import app
+
+REQUEST = {
+    "diagramType": "CLASS", "codeType": "PLANTUML", "requirementsText": "Customers place orders.", "renderMode": "llm",
+    "classes": [{"className": "Customer", "attributes": [], "relationships": []}],
+}
+REPLY = ["```plantuml\n@start", "uml\nclass Customer\n", "@enduml\n```"]
+
+def _frames(body: str) -> list:
+    # every frame is exactly one event line and one data line, terminated by a blank line
+    assert body.endswith("\n\n")
+    frames = []
+    for block in body[:-2].split("\n\n"):
+        event, data = block.split("\n")
+        assert event.startswith("event: ") and data.startswith("data: ")
+        frames.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return frames
+
+def _stream(monkeypatch, deltas, error=None, body=REQUEST):
+    async def fake_stream(messages, **kwargs):
+        for delta in deltas:
+            yield delta
+        if error is not None:
+            raise error
+
+    monkeypatch.setattr(streaming, "stream_chat_completion", fake_stream)
+    response = TestClient(app).post("/generate/stream", json=body)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.headers["cache-control"] == "no-cache"
+    return _frames(response.text)
+
+def test_tokens_are_framed_and_stripped_then_done(monkeypatch):
+    frames = _stream(monkeypatch, REPLY)
+    events = [event for event, _ in frames]
+    assert events[-1] == "done" and set(events[:-1]) == {"token"}
+    streamed = "".join(data["delta"] for event, data in frames if event == "token")
+    done = frames[-1][1]
+    assert streamed.strip() == done["diagramCode"] == "@startuml\nclass Customer\n@enduml"
+    assert done["renderMode"] == "llm" and done["correlation_id"]
+
+def test_upstream_failure_ends_the_stream_with_an_error_event(monkeypatch):
+    frames = _stream(monkeypatch, REPLY[:1], error=LLMServiceError("upstream went away"))
+    assert [event for event, _ in frames] == ["token", "error"]
+    error = frames[-1][1]
+    assert error["code"] == "LLM_PROVIDER_ERROR"
+    assert error["message"] == "upstream went away"
+    assert error["correlation_id"]
+
+def test_deterministic_render_is_a_single_token(monkeypatch):
+    frames = _stream(monkeypatch, [], body={**REQUEST, "renderMode": "deterministic"})
+    assert [event for event, _ in frames] == ["token", "done"]
+    assert frames[0][1]["delta"] == frames[1][1]["diagramCode"]
+    assert frames[1][1]["renderMode"] == "deterministic"
@@ -0,0 +1,57 @@
+import json
+import pytest
+import app.kadalClient as kadal
+import app.services.tokens as tokens
+import app.services.generate as generate
+from app.handlers import PromptTooLargeError
+from app.model import ClassEncoding
+from app.services.encoding import DSL_LEGEND, encode_classes
+
+DSL = DSL_LEGEND + """
+Customer: #id:int!, fullName:string!, ?email:string
+ Customer>Order A 1:M places
+Order: #id:int!, placedAt:datetime!
+ Order>Order Line C 1:M
+Order Line: quantity:int!"""
+
+@pytest.fixture
+def estimated(monkeypatch):
+    # the word-piece estimate is what runs when tiktoken is not installed
+    monkeypatch.setattr(tokens, "_encoder", None)
+
+def test_estimate_counts_word_pieces_and_punctuation(estimated):
+    assert tokens.count_tokens("") == 0
+    assert tokens.count_tokens("hello world") == 4
+    assert tokens.count_tokens("CustomerOrder  x\n  y") == 8
+    assert tokens.count_tokens("a1{}") == 4
+    assert tokens.PromptStats().stats()["exact"] is False
+
+def test_messages_carry_framing_overhead(estimated):
+    messages = [{"role": "system", "content": "hello world"}, {"role": "user", "content": None}]
+    assert tokens.count_message_tokens(messages) == 4 + 4 + 4 + 2
+
+def test_prompts_over_budget_are_rejected(estimated, monkeypatch):
+    messages = [{"role": "user", "content": "word " * 50}]
+    monkeypatch.setattr(kadal, "prompt_stats", tokens.PromptStats())
+    monkeypatch.setattr(kadal, "MAX_PROMPT_TOKENS", 0)
+    assert kadal.check_prompt_budget(messages, "test") == 56
+    monkeypatch.setattr(kadal, "MAX_PROMPT_TOKENS", 50)
+    with pytest.raises(PromptTooLargeError, match="56 tokens"):
+        kadal.check_prompt_budget(messages, "test")
+    assert kadal.prompt_stats.stats()["rejected"] == 1
+    assert kadal.prompt_stats.stats()["maxPromptTokens"] == 56
+
+def test_dsl_encoding_matches_golden_output(sample_classes):
+    assert encode_classes(sample_classes, ClassEncoding.dsl) == DSL
+
+def test_encodings_shrink_the_prompt_without_losing_the_model(sample_classes, estimated):
+    full = encode_classes(sample_classes, ClassEncoding.json)
+    compact = encode_classes(sample_classes, ClassEncoding.compact)
+    assert json.loads(compact) == json.loads(full)
+    sizes = [tokens.count_tokens(encode_classes(sample_classes, e)) for e in (ClassEncoding.json, ClassEncoding.compact, ClassEncoding.dsl)]
+    assert sizes == sorted(sizes, reverse=True)
+
+def test_request_encoding_overrides_the_configured_default(sample_classes, monkeypatch):
+    monkeypatch.setattr(generate, "CLASS_ENCODING", "dsl")
+    assert generate.serialize_classes(sample_classes) == DSL
+    assert json.loads(generate.serialize_classes(sample_classes, ClassEncoding.compact))[0]["className"] == "Customer"